@@ -0,0 +1,72 @@
+"""
+Route import throughput in routes/sec: one ``POST /routes`` per route versus
+``POST /routes/bulk`` with a JSON:API array or NDJSON.
+
+    $ python -m benchmarks.bulk_import --db_url=postgresql://...
+"""
+import argparse
+import time
+
+from tornado import escape, httpclient
+from tornado.ioloop import IOLoop
+
+from benchmarks.common import free_port, spawn_app, run_load
+from benchmarks.concurrency import route_document
+
+
+async def single(base_url, documents, concurrency):
+    bodies = [escape.json_encode(d) for d in documents]
+    summary = await run_load(
+        lambda n: httpclient.HTTPRequest(base_url + '/routes', method='POST',
+                                         body=bodies[n], request_timeout=300),
+        len(bodies), concurrency)
+    return summary['elapsed']
+
+
+async def bulk(base_url, documents, ndjson):
+    if ndjson:
+        body = '\n'.join(escape.json_encode(d) for d in documents)
+        content_type = 'application/x-ndjson'
+    else:
+        body = escape.json_encode({'data': [d['data'] for d in documents]})
+        content_type = 'application/vnd.api+json'
+    client = httpclient.AsyncHTTPClient(force_instance=True)
+    started = time.time()
+    await client.fetch(
+        base_url + '/routes/bulk', method='POST', body=body,
+        headers={'Content-Type': content_type}, request_timeout=3600)
+    elapsed = time.time() - started
+    client.close()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--db_url', required=True)
+    parser.add_argument('--routes', type=int, default=5000)
+    parser.add_argument('--points', type=int, default=200,
+                        help='Polyline points per route')
+    parser.add_argument('--concurrency', type=int, default=10,
+                        help='Parallel requests of the single-route import')
+    args = parser.parse_args()
+
+    documents = [route_document(args.points) for _ in range(args.routes)]
+    port = free_port()
+    with spawn_app(port, db_url=args.db_url):
+        base_url = 'http://127.0.0.1:%d' % port
+        runs = (
+            ('POST /routes', lambda: single(base_url, documents,
+                                            args.concurrency)),
+            ('POST /routes/bulk JSON:API', lambda: bulk(base_url, documents,
+                                                        ndjson=False)),
+            ('POST /routes/bulk NDJSON', lambda: bulk(base_url, documents,
+                                                      ndjson=True)),
+        )
+        for name, run in runs:
+            elapsed = IOLoop.current().run_sync(run)
+            print('%-28s %6d routes  %7.2fs  %8.1f routes/s' % (
+                name, len(documents), elapsed, len(documents) / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""
+Load test for coalescing of identical directions lookups: N concurrent
+identical ``AsyncClient.directions()`` calls must make exactly one request
+to the (fake) Google server, and every caller must get its own result.
+
+    $ python -m benchmarks.coalescing --requests=100
+"""
+import argparse
+import time
+
+from tornado import gen
+from tornado.ioloop import IOLoop
+
+from benchmarks.common import FAKE_GOOGLE_KEY, free_port
+from benchmarks.fake_google import make_app
+from core.google import AsyncClient
+
+
+async def run(args):
+    port = free_port()
+    fake_google = make_app(latency=args.latency)
+    server = fake_google.listen(port, address='127.0.0.1')
+    client = AsyncClient(key=FAKE_GOOGLE_KEY,
+                         base_url='http://127.0.0.1:%d' % port)
+
+    started = time.time()
+    results = await gen.multi([
+        client.directions('50.45,30.52', '50.40,30.60', mode='driving')
+        for _ in range(args.requests)
+    ])
+    elapsed = time.time() - started
+    server.stop()
+
+    stats = fake_google.stats
+    print('%d concurrent calls, %d upstream requests, %.1fms' % (
+        args.requests, stats['requests'], elapsed * 1000))
+    assert stats['requests'] == 1, stats
+    assert len(set(id(r) for r in results)) == args.requests
+    assert all(r == results[0] for r in results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.2)
+    args = parser.parse_args()
+    IOLoop.current().run_sync(lambda: run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""
+Helpers shared by the benchmark scripts: spawning the application and the
+fake Google server, and a small concurrent HTTP load generator.
+"""
+import os
+import socket
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+
+from tornado import gen, httpclient
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKE_GOOGLE_KEY = 'AIzaFakeBenchmarkKey'
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def wait_for_port(port, timeout=15):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError('Nothing is listening on port %d' % port)
+
+
+@contextmanager
+def spawn(args, port):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    process = subprocess.Popen([sys.executable] + args, cwd=ROOT, env=env)
+    try:
+        wait_for_port(port)
+        yield process
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def spawn_app(port, **options):
+    args = [os.path.join(ROOT, 'app.py'), '--port=%d' % port,
+            '--google_maps_api_key=%s' % FAKE_GOOGLE_KEY]
+    args += ['--%s=%s' % (k, v) for k, v in sorted(options.items())]
+    return spawn(args, port)
+
+
+def spawn_fake_google(port, latency=0.0, jitter=0.0, error_rate=0.0,
+                      points=0, certfile=None, keyfile=None):
+    args = [os.path.join(ROOT, 'benchmarks', 'fake_google.py'),
+            '--port=%d' % port, '--latency=%s' % latency,
+            '--jitter=%s' % jitter, '--error-rate=%s' % error_rate,
+            '--points=%d' % points]
+    if certfile:
+        args += ['--certfile=%s' % certfile, '--keyfile=%s' % keyfile]
+    return spawn(args, port)
+
+
+def process_memory(pid):
+    """Resident set size and its peak in KB from ``/proc``, None where
+    there is no ``/proc``"""
+    try:
+        with open('/proc/%d/status' % pid) as f:
+            fields = dict(line.split(':', 1) for line in f if ':' in line)
+    except OSError:
+        return None
+    return {'rss_kb': int(fields['VmRSS'].split()[0]),
+            'peak_rss_kb': int(fields['VmHWM'].split()[0])}
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1,
+                int(round(q / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(latencies, elapsed, errors=0):
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'elapsed': elapsed,
+        'rps': len(latencies) / elapsed if elapsed else None,
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+    }
+
+
+async def run_load(make_request, total, concurrency, client=None):
+    """Issues ``total`` requests built by ``make_request(i)`` keeping
+    ``concurrency`` of them in flight. Returns a ``summarize()`` dict.
+    """
+    own_client = client is None
+    if own_client:
+        client = httpclient.AsyncHTTPClient(force_instance=True,
+                                            max_clients=concurrency)
+    latencies = []
+    errors = [0]
+    counter = iter(range(total))
+
+    async def worker():
+        for i in counter:
+            request = make_request(i)
+            started = time.time()
+            try:
+                await client.fetch(request)
+            except httpclient.HTTPError:
+                errors[0] += 1
+            latencies.append(time.time() - started)
+
+    started = time.time()
+    await gen.multi([worker() for _ in range(concurrency)])
+    elapsed = time.time() - started
+    if own_client:
+        client.close()
+    return summarize(latencies, elapsed, errors[0])
+
+
+def format_summary(name, summary):
+    return ('%-32s %7d req  %8.1f req/s  p50 %7.1fms  p95 %7.1fms  '
+            'p99 %7.1fms  errors %d' % (
+                name, summary['requests'], summary['rps'] or 0,
+                (summary['p50'] or 0) * 1000, (summary['p95'] or 0) * 1000,
+                (summary['p99'] or 0) * 1000, summary['errors']))
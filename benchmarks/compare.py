@@ -0,0 +1,55 @@
+"""
+Compares two ``benchmarks.suite`` result files, e.g. of two commits.
+Exits with status 1 when throughput drops or p95 latency grows by more
+than ``--threshold`` percent in any case both files have.
+
+    $ python -m benchmarks.compare base.json new.json --threshold 10
+"""
+import argparse
+import json
+import sys
+
+
+def load(path):
+    with open(path) as f:
+        report = json.load(f)
+    return report, {(r['rows'], r['profile'], r['concurrency']): r
+                    for r in report['results']}
+
+
+def change(old, new):
+    if not old or new is None:
+        return None
+    return 100.0 * (new - old) / old
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('base')
+    parser.add_argument('new')
+    parser.add_argument('--threshold', type=float, default=10.0,
+                        help='Regression threshold, percent')
+    args = parser.parse_args()
+
+    base_report, base = load(args.base)
+    new_report, new = load(args.new)
+    print('%s -> %s' % ((base_report.get('commit') or args.base)[:10],
+                        (new_report.get('commit') or args.new)[:10]))
+    regressions = 0
+    for key in sorted(set(base) & set(new)):
+        old, current = base[key], new[key]
+        rps = change(old['rps'], current['rps'])
+        p95 = change(old['p95'], current['p95'])
+        rss = change(old.get('rss_kb'), current.get('rss_kb'))
+        regressed = ((rps is not None and rps < -args.threshold) or
+                     (p95 is not None and p95 > args.threshold))
+        regressions += regressed
+        print('%8d rows %-18s c%-3d  req/s %+7.1f%%  p95 %+7.1f%%  '
+              'rss %+7.1f%%%s' % (key + (rps or 0, p95 or 0, rss or 0,
+                                         '  REGRESSION' if regressed
+                                         else '')))
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+CPU time and bytes saved by compressing route documents: per request at
+several gzip levels and brotli qualities (when ``brotli`` is installed),
+versus serving the document stored compressed at insert time, which costs
+no compression per request.
+
+    $ python -m benchmarks.compression --points 1000 10000 100000
+"""
+import argparse
+import random
+import timeit
+import uuid
+from datetime import datetime, timezone
+
+from tornado import escape
+
+from benchmarks.serialization import st_asgeojson, spliced_dumps
+from core import compression
+
+LEVELS = [('gzip', 1), ('gzip', compression.GZIP_LEVEL), ('gzip', 9)]
+if compression.brotli is not None:
+    LEVELS += [('br', 1), ('br', compression.BROTLI_QUALITY), ('br', 9),
+               ('br', 11)]
+
+
+def make_row(points):
+    """Route along a random walk, like a real polyline every point is
+    close to the previous one"""
+    lng, lat = random.uniform(-180, 180), random.uniform(-85, 85)
+    coordinates = []
+    for _ in range(points):
+        lng += random.uniform(-0.0005, 0.0005)
+        lat += random.uniform(-0.0005, 0.0005)
+        coordinates.append((lng, lat))
+    return {
+        'id': str(uuid.uuid4()),
+        'origin': st_asgeojson('Point', coordinates[0]),
+        'origin_name': 'Origin',
+        'destination': st_asgeojson('Point', coordinates[-1]),
+        'destination_name': 'Destination',
+        'waypoints': None,
+        'waypoints_names': None,
+        'polyline': st_asgeojson('LineString', coordinates),
+        'bounds': None,
+        'created': datetime.now(timezone.utc),
+    }
+
+
+def make_compressor(encoding, level):
+    if encoding == 'br':
+        return compression._Brotli(level)
+    return compression._Gzip(level)
+
+
+def run(points, repeat):
+    body = escape.utf8(spliced_dumps(make_row(points)))
+    print('%d points, %d KB document' % (points, len(body) // 1024))
+    print('  %-8s %8s %8s %10s' % ('encoding', 'KB', 'saved', 'ms/request'))
+    for encoding, level in LEVELS:
+        compressed = make_compressor(encoding, level).compress(body, True)
+        seconds = timeit.timeit(
+            lambda: make_compressor(encoding, level).compress(body, True),
+            number=repeat) / repeat
+        print('  %-8s %8d %7.1f%% %10.2f' % (
+            '%s-%d' % (encoding, level), len(compressed) // 1024,
+            100.0 * (1 - len(compressed) / len(body)), seconds * 1000))
+    print('  %-8s %8s %8s %10.2f' % ('stored', '', '', 0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--points', type=int, nargs='+',
+                        default=[1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    for points in args.points:
+        run(points, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
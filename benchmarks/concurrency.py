@@ -0,0 +1,97 @@
+"""
+Concurrent ``GET /routes`` and ``GET /directions`` throughput with DB calls
+made inline on the IOLoop versus on the DB executor.
+
+    $ python -m benchmarks.concurrency --db_url=postgresql://...
+
+Needs a PostGIS database; the fake Google server is started automatically.
+"""
+import argparse
+import random
+
+from tornado import escape, gen, httpclient
+from tornado.ioloop import IOLoop
+
+from benchmarks.common import (free_port, spawn_app, spawn_fake_google,
+                               run_load, format_summary)
+
+
+def route_document(points=200, stops=0):
+    lng, lat = random.uniform(30, 31), random.uniform(50, 51)
+    coordinates = [[lng + i * 0.0001, lat + i * 0.0001] for i in range(points)]
+    attributes = {
+        'origin': {'type': 'Point', 'coordinates': coordinates[0]},
+        'origin-name': 'Origin',
+        'destination': {'type': 'Point', 'coordinates': coordinates[-1]},
+        'destination-name': 'Destination',
+        'polyline': {'type': 'LineString', 'coordinates': coordinates},
+    }
+    if stops:
+        attributes['waypoints'] = {'type': 'MultiPoint', 'coordinates': [
+            coordinates[(i + 1) * (points - 1) // (stops + 1)]
+            for i in range(stops)]}
+        attributes['waypoints-names'] = ['Stop %d' % i for i in range(stops)]
+    return {'data': {'type': 'routes', 'attributes': attributes}}
+
+
+async def seed(base_url, count):
+    client = httpclient.AsyncHTTPClient(force_instance=True, max_clients=20)
+    await gen.multi([
+        client.fetch(base_url + '/routes', method='POST',
+                     body=escape.json_encode(route_document()))
+        for _ in range(count)
+    ])
+    client.close()
+
+
+async def measure(base_url, args):
+    def routes_request(i):
+        return httpclient.HTTPRequest(base_url + '/routes',
+                                      request_timeout=120)
+
+    def directions_request(i):
+        return httpclient.HTTPRequest(
+            base_url + '/directions?origin=50.45,30.52'
+                       '&destination=50.40,30.60',
+            request_timeout=120)
+
+    routes, directions = await gen.multi([
+        run_load(routes_request, args.requests, args.concurrency),
+        run_load(directions_request, args.requests, args.concurrency),
+    ])
+    return routes, directions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--db_url', required=True)
+    parser.add_argument('--seed', type=int, default=500,
+                        help='Routes to insert before measuring')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--google-latency', type=float, default=0.05)
+    args = parser.parse_args()
+
+    google_port = free_port()
+    with spawn_fake_google(google_port, latency=args.google_latency):
+        for name, workers in (('inline', 0), ('executor', None)):
+            port = free_port()
+            options = {
+                'db_url': args.db_url,
+                'google_maps_base_url': 'http://127.0.0.1:%d' % google_port,
+            }
+            if workers is not None:
+                options['db_executor_workers'] = workers
+            with spawn_app(port, **options):
+                base_url = 'http://127.0.0.1:%d' % port
+                if args.seed and name == 'inline':
+                    IOLoop.current().run_sync(
+                        lambda: seed(base_url, args.seed))
+                routes, directions = IOLoop.current().run_sync(
+                    lambda: measure(base_url, args))
+            print(format_summary('%s GET /routes' % name, routes))
+            print(format_summary('%s GET /directions' % name, directions))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""
+``POST /routes`` latency percentiles under concurrent load, optionally
+with every request retried with the same ``Idempotency-Key``.
+
+    $ python -m benchmarks.create_latency --db_url=postgresql://...
+"""
+import argparse
+import uuid
+
+from tornado import escape, httpclient
+from tornado.ioloop import IOLoop
+
+from benchmarks.common import free_port, spawn_app, run_load, format_summary
+from benchmarks.concurrency import route_document
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--db_url', required=True)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, nargs='+',
+                        default=[1, 10, 50])
+    parser.add_argument('--points', type=int, default=200,
+                        help='Polyline points per route')
+    parser.add_argument('--retries', action='store_true',
+                        help='Send every request twice with the same '
+                             'Idempotency-Key')
+    args = parser.parse_args()
+
+    bodies = [escape.json_encode(route_document(args.points))
+              for _ in range(args.requests)]
+    copies = 2 if args.retries else 1
+    port = free_port()
+    with spawn_app(port, db_url=args.db_url):
+        url = 'http://127.0.0.1:%d/routes' % port
+        for concurrency in args.concurrency:
+            keys = [str(uuid.uuid4()) for _ in bodies]
+
+            def make_request(n):
+                n //= copies
+                return httpclient.HTTPRequest(
+                    url, method='POST', body=bodies[n], request_timeout=120,
+                    headers={'Idempotency-Key': keys[n]})
+
+            summary = IOLoop.current().run_sync(lambda: run_load(
+                make_request, len(bodies) * copies, concurrency))
+            print(format_summary('concurrency %d' % concurrency, summary))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+"""
+Local stand-in for the Google Maps Directions and Distance Matrix APIs.
+
+    $ python benchmarks/fake_google.py --port=9090 --latency=0.05
+
+Point the application at it with
+``--google_maps_base_url=http://127.0.0.1:9090``.
+"""
+import argparse
+import math
+import random
+
+from tornado import gen, web
+from tornado.ioloop import IOLoop
+
+from core import polyline
+
+# Example polyline from Google's encoded polyline algorithm documentation
+SAMPLE_POLYLINE = '_p~iF~ps|U_ulLnnqC_mqNvxq`@'
+
+
+def parse_latlng(value, default):
+    try:
+        lat, lng = (float(v) for v in value.split(','))
+    except (AttributeError, ValueError):
+        return default
+    return {'lat': lat, 'lng': lng}
+
+
+def make_polyline(start, end, points):
+    """Wiggly line of ``points`` points from ``start`` to ``end``"""
+    line = [(start['lat'], start['lng'])]
+    for i in range(1, points - 1):
+        t = i / (points - 1)
+        line.append((
+            start['lat'] + (end['lat'] - start['lat']) * t +
+            random.uniform(-0.0002, 0.0002),
+            start['lng'] + (end['lng'] - start['lng']) * t +
+            random.uniform(-0.0002, 0.0002)))
+    line.append((end['lat'], end['lng']))
+    return polyline.encode(line)
+
+
+def make_route(origin, destination, points=0):
+    start = parse_latlng(origin, {'lat': 38.5, 'lng': -120.2})
+    end = parse_latlng(destination, {'lat': 43.252, 'lng': -126.453})
+    overview = (make_polyline(start, end, points) if points > 1
+                else SAMPLE_POLYLINE)
+    return {
+        'bounds': {
+            'northeast': {'lat': max(start['lat'], end['lat']),
+                          'lng': max(start['lng'], end['lng'])},
+            'southwest': {'lat': min(start['lat'], end['lat']),
+                          'lng': min(start['lng'], end['lng'])},
+        },
+        'copyrights': 'Fake data',
+        'legs': [{
+            'distance': {'text': '1 km', 'value': 1000},
+            'duration': {'text': '1 min', 'value': 60},
+            'start_address': origin,
+            'start_location': start,
+            'end_address': destination,
+            'end_location': end,
+            'steps': [],
+            'via_waypoint': [],
+        }],
+        'overview_polyline': {'points': overview},
+        'summary': 'Fake route',
+        'warnings': [],
+        'waypoint_order': [],
+    }
+
+
+def make_element(origin, destination):
+    start = parse_latlng(origin, {'lat': 0.0, 'lng': 0.0})
+    end = parse_latlng(destination, {'lat': 0.0, 'lng': 0.0})
+    # Straight line distance in metres at 50 km/h, good enough for a fake
+    distance = int(111320 * math.hypot(end['lat'] - start['lat'],
+                                       end['lng'] - start['lng']))
+    return {
+        'status': 'OK',
+        'distance': {'text': '%d m' % distance, 'value': distance},
+        'duration': {'text': 'Fake', 'value': int(distance / 13.9)},
+    }
+
+
+class FakeHandler(web.RequestHandler):
+    def initialize(self, stats, latency, jitter, error_rate, points):
+        self.stats = stats
+        self.points = points
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+
+    async def delay(self):
+        """Sleeps for the response latency. Returns False if the request
+        should fail."""
+        self.stats['requests'] += 1
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay:
+            await gen.sleep(delay)
+        if self.error_rate and random.random() < self.error_rate:
+            self.stats['errors'] += 1
+            return False
+        return True
+
+
+class DirectionsHandler(FakeHandler):
+    async def get(self):
+        if not await self.delay():
+            self.finish({'status': 'OVER_QUERY_LIMIT', 'routes': []})
+            return
+        origin = self.get_query_argument('origin')
+        destination = self.get_query_argument('destination')
+        self.finish({
+            'status': 'OK',
+            'geocoded_waypoints': [],
+            'routes': [make_route(origin, destination, self.points)],
+        })
+
+
+class DistanceMatrixHandler(FakeHandler):
+    async def get(self):
+        if not await self.delay():
+            self.finish({'status': 'OVER_QUERY_LIMIT', 'rows': []})
+            return
+        origins = self.get_query_argument('origins').split('|')
+        destinations = self.get_query_argument('destinations').split('|')
+        self.finish({
+            'status': 'OK',
+            'origin_addresses': origins,
+            'destination_addresses': destinations,
+            'rows': [{'elements': [make_element(o, d) for d in destinations]}
+                     for o in origins],
+        })
+
+
+class StatsHandler(web.RequestHandler):
+    def initialize(self, stats):
+        self.stats = stats
+
+    def get(self):
+        self.finish(self.stats)
+
+    def delete(self):
+        for key in self.stats:
+            self.stats[key] = 0
+        self.set_status(204)
+
+
+def make_app(latency=0.0, jitter=0.0, error_rate=0.0, points=0):
+    stats = {'requests': 0, 'errors': 0}
+    settings = {'stats': stats, 'latency': latency, 'jitter': jitter,
+                'error_rate': error_rate, 'points': points}
+    app = web.Application([
+        (r'/maps/api/directions/json', DirectionsHandler, settings),
+        (r'/maps/api/distancematrix/json', DistanceMatrixHandler, settings),
+        (r'/stats', StatsHandler, {'stats': stats}),
+    ])
+    app.stats = stats
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9090)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Base response latency, seconds')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='Random extra latency up to this many seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='Share of OVER_QUERY_LIMIT responses')
+    parser.add_argument('--points', type=int, default=0,
+                        help='Overview polyline points of routes, 0 is a '
+                             'short sample polyline')
+    parser.add_argument('--certfile', help='Serve HTTPS with this '
+                                           'certificate')
+    parser.add_argument('--keyfile')
+    args = parser.parse_args()
+
+    app = make_app(args.latency, args.jitter, args.error_rate, args.points)
+    ssl_options = None
+    if args.certfile:
+        ssl_options = {'certfile': args.certfile, 'keyfile': args.keyfile}
+    app.listen(args.port, address=args.host, ssl_options=ssl_options)
+    IOLoop.current().start()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Fills the ``route`` table with synthetic routes, generated inside PostGIS so
+millions of rows take minutes rather than hours.
+
+    $ python -m benchmarks.generate_routes --db_url=postgresql://... \\
+        --count=1000000
+"""
+import argparse
+import time
+
+from sqlalchemy import create_engine, text
+
+import models
+
+# Version 4 UUIDs from md5(), so generated routes match UUID4_PATTERN
+INSERT = text('''
+WITH points AS (
+    SELECT i,
+           :min_lng + random() * (:max_lng - :min_lng) AS lng,
+           :min_lat + random() * (:max_lat - :min_lat) AS lat,
+           (random() - 0.5) * :span AS dlng,
+           (random() - 0.5) * :span AS dlat
+    FROM generate_series(:first, :last) AS i
+), lines AS (
+    SELECT i, ST_SetSRID(ST_MakeLine(ARRAY(
+        SELECT ST_MakePoint(
+            lng + dlng * k / (:points - 1) + (random() - 0.5) * :noise,
+            lat + dlat * k / (:points - 1) + (random() - 0.5) * :noise)
+        FROM generate_series(0, :points - 1) AS k
+    )), 4326) AS line
+    FROM points
+)
+INSERT INTO route (id, origin, origin_name, destination, destination_name,
+                   polyline, polyline_z6, polyline_z10, polyline_z14,
+                   waypoints, bbox, created)
+SELECT uuid_in(overlay(overlay(md5(random()::text || i::text)
+                               PLACING '4' FROM 13)
+                       PLACING '8' FROM 17)::cstring),
+       geography(ST_StartPoint(line)), 'Origin ' || i,
+       geography(ST_EndPoint(line)), 'Destination ' || i,
+       geography(line),
+       geography(ST_SimplifyPreserveTopology(line, :tolerance_z6)),
+       geography(ST_SimplifyPreserveTopology(line, :tolerance_z10)),
+       geography(ST_SimplifyPreserveTopology(line, :tolerance_z14)),
+       CASE WHEN :stops > 0 THEN geography(ST_Collect(ARRAY(
+           SELECT ST_LineInterpolatePoint(line, k::float / (:stops + 1))
+           FROM generate_series(1, :stops) AS k
+       ))) END,
+       ST_Envelope(line),
+       now() - i * interval '1 second'
+FROM lines
+''')
+
+
+def generate(engine, count, points=10, region=(-10, 35, 30, 60), span=0.5,
+             batch_size=100000, first=1, log=print, stops=0):
+    """Inserts ``count`` routes of ``points`` vertices and ``stops``
+    waypoints with origins in the ``(min_lng, min_lat, max_lng, max_lat)``
+    region"""
+    min_lng, min_lat, max_lng, max_lat = region
+    params = {
+        'min_lng': min_lng, 'min_lat': min_lat,
+        'max_lng': max_lng, 'max_lat': max_lat,
+        'span': span, 'noise': span / points, 'points': max(points, 2),
+        'stops': stops,
+    }
+    for zoom in models.SIMPLIFIED_ZOOM_LEVELS:
+        params['tolerance_z%d' % zoom] = models.simplify_tolerance(zoom)
+
+    started = time.time()
+    for batch_first in range(first, first + count, batch_size):
+        batch_last = min(batch_first + batch_size, first + count) - 1
+        with engine.begin() as connection:
+            connection.execute(INSERT, first=batch_first, last=batch_last,
+                               **params)
+        log('%d routes, %.1fs' % (batch_last - first + 1,
+                                  time.time() - started))
+    with engine.begin() as connection:
+        connection.execute('ANALYZE route')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--db_url', required=True)
+    parser.add_argument('--count', type=int, default=10000)
+    parser.add_argument('--points', type=int, default=10,
+                        help='Polyline vertices per route')
+    parser.add_argument('--region', type=float, nargs=4,
+                        default=[-10, 35, 30, 60],
+                        metavar=('MIN_LNG', 'MIN_LAT', 'MAX_LNG', 'MAX_LAT'))
+    parser.add_argument('--span', type=float, default=0.5,
+                        help='Maximum route extent, degrees')
+    parser.add_argument('--stops', type=int, default=0,
+                        help='Waypoints per route')
+    parser.add_argument('--truncate', action='store_true',
+                        help='Delete existing routes first')
+    args = parser.parse_args()
+
+    engine = create_engine(args.db_url)
+    models.init_db(engine)
+    if args.truncate:
+        with engine.begin() as connection:
+            connection.execute('TRUNCATE route CASCADE')
+    generate(engine, args.count, points=args.points, region=args.region,
+             span=args.span, stops=args.stops)
+
+
+if __name__ == '__main__':
+    main()
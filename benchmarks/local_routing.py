@@ -0,0 +1,123 @@
+"""
+Latency of directions from the local road graph engine against Google,
+stubbed by the fake Google server with the given latency. Runs both
+in-process on a synthetic grid city.
+
+    $ python -m benchmarks.local_routing --size=200 --latency=0.15
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+from tornado import gen
+from tornado.ioloop import IOLoop
+
+from benchmarks.common import FAKE_GOOGLE_KEY, free_port, summarize, \
+    format_summary
+from benchmarks.fake_google import make_app
+from core.google import AsyncClient
+from core.routing import LocalRouter, RoadGraph
+
+# Grid node spacing, degrees (about 100m)
+SPACING = 0.001
+ORIGIN = (50.40, 30.45)
+SPEEDS = (30, 30, 30, 50, 70)
+
+
+def write_grid_graph(path, size):
+    """Writes a ``size`` x ``size`` street grid in the JSON graph format"""
+    lat0, lng0 = ORIGIN
+    nodes = [[lat0 + i * SPACING, lng0 + j * SPACING]
+             for i in range(size) for j in range(size)]
+    edges = []
+    for i in range(size):
+        for j in range(size):
+            node = i * size + j
+            if j + 1 < size:
+                edges.append([node, node + 1, random.choice(SPEEDS),
+                              'Street %d' % i, False])
+            if i + 1 < size:
+                edges.append([node, node + size, random.choice(SPEEDS),
+                              'Avenue %d' % j, random.random() < 0.1])
+    with open(path, 'w') as f:
+        json.dump({'nodes': nodes, 'edges': edges}, f)
+
+
+def random_location(size):
+    lat0, lng0 = ORIGIN
+    return '%.6f,%.6f' % (lat0 + random.uniform(0, size - 1) * SPACING,
+                          lng0 + random.uniform(0, size - 1) * SPACING)
+
+
+async def measure(backend, queries, concurrency):
+    latencies = []
+    errors = [0]
+    pending = iter(queries)
+
+    async def worker():
+        for origin, destination in pending:
+            started = time.time()
+            try:
+                routes = await backend.directions(origin, destination,
+                                                  mode='driving')
+                if not routes:
+                    errors[0] += 1
+            except Exception:
+                errors[0] += 1
+            latencies.append(time.time() - started)
+
+    started = time.time()
+    await gen.multi([worker() for _ in range(concurrency)])
+    return summarize(latencies, time.time() - started, errors[0])
+
+
+async def run(args):
+    fd, path = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    try:
+        write_grid_graph(path, args.size)
+        started = time.time()
+        graph = RoadGraph.load(path)
+        print('%d nodes graph loaded in %.2fs' % (
+            len(graph), time.time() - started))
+    finally:
+        os.remove(path)
+
+    queries = [(random_location(args.size), random_location(args.size))
+               for _ in range(args.requests)]
+    local = LocalRouter(graph)
+
+    port = free_port()
+    fake_google = make_app(latency=args.latency, jitter=args.jitter)
+    server = fake_google.listen(port, address='127.0.0.1')
+    # No cache and a generous rate limit, every query goes upstream
+    google = AsyncClient(key=FAKE_GOOGLE_KEY,
+                         base_url='http://127.0.0.1:%d' % port,
+                         queries_per_second=10000)
+
+    for concurrency in args.concurrency:
+        print(format_summary('local c=%d' % concurrency,
+                             await measure(local, queries, concurrency)))
+        print(format_summary('stubbed google c=%d' % concurrency,
+                             await measure(google, queries, concurrency)))
+    server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size', type=int, default=200,
+                        help='Grid side, nodes')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 10])
+    parser.add_argument('--latency', type=float, default=0.15,
+                        help='Fake Google response latency, seconds')
+    parser.add_argument('--jitter', type=float, default=0.05)
+    args = parser.parse_args()
+    IOLoop.current().run_sync(lambda: run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+``GET /matrix`` latency and upstream requests, cold and with the matrix
+cache warm, against the fake Google server. Also compares the memory of
+the array-backed ``core.matrix.Matrix`` with a dict of cells.
+
+    $ python -m benchmarks.matrix --db_url=postgresql://... --sizes 10 100
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+from tornado import httpclient, escape
+from tornado.ioloop import IOLoop
+
+from benchmarks.common import free_port, spawn_app, spawn_fake_google
+from core.matrix import Matrix
+
+
+def locations(count):
+    return ['%.5f,%.5f' % (random.uniform(50.3, 50.6),
+                           random.uniform(30.3, 30.7))
+            for _ in range(count)]
+
+
+def memory(size):
+    origins = destinations = locations(size)
+    matrix = Matrix(origins, destinations)
+    for i in range(size):
+        for j in range(size):
+            matrix.set(i, j, random.randint(0, 10000),
+                       random.randint(0, 100000))
+    array_bytes = (sys.getsizeof(matrix.durations) +
+                   sys.getsizeof(matrix.distances))
+
+    cells = {(o, d): {'duration': random.randint(0, 10000),
+                      'distance': random.randint(0, 100000)}
+             for o in origins for d in destinations}
+    dict_bytes = sys.getsizeof(cells) + sum(
+        sys.getsizeof(k) + sys.getsizeof(v) for k, v in cells.items())
+    print('%dx%d matrix: arrays %d KB, dict of cells %d KB' % (
+        size, size, array_bytes // 1024, dict_bytes // 1024))
+
+
+async def fetch_matrix(client, base_url, google_url, origins, destinations):
+    await client.fetch(google_url + '/stats', method='DELETE')
+    started = time.time()
+    response = await client.fetch(
+        '%s/matrix?origins=%s&destinations=%s' % (
+            base_url, '|'.join(origins), '|'.join(destinations)),
+        request_timeout=300)
+    elapsed = time.time() - started
+    stats = escape.json_decode(
+        (await client.fetch(google_url + '/stats')).body)
+    meta = escape.json_decode(response.body)['meta']
+    return elapsed, meta['fetched'], stats['requests']
+
+
+async def run(args, base_url, google_url):
+    client = httpclient.AsyncHTTPClient()
+    for size in args.sizes:
+        origins = destinations = locations(size)
+        for name in ('cold', 'warm'):
+            elapsed, fetched, upstream = await fetch_matrix(
+                client, base_url, google_url, origins, destinations)
+            print('%3dx%-3d %s  %8.1fms  %5d cells fetched  '
+                  '%4d upstream requests' % (size, size, name,
+                                             elapsed * 1000, fetched,
+                                             upstream))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--db_url', required=True)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 50, 100])
+    parser.add_argument('--latency', type=float, default=0.1,
+                        help='Fake Google response latency, seconds')
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        memory(size)
+
+    google_port = free_port()
+    port = free_port()
+    cache_dir = tempfile.mkdtemp()
+    google_url = 'http://127.0.0.1:%d' % google_port
+    with spawn_fake_google(google_port, latency=args.latency), \
+            spawn_app(port, db_url=args.db_url,
+                      google_maps_base_url=google_url,
+                      google_queries_per_second=1000, google_burst=100,
+                      matrix_cache_file=os.path.join(cache_dir, 'matrix')):
+        IOLoop.current().run_sync(lambda: run(
+            args, 'http://127.0.0.1:%d' % port, google_url))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+Payload size and latency of ``core.polyline`` encoded polylines
+against GeoJSON coordinate arrays.
+
+    $ python -m benchmarks.polyline --points 1000 50000
+"""
+import argparse
+import json
+import random
+import timeit
+
+from benchmarks.serialization import pg_double
+from core import polyline
+
+
+def make_coordinates(points):
+    lng, lat = random.uniform(-180, 180), random.uniform(-85, 85)
+    coordinates = []
+    for _ in range(points):
+        lng += random.uniform(-0.001, 0.001)
+        lat += random.uniform(-0.001, 0.001)
+        coordinates.append([lng, lat])
+    return coordinates
+
+
+def geojson_text(coordinates, digits=15):
+    return '{"type":"LineString","coordinates":[%s]}' % ','.join(
+        '[%s,%s]' % (pg_double(x, digits), pg_double(y, digits))
+        for x, y in coordinates)
+
+
+def timed(fn, repeat):
+    return min(timeit.repeat(fn, number=1, repeat=repeat)) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--points', type=int, nargs='+',
+                        default=[1000, 50000])
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    for points in args.points:
+        coordinates = make_coordinates(points)
+        full = geojson_text(coordinates)
+        reduced = geojson_text(coordinates, 6)
+        encoded = polyline.from_geojson(coordinates)
+        print('%6d points  geojson %9d B  geojson precision=6 %9d B  '
+              'encoded %9d B (%.1fx smaller)' % (
+                  points, len(full), len(reduced), len(encoded),
+                  len(full) / float(len(encoded))))
+        print('%6d points  encode %7.2fms  decode %7.2fms  '
+              'json.loads %7.2fms' % (
+                  points,
+                  timed(lambda: polyline.from_geojson(coordinates),
+                        args.repeat),
+                  timed(lambda: polyline.to_geojson(encoded), args.repeat),
+                  timed(lambda: json.loads(full), args.repeat)))
+
+
+if __name__ == '__main__':
+    main()
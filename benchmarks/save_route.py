@@ -0,0 +1,98 @@
+"""
+Saving a ``GET /directions`` result as a route: the client converting the
+overview polyline to GeoJSON and posting the geometry back, versus
+posting the result's token. Reports request bytes and latency per saved
+route.
+
+    $ python -m benchmarks.save_route --db_url=postgresql://... \
+        --points 100 1000 10000
+"""
+import argparse
+import time
+
+from tornado import escape, httpclient
+from tornado.ioloop import IOLoop
+
+from benchmarks.common import free_port, spawn_app, spawn_fake_google
+from core import polyline
+
+
+def geojson_document(route):
+    """``POST /routes`` document a client builds from a directions route"""
+    legs = route['legs']
+    start, end = legs[0]['start_location'], legs[-1]['end_location']
+    return {'data': {'type': 'routes', 'attributes': {
+        'origin': {'type': 'Point', 'coordinates': [start['lng'],
+                                                    start['lat']]},
+        'origin-name': legs[0]['start_address'],
+        'destination': {'type': 'Point', 'coordinates': [end['lng'],
+                                                         end['lat']]},
+        'destination-name': legs[-1]['end_address'],
+        'polyline': {'type': 'LineString', 'coordinates': polyline.to_geojson(
+            route['overview_polyline']['points'])},
+        'bounds': route['bounds'],
+    }}}
+
+
+def token_document(token):
+    return {'data': {'type': 'routes',
+                     'attributes': {'directions-token': token}}}
+
+
+async def save(client, base_url, index, by_token):
+    origin = '50.%04d,30.4' % index
+    response = await client.fetch(
+        '%s/directions?origin=%s&destination=50.6,30.7' % (base_url, origin))
+    received = len(response.body)
+    started = time.time()
+    item = escape.json_decode(response.body)['data'][0]
+    if by_token:
+        document = token_document(item['attributes']['token'])
+    else:
+        document = geojson_document(item['attributes']['route'])
+    body = escape.json_encode(document)
+    await client.fetch(base_url + '/routes', method='POST', body=body)
+    return received, len(body), time.time() - started
+
+
+async def run(args, base_url):
+    client = httpclient.AsyncHTTPClient()
+    for by_token in (False, True):
+        sent = elapsed = 0
+        for i in range(args.routes):
+            received, size, seconds = await save(client, base_url, i,
+                                                 by_token)
+            sent += size
+            elapsed += seconds
+        print('  %-8s directions %7d B  POST body %8d B  '
+              'save %7.2fms per route' % (
+                  'token' if by_token else 'geojson', received,
+                  sent // args.routes, elapsed * 1000 / args.routes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--db_url', required=True)
+    parser.add_argument('--points', type=int, nargs='+',
+                        default=[100, 1000, 10000],
+                        help='Overview polyline points of routes')
+    parser.add_argument('--routes', type=int, default=100,
+                        help='Routes saved per case')
+    args = parser.parse_args()
+
+    for points in args.points:
+        print('%d points' % points)
+        google_port = free_port()
+        port = free_port()
+        with spawn_fake_google(google_port, points=points), \
+                spawn_app(port, db_url=args.db_url,
+                          google_maps_base_url='http://127.0.0.1:%d' %
+                          google_port,
+                          google_queries_per_second=1000, google_burst=100,
+                          directions_cache_size=0):
+            IOLoop.current().run_sync(
+                lambda: run(args, 'http://127.0.0.1:%d' % port))
+
+
+if __name__ == '__main__':
+    main()
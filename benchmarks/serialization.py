@@ -0,0 +1,86 @@
+"""
+Micro-benchmark of ``RouteOutputSchema`` serialization: decoding GeoJSON and
+re-encoding it with marshmallow versus splicing ``ST_AsGeoJSON`` text into
+the output. tests/test_geojson.py checks that both produce the same bytes.
+
+    $ python -m benchmarks.serialization --points 1000 50000
+"""
+import argparse
+import math
+import random
+import timeit
+import uuid
+from datetime import datetime, timezone
+
+from core.geojson import Fragments
+from handlers.routes import RouteOutputSchema
+
+
+def pg_double(value, max_digits=15):
+    """Formats a double like PostGIS ``lwprint_double()``"""
+    integer_digits = (math.floor(math.log10(abs(value))) + 1
+                      if abs(value) >= 1 else 0)
+    text = '%.*f' % (max(0, max_digits - integer_digits), value)
+    if '.' in text:
+        text = text.rstrip('0').rstrip('.')
+    return text
+
+
+def st_asgeojson(geometry_type, coordinates):
+    if geometry_type == 'Point':
+        body = '[%s,%s]' % tuple(pg_double(v) for v in coordinates)
+    else:
+        body = '[%s]' % ','.join('[%s,%s]' % (pg_double(x), pg_double(y))
+                                 for x, y in coordinates)
+    return '{"type":"%s","coordinates":%s}' % (geometry_type, body)
+
+
+def make_row(points, stops=0):
+    lng, lat = random.uniform(-180, 180), random.uniform(-85, 85)
+    coordinates = [(lng + random.uniform(-0.01, 0.01),
+                    lat + random.uniform(-0.01, 0.01)) for _ in range(points)]
+    waypoints = coordinates[1:stops + 1]
+    return {
+        'id': str(uuid.uuid4()),
+        'origin': st_asgeojson('Point', coordinates[0]),
+        'origin_name': 'Origin',
+        'destination': st_asgeojson('Point', coordinates[-1]),
+        'destination_name': 'Destination',
+        'waypoints': (st_asgeojson('MultiPoint', waypoints)
+                      if waypoints else None),
+        'waypoints_names': (['Stop %d' % i for i in range(len(waypoints))]
+                            if waypoints else None),
+        'polyline': st_asgeojson('LineString', coordinates),
+        'bounds': None,
+        'created': datetime.now(timezone.utc),
+    }
+
+
+def schema_dumps(row):
+    return RouteOutputSchema().dumps(dict(row)).data
+
+
+def spliced_dumps(row):
+    fragments = Fragments()
+    schema = RouteOutputSchema()
+    output = schema.dumps(schema.stash_geojson(dict(row), fragments))
+    return fragments.splice(output.data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--points', type=int, nargs='+',
+                        default=[1000, 50000])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    for points in args.points:
+        row = make_row(points)
+        for name, fn in (('schema', schema_dumps), ('spliced', spliced_dumps)):
+            seconds = min(timeit.repeat(lambda: fn(row), number=1,
+                                        repeat=args.repeat))
+            print('%6d points  %-8s %8.2fms' % (points, name, seconds * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Response size and latency of ``GET /routes`` list pages with full and
+simplified polylines.
+
+    $ python -m benchmarks.simplify --db_url=postgresql://...
+"""
+import argparse
+
+from tornado import escape, gen, httpclient
+from tornado.ioloop import IOLoop
+
+from benchmarks.common import free_port, spawn_app, run_load, format_summary
+from benchmarks.concurrency import route_document
+
+VARIANTS = ('', 'zoom=14', 'zoom=10', 'zoom=6', 'simplify=0.001')
+
+
+async def seed(base_url, count, points):
+    client = httpclient.AsyncHTTPClient(force_instance=True, max_clients=10)
+    await gen.multi([
+        client.fetch(base_url + '/routes', method='POST',
+                     body=escape.json_encode(route_document(points)))
+        for _ in range(count)
+    ])
+    client.close()
+
+
+async def measure(base_url, args):
+    client = httpclient.AsyncHTTPClient(force_instance=True)
+    results = []
+    for variant in VARIANTS:
+        url = '%s/routes?page[size]=%d&%s' % (base_url, args.page_size,
+                                              variant)
+        response = await client.fetch(url, request_timeout=120)
+        summary = await run_load(
+            lambda n: httpclient.HTTPRequest(url, request_timeout=120),
+            args.requests, args.concurrency)
+        results.append((variant or 'full', len(response.body), summary))
+    client.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--db_url', required=True)
+    parser.add_argument('--seed', type=int, default=200,
+                        help='Routes to insert before measuring')
+    parser.add_argument('--points', type=int, default=5000,
+                        help='Polyline points of inserted routes')
+    parser.add_argument('--page-size', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=10)
+    args = parser.parse_args()
+
+    port = free_port()
+    with spawn_app(port, db_url=args.db_url):
+        base_url = 'http://127.0.0.1:%d' % port
+        if args.seed:
+            IOLoop.current().run_sync(
+                lambda: seed(base_url, args.seed, args.points))
+        results = IOLoop.current().run_sync(lambda: measure(base_url, args))
+
+    full_size = results[0][1]
+    for variant, size, summary in results:
+        print('%-16s %10d B (%5.1f%%)' % (variant, size,
+                                          100.0 * size / full_size))
+        print(format_summary('  ' + variant, summary))
+
+
+if __name__ == '__main__':
+    main()
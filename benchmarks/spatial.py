@@ -0,0 +1,68 @@
+"""
+Latency of the ``GET /routes`` spatial filters at the database, for a table
+filled by ``benchmarks.generate_routes``.
+
+    $ python -m benchmarks.generate_routes --db_url=... --count=1000000
+    $ python -m benchmarks.spatial --db_url=...
+"""
+import argparse
+import random
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks.common import summarize
+from handlers.routes import SPATIAL_FILTERS
+from models import Route
+
+
+def random_value(name, region, radius):
+    min_lng, min_lat, max_lng, max_lat = region
+    lng = random.uniform(min_lng, max_lng)
+    lat = random.uniform(min_lat, max_lat)
+    if name == 'filter[bbox]':
+        return '%f,%f,%f,%f' % (lng, lat, lng + 0.05, lat + 0.05)
+    return '%f,%f,%f' % (lng, lat, radius)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--db_url', required=True)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--page-size', type=int, default=20)
+    parser.add_argument('--radius', type=float, default=500,
+                        help='Radius of near filters, metres')
+    parser.add_argument('--region', type=float, nargs=4,
+                        default=[-10, 35, 30, 60],
+                        metavar=('MIN_LNG', 'MIN_LAT', 'MAX_LNG', 'MAX_LAT'))
+    parser.add_argument('--explain', action='store_true',
+                        help='Print the query plan of each filter')
+    args = parser.parse_args()
+
+    session = sessionmaker(bind=create_engine(args.db_url))()
+    for name, build in sorted(SPATIAL_FILTERS.items()):
+        latencies = []
+        started = time.time()
+        for _ in range(args.queries):
+            expression = build(name, random_value(name, args.region,
+                                                  args.radius))
+            query = session.query(Route.id).filter(expression).order_by(
+                Route.created.desc(), Route.id.desc()).limit(args.page_size)
+            query_started = time.time()
+            query.all()
+            latencies.append(time.time() - query_started)
+        summary = summarize(latencies, time.time() - started)
+        print('%-26s p50 %6.2fms  p95 %6.2fms  p99 %6.2fms' % (
+            name, summary['p50'] * 1000, summary['p95'] * 1000,
+            summary['p99'] * 1000))
+        if args.explain:
+            compiled = query.statement.compile(
+                dialect=session.bind.dialect,
+                compile_kwargs={'literal_binds': True})
+            for row in session.execute('EXPLAIN ANALYZE %s' % compiled):
+                print('    ' + row[0])
+
+
+if __name__ == '__main__':
+    main()
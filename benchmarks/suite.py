@@ -0,0 +1,203 @@
+"""
+Load profiles of every endpoint against synthetic route tables of growing
+size, with Google replaced by the fake server. Reports throughput,
+latency percentiles and server memory per profile and concurrency, and
+writes them as JSON for ``benchmarks.compare``.
+
+The route table is filled by ``benchmarks.generate_routes`` up to each
+``--rows`` size; existing routes count towards it. Use a dedicated
+database.
+
+    $ python -m benchmarks.suite --db_url=postgresql://... \\
+        --rows 10000 100000 1000000 --output=results/$(git rev-parse \\
+        --short HEAD).json
+    $ python -m benchmarks.compare results/a1b2c3d.json results/e4f5a6b.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+from datetime import datetime, timezone
+
+from sqlalchemy import create_engine, text
+from tornado import escape, httpclient
+from tornado.ioloop import IOLoop
+
+import models
+from benchmarks.common import ROOT, free_port, spawn_app, spawn_fake_google, \
+    run_load, format_summary, process_memory
+from benchmarks.concurrency import route_document
+from benchmarks.generate_routes import generate
+
+REGION = (-10, 35, 30, 60)
+
+
+def random_location():
+    return '%.5f,%.5f' % (random.uniform(REGION[1], REGION[3]),
+                          random.uniform(REGION[0], REGION[2]))
+
+
+def routes_get(base_url, route_ids):
+    def make_request(i):
+        return httpclient.HTTPRequest(
+            '%s/routes/%s' % (base_url, random.choice(route_ids)),
+            request_timeout=120)
+    return make_request
+
+
+def routes_page(base_url, route_ids):
+    def make_request(i):
+        return httpclient.HTTPRequest(base_url + '/routes?page[size]=100',
+                                      request_timeout=120)
+    return make_request
+
+
+def routes_near(base_url, route_ids):
+    def make_request(i):
+        lat, lng = random_location().split(',')
+        return httpclient.HTTPRequest(
+            '%s/routes?page[size]=20&filter[near]=%s,%s,1000' % (
+                base_url, lng, lat), request_timeout=120)
+    return make_request
+
+
+def routes_post(base_url, route_ids):
+    def make_request(i):
+        return httpclient.HTTPRequest(
+            base_url + '/routes', method='POST', request_timeout=120,
+            body=escape.json_encode(route_document()))
+    return make_request
+
+
+def directions(base_url, route_ids):
+    def make_request(i):
+        # Random endpoints miss the directions cache
+        return httpclient.HTTPRequest(
+            '%s/directions?origin=%s&destination=%s' % (
+                base_url, random_location(), random_location()),
+            request_timeout=120)
+    return make_request
+
+
+def directions_cached(base_url, route_ids):
+    def make_request(i):
+        return httpclient.HTTPRequest(
+            base_url + '/directions?origin=50.45,30.52'
+                       '&destination=50.40,30.60', request_timeout=120)
+    return make_request
+
+
+def matrix(base_url, route_ids):
+    def make_request(i):
+        locations = '|'.join(random_location() for _ in range(5))
+        return httpclient.HTTPRequest(
+            '%s/matrix?origins=%s&destinations=%s' % (
+                base_url, locations, locations), request_timeout=120)
+    return make_request
+
+
+PROFILES = {
+    'routes-get': routes_get,
+    'routes-page': routes_page,
+    'routes-near': routes_near,
+    'routes-post': routes_post,
+    'directions': directions,
+    'directions-cached': directions_cached,
+    'matrix': matrix,
+}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=ROOT,
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def fill(engine, rows, points):
+    with engine.connect() as connection:
+        count = connection.execute(text('SELECT count(*) FROM route')).scalar()
+    if count < rows:
+        generate(engine, rows - count, points=points, region=REGION,
+                 first=count + 1, log=lambda message: None)
+    with engine.connect() as connection:
+        return [row.id for row in connection.execute(text(
+            'SELECT id FROM route ORDER BY random() LIMIT 1000'))]
+
+
+def run_profiles(args, base_url, process, rows, route_ids):
+    results = []
+    for name in args.profiles:
+        for concurrency in args.concurrency:
+            summary = IOLoop.current().run_sync(lambda: run_load(
+                PROFILES[name](base_url, route_ids), args.requests,
+                concurrency))
+            print(format_summary('%d rows %s c%d' % (rows, name,
+                                                     concurrency), summary))
+            result = dict(summary, rows=rows, profile=name,
+                          concurrency=concurrency)
+            result.update(process_memory(process.pid) or {})
+            results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--db_url', required=True)
+    parser.add_argument('--rows', type=int, nargs='+',
+                        default=[10000, 100000, 1000000])
+    parser.add_argument('--points', type=int, default=50,
+                        help='Polyline points of generated routes')
+    parser.add_argument('--profiles', nargs='+', default=sorted(PROFILES),
+                        choices=sorted(PROFILES))
+    parser.add_argument('--requests', type=int, default=1000,
+                        help='Requests per profile and concurrency')
+    parser.add_argument('--concurrency', type=int, nargs='+',
+                        default=[1, 10, 50])
+    parser.add_argument('--google-latency', type=float, default=0.05)
+    parser.add_argument('--google-jitter', type=float, default=0.05)
+    parser.add_argument('--google-error-rate', type=float, default=0.0,
+                        help='Share of OVER_QUERY_LIMIT responses')
+    parser.add_argument('--output', help='Write results to this JSON file')
+    args = parser.parse_args()
+
+    engine = create_engine(args.db_url)
+    models.init_db(engine)
+    report = {
+        'commit': git_commit(),
+        'date': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'arguments': {k: v for k, v in vars(args).items()
+                      if k not in ('db_url', 'output')},
+        'results': [],
+    }
+    google_port = free_port()
+    with spawn_fake_google(google_port, latency=args.google_latency,
+                           jitter=args.google_jitter,
+                           error_rate=args.google_error_rate):
+        for rows in sorted(args.rows):
+            route_ids = fill(engine, rows, args.points)
+            port = free_port()
+            with spawn_app(port, db_url=args.db_url,
+                           google_maps_base_url='http://127.0.0.1:%d' %
+                           google_port,
+                           google_queries_per_second=10000,
+                           google_burst=1000) as process:
+                report['results'].extend(run_profiles(
+                    args, 'http://127.0.0.1:%d' % port, process, rows,
+                    route_ids))
+
+    if args.output:
+        directory = os.path.dirname(args.output)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
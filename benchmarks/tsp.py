@@ -0,0 +1,86 @@
+"""
+Solution quality against time of ``core.tsp`` waypoint ordering, on random
+stops with asymmetric durations. Tours are compared with the exact
+optimum (Held-Karp) where that is feasible, and with the nearest
+neighbour tour otherwise.
+
+    $ python -m benchmarks.tsp --stops 10 50 200 --time-limits 0.1 1 5
+"""
+import argparse
+import math
+import random
+import time
+
+from core import tsp
+
+# Stops spread over about 20 km, driven at 40 km/h
+EXTENT = 20000
+SPEED = 40 / 3.6
+
+
+def random_matrix(n, asymmetry=0.2):
+    points = [(random.uniform(0, EXTENT), random.uniform(0, EXTENT))
+              for _ in range(n)]
+    return [0.0 if a is b else
+            math.hypot(a[0] - b[0], a[1] - b[1]) / SPEED *
+            (1 + random.uniform(0, asymmetry))
+            for a in points for b in points]
+
+
+def held_karp(costs, n):
+    """Exact shortest open path from stop 0 to stop n - 1"""
+    inner = n - 2
+    best = {}
+    for k in range(inner):
+        best[(1 << k, k)] = costs[k + 1]
+    for subset in range(1, 1 << inner):
+        for last in range(inner):
+            if not subset & (1 << last) or (subset, last) not in best:
+                continue
+            cost = best[(subset, last)]
+            for k in range(inner):
+                if subset & (1 << k):
+                    continue
+                key = (subset | (1 << k), k)
+                value = cost + costs[(last + 1) * n + k + 1]
+                if value < best.get(key, float('inf')):
+                    best[key] = value
+    full = (1 << inner) - 1
+    return min(best[(full, k)] + costs[(k + 1) * n + n - 1]
+               for k in range(inner))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--stops', type=int, nargs='+',
+                        default=[10, 25, 50, 100, 200])
+    parser.add_argument('--time-limits', type=float, nargs='+',
+                        default=[0.05, 0.2, 1, 5])
+    parser.add_argument('--instances', type=int, default=5)
+    args = parser.parse_args()
+
+    for n in args.stops:
+        rows = {}
+        for _ in range(args.instances):
+            costs = random_matrix(n)
+            if n <= 14:
+                reference, name = held_karp(costs, n), 'optimum'
+            else:
+                reference, name = tsp.path_cost(
+                    costs, n, tsp.nearest_neighbour(costs, n)), 'nearest'
+            for limit in args.time_limits + [None]:
+                started = time.time()
+                tour = tsp.optimize(costs, n, time_limit=limit)
+                elapsed = time.time() - started
+                ratio = tsp.path_cost(costs, n, tour) / reference
+                row = rows.setdefault(limit, [0.0, 0.0])
+                row[0] += ratio / args.instances
+                row[1] += elapsed / args.instances
+        for limit, (ratio, elapsed) in rows.items():
+            print('%4d stops  limit %-6s  %8.1fms  %.3f of %s' % (
+                n, 'none' if limit is None else '%gs' % limit,
+                elapsed * 1000, ratio, name))
+
+
+if __name__ == '__main__':
+    main()
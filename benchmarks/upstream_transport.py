@@ -0,0 +1,67 @@
+"""
+Upstream HTTP transports against the fake Google server over TLS:
+tornado's simple client, which handshakes for every request, versus the
+curl client keeping connections alive. Needs ``openssl`` for a throwaway
+certificate, and pycurl for the curl transport.
+
+    $ python -m benchmarks.upstream_transport --requests 2000 \\
+        --concurrency 1 10 50
+"""
+import argparse
+import os
+import subprocess
+import tempfile
+
+from tornado import httpclient
+from tornado.ioloop import IOLoop
+
+from benchmarks.common import free_port, spawn_fake_google, run_load, \
+    format_summary
+from core.google import TRANSPORTS, make_http_client
+
+
+def make_certificate(directory):
+    certfile = os.path.join(directory, 'cert.pem')
+    keyfile = os.path.join(directory, 'key.pem')
+    subprocess.check_call(
+        ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes',
+         '-subj', '/CN=127.0.0.1', '-days', '1',
+         '-keyout', keyfile, '-out', certfile],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return certfile, keyfile
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, nargs='+',
+                        default=[1, 10, 50])
+    parser.add_argument('--transports', nargs='+', default=list(TRANSPORTS),
+                        choices=TRANSPORTS)
+    parser.add_argument('--latency', type=float, default=0.01,
+                        help='Fake Google response latency, seconds')
+    args = parser.parse_args()
+
+    certfile, keyfile = make_certificate(tempfile.mkdtemp())
+    port = free_port()
+    url = ('https://127.0.0.1:%d/maps/api/directions/json'
+           '?origin=50.45,30.52&destination=50.40,30.60' % port)
+
+    def make_request(i):
+        return httpclient.HTTPRequest(url, validate_cert=False,
+                                      connect_timeout=5, request_timeout=30)
+
+    with spawn_fake_google(port, latency=args.latency, certfile=certfile,
+                           keyfile=keyfile):
+        for transport in args.transports:
+            for concurrency in args.concurrency:
+                client = make_http_client(transport, concurrency)
+                summary = IOLoop.current().run_sync(lambda: run_load(
+                    make_request, args.requests, concurrency, client))
+                client.close()
+                print(format_summary('%s, concurrency %d' % (
+                    transport, concurrency), summary))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Parsing and validating request input: ``POST /routes`` bodies of 10k
+vertex polylines through ``RouteInputSchema`` versus the fast path of
+``load_route_input()``, and ``GET /directions`` query strings through
+webargs versus ``parse_directions_query()``. With ``--db_url`` also
+measures ``POST /routes`` requests/sec end to end. tests/test_routes.py
+and tests/test_directions.py check that both ways give the same result.
+
+    $ python -m benchmarks.validation --points 1000 10000 \\
+        --db_url=postgresql://...
+"""
+import argparse
+import timeit
+
+from tornado import escape, httpclient, httputil
+from tornado.ioloop import IOLoop
+from webargs.tornadoparser import parser as webargs_parser
+
+from benchmarks.common import free_port, spawn_app, run_load, format_summary
+from benchmarks.concurrency import route_document
+from handlers.directions import DirectionsQuerySchema, parse_directions_query
+from handlers.routes import RouteInputSchema, load_route_input
+
+DIRECTIONS_URI = ('/directions?origin=50.45,30.52&destination=50.40,30.60'
+                  '&mode=walking&language=en&waypoints=50.43,30.55'
+                  '&waypoints=50.42,30.57')
+
+
+def rate(fn, repeat):
+    seconds = min(timeit.repeat(fn, number=1, repeat=repeat))
+    return seconds, 1 / seconds
+
+
+def routes_parsing(points, repeat):
+    body = escape.utf8(escape.json_encode(route_document(points)))
+    cases = (
+        ('json only', lambda: escape.json_decode(body)),
+        ('schema', lambda: RouteInputSchema().load(
+            escape.json_decode(body))),
+        ('fast path', lambda: load_route_input(escape.json_decode(body))),
+    )
+    for name, fn in cases:
+        seconds, per_second = rate(fn, repeat)
+        print('POST /routes %6d points  %-10s %8.3fms  %8.0f req/s' % (
+            points, name, seconds * 1000, per_second))
+
+
+def directions_parsing(repeat):
+    request = httputil.HTTPServerRequest(method='GET', uri=DIRECTIONS_URI)
+    cases = (
+        ('webargs', lambda: webargs_parser.parse(
+            DirectionsQuerySchema, request, locations=('query',))),
+        ('fast path', lambda: parse_directions_query(request)),
+    )
+    for name, fn in cases:
+        seconds, per_second = rate(fn, repeat)
+        print('GET /directions query   %-10s %8.3fms  %8.0f req/s' % (
+            name, seconds * 1000, per_second))
+
+
+def end_to_end(args):
+    bodies = [escape.json_encode(route_document(args.points[-1]))
+              for _ in range(20)]
+    port = free_port()
+    with spawn_app(port, db_url=args.db_url):
+        url = 'http://127.0.0.1:%d/routes' % port
+        summary = IOLoop.current().run_sync(lambda: run_load(
+            lambda n: httpclient.HTTPRequest(
+                url, method='POST', body=bodies[n % len(bodies)],
+                request_timeout=120),
+            args.requests, args.concurrency))
+    print(format_summary('POST /routes %d points' % args.points[-1],
+                         summary))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--points', type=int, nargs='+',
+                        default=[1000, 10000])
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--db_url')
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=10)
+    args = parser.parse_args()
+
+    for points in args.points:
+        routes_parsing(points, args.repeat)
+    directions_parsing(args.repeat * 100)
+    if args.db_url:
+        end_to_end(args)
+
+
+if __name__ == '__main__':
+    main()
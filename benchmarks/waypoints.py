@@ -0,0 +1,81 @@
+"""
+Routes with many stops: rendering the waypoints MultiPoint spliced from
+``ST_AsGeoJSON`` versus decoding it per row, and ``filter[stops-near]``
+latency with the GiST index and with a sequential scan, for a table
+filled by ``benchmarks.generate_routes``.
+
+    $ python -m benchmarks.generate_routes --db_url=... --count=100000 \\
+        --stops=50 --truncate
+    $ python -m benchmarks.waypoints --db_url=... --stops 50
+"""
+import argparse
+import random
+import time
+import timeit
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks.common import summarize
+from benchmarks.serialization import make_row, schema_dumps, spliced_dumps
+from handlers.routes import SPATIAL_FILTERS
+from models import Route
+
+
+def serialization(stops, points, repeat):
+    row = make_row(points, stops)
+    for name, fn in (('decoded', schema_dumps), ('spliced', spliced_dumps)):
+        seconds = min(timeit.repeat(lambda: fn(row), number=1, repeat=repeat))
+        print('%3d stops  %-8s %8.3fms per route' % (
+            stops, name, seconds * 1000))
+
+
+def stops_near(session, args, indexed):
+    session.execute('SET enable_indexscan = %s' % ('on' if indexed else 'off'))
+    session.execute('SET enable_bitmapscan = %s' % ('on' if indexed
+                                                    else 'off'))
+    min_lng, min_lat, max_lng, max_lat = args.region
+    latencies = []
+    started = time.time()
+    for _ in range(args.queries):
+        value = '%f,%f,%f' % (random.uniform(min_lng, max_lng),
+                              random.uniform(min_lat, max_lat), args.radius)
+        query = session.query(Route.id).filter(
+            SPATIAL_FILTERS['filter[stops-near]']('filter[stops-near]',
+                                                  value)).order_by(
+            Route.created.desc(), Route.id.desc()).limit(args.page_size)
+        query_started = time.time()
+        query.all()
+        latencies.append(time.time() - query_started)
+    summary = summarize(latencies, time.time() - started)
+    print('filter[stops-near] %-10s p50 %8.2fms  p95 %8.2fms' % (
+        'gist' if indexed else 'seq scan', summary['p50'] * 1000,
+        summary['p95'] * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--db_url')
+    parser.add_argument('--stops', type=int, nargs='+', default=[0, 50])
+    parser.add_argument('--points', type=int, default=1000,
+                        help='Polyline points of serialized routes')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--page-size', type=int, default=20)
+    parser.add_argument('--radius', type=float, default=500,
+                        help='filter[stops-near] radius, metres')
+    parser.add_argument('--region', type=float, nargs=4,
+                        default=[-10, 35, 30, 60],
+                        metavar=('MIN_LNG', 'MIN_LAT', 'MAX_LNG', 'MAX_LAT'))
+    args = parser.parse_args()
+
+    for stops in args.stops:
+        serialization(stops, args.points, args.repeat)
+    if args.db_url:
+        session = sessionmaker(bind=create_engine(args.db_url))()
+        for indexed in (True, False):
+            stops_near(session, args, indexed)
+
+
+if __name__ == '__main__':
+    main()
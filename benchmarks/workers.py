@@ -0,0 +1,40 @@
+"""
+``GET /routes`` throughput by number of pre-forked worker processes.
+
+    $ python -m benchmarks.workers --db_url=postgresql://... --workers 1 2 4
+"""
+import argparse
+
+from tornado import httpclient
+from tornado.ioloop import IOLoop
+
+from benchmarks.common import free_port, spawn_app, run_load, format_summary
+from benchmarks.concurrency import seed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--db_url', required=True)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--seed', type=int, default=500,
+                        help='Routes to insert before measuring')
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=32)
+    args = parser.parse_args()
+
+    for i, workers in enumerate(args.workers):
+        port = free_port()
+        with spawn_app(port, db_url=args.db_url, workers=workers):
+            base_url = 'http://127.0.0.1:%d' % port
+            if args.seed and i == 0:
+                IOLoop.current().run_sync(lambda: seed(base_url, args.seed))
+            url = '%s/routes?page[size]=%d' % (base_url, args.page_size)
+            summary = IOLoop.current().run_sync(lambda: run_load(
+                lambda n: httpclient.HTTPRequest(url, request_timeout=120),
+                args.requests, args.concurrency))
+        print(format_summary('%d worker(s)' % workers, summary))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,28 @@
+class DirectionsBackend(object):
+    """
+    Source of directions, answers with Google Directions API route dicts.
+
+    Errors are raised as ``googlemaps.exceptions`` so handlers map them to
+    responses the same way for every backend.
+    """
+    # Most origins or destinations, and elements, per distance_matrix()
+    # call; None if unlimited
+    matrix_limits = None
+
+    async def directions(self, origin, destination, mode=None, waypoints=None,
+                         language=None, **kwargs):
+        """Get directions between an origin point and a destination point.
+
+        :rtype: list of routes
+        """
+        raise NotImplementedError()
+
+    async def distance_matrix(self, origins, destinations, mode=None,
+                              language=None, **kwargs):
+        """Travel durations and distances between every origin and
+        destination.
+
+        :rtype: list of Distance Matrix API rows, one per origin, with an
+            element per destination
+        """
+        raise NotImplementedError()
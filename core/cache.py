@@ -0,0 +1,205 @@
+import hashlib
+import logging
+import time
+import uuid
+from collections import OrderedDict
+
+from sqlalchemy import text
+from tornado import escape
+from tornado.ioloop import IOLoop
+
+
+class LRUCache(object):
+    """
+    In-memory LRU cache with per-entry expiration time
+    """
+    def __init__(self, max_size=1024, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        try:
+            value, expires = self._entries[key]
+        except KeyError:
+            return None
+        if expires < time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key, value, ttl=None):
+        self._entries.pop(key, None)
+        self._entries[key] = (value, time.time() + (ttl or self.ttl))
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def delete(self, key):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+
+class DatabaseCache(object):
+    """
+    Cache tier in the ``directions_cache`` table, survives restarts and is
+    shared by all processes using the same database
+    """
+    select = text(
+        'SELECT value, extract(epoch FROM expires - now()) AS ttl '
+        'FROM directions_cache WHERE key = :key AND expires > now()'
+    )
+    upsert = text(
+        'INSERT INTO directions_cache (key, value, expires) '
+        "VALUES (:key, :value, now() + :ttl * interval '1 second') "
+        'ON CONFLICT (key) DO UPDATE '
+        'SET value = excluded.value, expires = excluded.expires'
+    )
+    purge_expired = text('DELETE FROM directions_cache WHERE expires <= now()')
+
+    def __init__(self, db, ttl=300):
+        self.db = db
+        self.ttl = ttl
+
+    def _get(self, key):
+        with self.db.engine.connect() as connection:
+            return connection.execute(self.select, key=key).first()
+
+    def _set(self, key, value, ttl):
+        with self.db.engine.connect() as connection:
+            connection.execute(self.upsert, key=key, value=value,
+                               ttl=ttl or self.ttl)
+
+    def _set_many(self, items, ttl):
+        with self.db.engine.begin() as connection:
+            connection.execute(self.upsert, [
+                {'key': key, 'value': value, 'ttl': ttl or self.ttl}
+                for key, value in items])
+
+    def _purge(self):
+        with self.db.engine.connect() as connection:
+            connection.execute(self.purge_expired)
+
+    def get(self, key):
+        """Resolves to ``(value, seconds_left)`` or None"""
+        return self.db.run(self._get, key)
+
+    def set(self, key, value, ttl=None):
+        return self.db.run(self._set, key, value, ttl)
+
+    def set_many(self, items, ttl=None):
+        """Sets ``(key, value)`` items in one transaction"""
+        return self.db.run(self._set_many, items, ttl)
+
+    def purge(self):
+        """Deletes expired entries"""
+        return self.db.run(self._purge)
+
+
+class DirectionsCache(object):
+    """
+    Two-tier cache of Google Directions results keyed by request params.
+
+    Results are kept as JSON text, so every hit returns a fresh copy.
+    ``max_age`` bounds how long a result may be reused, to stay within the
+    caching terms of Google Maps APIs.
+    """
+    def __init__(self, max_size=1024, max_age=300, store=None):
+        self.max_age = max_age
+        self.memory = LRUCache(max_size=max_size, ttl=max_age)
+        self.store = store
+        self.hits = 0
+        self.store_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(params):
+        items = sorted((k, str(v).strip()) for k, v in params.items())
+        return hashlib.sha1(escape.utf8(escape.json_encode(items))).hexdigest()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'store_hits': self.store_hits,
+            'misses': self.misses,
+            'size': len(self.memory),
+        }
+
+    async def get(self, params):
+        key = self.make_key(params)
+        value = self.memory.get(key)
+        if value is not None:
+            self.hits += 1
+            return escape.json_decode(value)
+        if self.store is not None:
+            row = await self.store.get(key)
+            if row is not None:
+                value, ttl = row
+                self.store_hits += 1
+                # Don't let the memory tier outlive the stored entry
+                self.memory.set(key, value, ttl=min(ttl, self.max_age))
+                return escape.json_decode(value)
+        self.misses += 1
+        return None
+
+    def peek(self, params):
+        """Memory tier lookup, without counting it or asking the store"""
+        value = self.memory.get(self.make_key(params))
+        return None if value is None else escape.json_decode(value)
+
+    async def set(self, params, result):
+        key = self.make_key(params)
+        value = escape.json_encode(result)
+        self.memory.set(key, value)
+        if self.store is not None:
+            await self.store.set(key, value, self.max_age)
+
+    def purge(self):
+        """Deletes expired entries from the store tier, memory tier entries
+        expire on access"""
+        if self.store is not None:
+            return self.store.purge()
+
+
+class ResultStore(object):
+    """
+    Results kept for a while under random tokens, so clients can refer to
+    a result instead of sending it back. Tiers are the same as
+    ``DirectionsCache``'s; with a ``DatabaseCache`` store a token issued
+    by one process resolves in the others.
+    """
+    def __init__(self, max_size=1024, ttl=600, store=None):
+        self.ttl = ttl
+        self.memory = LRUCache(max_size=max_size, ttl=ttl)
+        self.store = store
+
+    def put(self, results):
+        """Stores ``results``, returns their tokens. The memory tier has
+        them at once; the store is written in the background, in one batch,
+        so responses don't wait for it."""
+        items = [(uuid.uuid4().hex, escape.json_encode(result))
+                 for result in results]
+        for token, value in items:
+            self.memory.set(token, value)
+        if self.store is not None and items:
+            IOLoop.current().spawn_callback(self._store_items, items)
+        return [token for token, _ in items]
+
+    async def _store_items(self, items):
+        try:
+            await self.store.set_many(items, self.ttl)
+        except Exception:
+            logging.exception('Storing %d results failed', len(items))
+
+    async def get(self, token):
+        value = self.memory.get(token)
+        if value is None and self.store is not None:
+            row = await self.store.get(token)
+            if row is not None:
+                value = row[0]
+        return None if value is None else escape.json_decode(value)
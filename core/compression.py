@@ -0,0 +1,127 @@
+"""
+Response compression negotiated from ``Accept-Encoding``: brotli when the
+optional ``brotli`` package is installed, gzip otherwise.
+
+Tornado's own ``compress_response`` only knows a fixed list of content
+types, which lacks ``application/vnd.api+json``.
+"""
+import zlib
+
+from tornado.escape import native_str
+from tornado.web import OutputTransform
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Compressing small bodies costs more than it saves
+MIN_LENGTH = 1024
+# Per request compression favours speed. Stored documents are compressed
+# once, harder; brotli 10-11 takes seconds on multi-megabyte routes.
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+STORED_GZIP_LEVEL = 9
+STORED_BROTLI_QUALITY = 9
+COMPRESSIBLE_TYPES = frozenset([
+    'application/json', 'application/vnd.api+json', 'application/x-ndjson',
+    'application/javascript', 'application/xml',
+])
+
+
+def available_encodings():
+    """Encodings this process can produce, preferred first"""
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def negotiate(accept_encoding, encodings=None):
+    """Preferred encoding accepted by an ``Accept-Encoding`` header value,
+    None if there is none"""
+    accepted = {}
+    for item in accept_encoding.split(','):
+        coding, _, params = item.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip().lower()] = quality
+    for encoding in encodings or available_encodings():
+        if accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return None
+
+
+class _Gzip(object):
+    def __init__(self, level=GZIP_LEVEL):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED,
+                                            16 + zlib.MAX_WBITS)
+
+    def compress(self, data, finishing):
+        flush = zlib.Z_FINISH if finishing else zlib.Z_SYNC_FLUSH
+        return self._compressor.compress(data) + self._compressor.flush(flush)
+
+
+class _Brotli(object):
+    def __init__(self, quality=BROTLI_QUALITY):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data, finishing):
+        output = self._compressor.process(data)
+        if finishing:
+            return output + self._compressor.finish()
+        return output + self._compressor.flush()
+
+
+def compressor(encoding, stored=False):
+    if encoding == 'br':
+        return _Brotli(STORED_BROTLI_QUALITY if stored else BROTLI_QUALITY)
+    return _Gzip(STORED_GZIP_LEVEL if stored else GZIP_LEVEL)
+
+
+def compress(data, encoding):
+    """Compresses a whole body for storage, at the highest level"""
+    return compressor(encoding, stored=True).compress(data, True)
+
+
+class CompressionTransform(OutputTransform):
+    """
+    Compresses JSON and text responses. Streamed responses are flushed
+    chunk by chunk, bodies with a ``Content-Encoding`` already (stored
+    compressed blobs) are left alone.
+    """
+    def __init__(self, request):
+        self._encoding = negotiate(
+            request.headers.get('Accept-Encoding', ''))
+        self._compressor = None
+
+    def transform_first_chunk(self, status_code, headers, chunk, finishing):
+        # Header values set by the handler are bytes
+        if 'Vary' in headers:
+            headers['Vary'] += b', Accept-Encoding'
+        else:
+            headers['Vary'] = b'Accept-Encoding'
+        content_type = native_str(
+            headers.get('Content-Type', '')).split(';')[0].strip()
+        if (self._encoding is not None and
+                status_code not in (204, 304) and
+                'Content-Encoding' not in headers and
+                (content_type.startswith('text/') or
+                 content_type in COMPRESSIBLE_TYPES) and
+                (not finishing or len(chunk) >= MIN_LENGTH)):
+            self._compressor = compressor(self._encoding)
+            headers['Content-Encoding'] = self._encoding
+            chunk = self.transform_chunk(chunk, finishing)
+            if 'Content-Length' in headers:
+                if finishing:
+                    headers['Content-Length'] = str(len(chunk))
+                else:
+                    del headers['Content-Length']
+        return status_code, headers, chunk
+
+    def transform_chunk(self, chunk, finishing):
+        if self._compressor is not None:
+            return self._compressor.compress(chunk, finishing)
+        return chunk
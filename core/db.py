@@ -0,0 +1,70 @@
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from tornado.concurrent import Future, chain_future
+
+import models
+from core import metrics
+
+
+class Database(object):
+    """
+    SQLAlchemy engine with a bounded thread pool for blocking DB calls.
+
+    Handlers run their queries through ``run()``, so a slow PostGIS query
+    occupies an executor thread instead of the IOLoop. With
+    ``executor_workers=0`` calls are made inline on the IOLoop (the old
+    synchronous behaviour).
+    """
+    def __init__(self, url, pool_size=5, max_overflow=10, pool_timeout=30,
+                 executor_workers=None, echo=False):
+        self.engine = create_engine(url, convert_unicode=True, echo=echo,
+                                    pool_size=pool_size,
+                                    max_overflow=max_overflow,
+                                    pool_timeout=pool_timeout)
+        self.session_factory = sessionmaker(bind=self.engine)
+        if executor_workers is None:
+            # One thread per connection the pool can hand out
+            executor_workers = pool_size + max_overflow
+        if executor_workers > 0:
+            self.executor = ThreadPoolExecutor(max_workers=executor_workers)
+        else:
+            self.executor = None
+
+    def init_db(self):
+        models.init_db(self.engine)
+
+    def compact_collection_changes(self):
+        return self.run(models.compact_collection_changes, self.engine)
+
+    def session(self):
+        return self.session_factory()
+
+    def run(self, fn, *args, **kwargs):
+        """Calls ``fn(*args, **kwargs)`` on the executor.
+
+        :rtype: tornado.concurrent.Future
+        """
+        future = Future()
+        if self.executor is None:
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except Exception:
+                future.set_exc_info(sys.exc_info())
+            return future
+        submitted = time.perf_counter()
+
+        def call():
+            metrics.DB_EXECUTOR_WAIT.observe(time.perf_counter() - submitted)
+            return fn(*args, **kwargs)
+
+        chain_future(self.executor.submit(call), future)
+        return future
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+        self.engine.dispose()
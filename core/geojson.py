@@ -0,0 +1,86 @@
+import json
+import re
+
+_PLACEHOLDER_KEY = '\x00'
+_PLACEHOLDER_RE = re.compile(r'\{"\\u0000": (\d+)\}')
+# Numbers Python's json would print differently from PostGIS: exponents,
+# values under 1e-4 (repr() switches to exponent form) and negative zero.
+# Every number of ST_AsGeoJSON output follows '[' or ',', and substring
+# checks for these are much cheaper than a regular expression scan
+_REENCODE_MARKERS = ('e-', 'e+', '-0,', '-0]', '[0.0000', ',0.0000',
+                     '-0.0000')
+
+
+def normalize(text):
+    """
+    Formats compact GeoJSON text from ``ST_AsGeoJSON`` the way ``json.dumps``
+    formats the decoded object, without decoding it in the common case.
+
+    ``ST_AsGeoJSON`` of a geography has no string values with commas or
+    colons in them and prints at most 15 significant digits, which
+    ``repr()`` of the parsed float reproduces exactly.
+    """
+    if any(marker in text for marker in _REENCODE_MARKERS):
+        return json.dumps(json.loads(text))
+    return text.replace(',', ', ').replace(':', ': ')
+
+
+# Least positions of a geometry's coordinates, None for a single position
+_MIN_POSITIONS = {'Point': None, 'LineString': 2, 'MultiPoint': 0}
+
+
+def geometry_error(geometry, geometry_type):
+    """
+    Why ``geometry`` is not a GeoJSON ``geometry_type`` of longitude,
+    latitude pairs in range, None if it is.
+
+    Coordinates are checked in bulk rather than position by position:
+    transposed into longitude and latitude tuples, summed, which rejects
+    anything but numbers, and range checked with ``min()`` and ``max()``.
+    """
+    if not isinstance(geometry, dict) or geometry.get('type') != geometry_type:
+        return 'Must be a GeoJSON %s.' % geometry_type
+    positions = geometry.get('coordinates')
+    min_positions = _MIN_POSITIONS[geometry_type]
+    if min_positions is None:
+        positions = [positions]
+    elif not isinstance(positions, list):
+        return 'Must be a GeoJSON %s.' % geometry_type
+    elif len(positions) < min_positions:
+        return 'Must be a GeoJSON %s of at least %d positions.' % (
+            geometry_type, min_positions)
+    if not positions:
+        return None
+    try:
+        if set(map(len, positions)) != {2}:
+            raise TypeError()
+        longitudes, latitudes = zip(*positions)
+        total = sum(longitudes) + sum(latitudes)
+    except TypeError:
+        return 'Coordinates must be [longitude, latitude] pairs of numbers.'
+    # NaN is the only value not equal to itself
+    if (total != total or min(longitudes) < -180 or max(longitudes) > 180 or
+            min(latitudes) < -90 or max(latitudes) > 90):
+        return 'Coordinates are out of range.'
+    return None
+
+
+class Fragments(list):
+    """
+    Pre-rendered GeoJSON texts to splice into a serialized document.
+
+    ``stash()`` returns a placeholder object to serialize in place of the
+    geometry, ``splice()`` swaps placeholders in the JSON output for the
+    stashed texts.
+    """
+    def stash(self, text):
+        if text is None:
+            return None
+        self.append(text)
+        return {_PLACEHOLDER_KEY: len(self) - 1}
+
+    def splice(self, output):
+        if not self:
+            return output
+        return _PLACEHOLDER_RE.sub(
+            lambda m: normalize(self[int(m.group(1))]), output)
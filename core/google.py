@@ -1,3 +1,4 @@
+import copy
 import random
 import time
 from datetime import datetime
@@ -5,7 +6,38 @@ from enum import Enum
 
 import googlemaps
 from googlemaps import convert
-from tornado import gen, httpclient, escape
+from tornado import gen, httpclient, escape, locks
+
+from core import metrics
+from core.backends import DirectionsBackend
+from core.ratelimit import TokenBucket
+
+try:
+    from tornado.curl_httpclient import CurlAsyncHTTPClient
+except ImportError:
+    CurlAsyncHTTPClient = None
+
+DEFAULT_BASE_URL = googlemaps.client._DEFAULT_BASE_URL
+TRANSPORTS = ('simple', 'curl')
+
+
+def make_http_client(transport='simple', max_connections=10):
+    """
+    HTTP client for upstream requests. ``simple`` is tornado's own client,
+    which opens a connection (and a TLS session) per request; ``curl``
+    keeps up to ``max_connections`` connections alive between requests and
+    needs pycurl.
+    """
+    if transport == 'curl':
+        if CurlAsyncHTTPClient is None:
+            raise ValueError('The curl transport needs pycurl installed')
+        return CurlAsyncHTTPClient(force_instance=True,
+                                   max_clients=max_connections)
+    if transport != 'simple':
+        raise ValueError('Transport must be one of: %s' %
+                         ', '.join(TRANSPORTS))
+    return httpclient.AsyncHTTPClient(force_instance=True,
+                                      max_clients=max_connections)
 
 
 class ApiErrorCode(Enum):
@@ -19,22 +51,51 @@ class ApiErrorCode(Enum):
     UNKNOWN_ERROR = 500
 
 
-class AsyncClient(googlemaps.Client):
+class AsyncClient(googlemaps.Client, DirectionsBackend):
     """
     Asynchronous implementation of googlemaps python client
     """
-    def __init__(self, *args, **kwargs):
+    matrix_limits = (25, 100)
+
+    def __init__(self, *args, base_url=DEFAULT_BASE_URL, cache=None,
+                 rate_limiter=None, transport='simple', max_connections=10,
+                 connect_timeout=None, **kwargs):
+        """
+        :param cache: Directions results cache with coroutine methods
+            ``get(params)`` and ``set(params, routes)``, e.g.
+            ``core.cache.DirectionsCache``.
+        :param rate_limiter: Limiter with coroutine method ``acquire()``
+            awaited before every request. Defaults to a process-local
+            ``core.ratelimit.TokenBucket`` at ``queries_per_second``.
+        :param transport: ``simple`` or ``curl``, see ``make_http_client()``.
+        :param max_connections: Requests in flight at a time, more wait in
+            a queue. ``timeout`` (the request timeout) starts after the
+            wait.
+        :param connect_timeout: Seconds to wait for a connection.
+        """
         super(AsyncClient, self).__init__(*args, **kwargs)
-        self.http_client = httpclient.AsyncHTTPClient()
+        self.base_url = base_url
+        self.cache = cache
+        self.rate_limiter = rate_limiter or TokenBucket(
+            self.queries_per_second)
+        # Upstream requests in progress: params key -> [future, callers]
+        self._inflight = {}
+        self.http_client = make_http_client(transport, max_connections)
+        # Queued here rather than in the HTTP client, so the wait is
+        # measured and doesn't count against the request timeout
+        self._connections = locks.Semaphore(max_connections)
+        self.requests_in_flight = 0
         self.requests_kwargs = kwargs.get('requests_kwargs') or {}
         self.requests_kwargs.update({
             "user_agent": googlemaps.client._USER_AGENT,
             "request_timeout": self.timeout,
             "validate_cert": True,  # NOTE(cbro): verify SSL certs.
         })
+        if connect_timeout is not None:
+            self.requests_kwargs["connect_timeout"] = connect_timeout
 
     async def _get(self, url, params, first_request_time=None, retry_counter=0,
-                   base_url=googlemaps.client._DEFAULT_BASE_URL,
+                   base_url=None,
                    accepts_clientid=True, extract_body=None,
                    requests_kwargs=None):
         """Performs _asynchronous_ HTTP GET request with credentials,
@@ -46,17 +107,19 @@ class AsyncClient(googlemaps.Client):
         :param first_request_time: The time of the first request (None if no
             retries have occurred).
         :type first_request_time: datetime.datetime
-        :param retry_counter: The number of this retry, or zero for first attempt.
+        :param retry_counter: The number of this retry, or zero for first
+            attempt.
         :type retry_counter: int
-        :param base_url: The base URL for the request. Defaults to the Maps API
-            server. Should not have a trailing slash.
+        :param base_url: The base URL for the request. Defaults to the client's
+            base_url (the Maps API server). Should not have a trailing slash.
         :type base_url: string
-        :param accepts_clientid: Whether this call supports the client/signature
-            params. Some APIs require API keys (e.g. Roads).
+        :param accepts_clientid: Whether this call supports the
+            client/signature params. Some APIs require API keys (e.g. Roads).
         :type accepts_clientid: bool
-        :param extract_body: A function that extracts the body from the request.
-            If the request was not successful, the function should raise a
-            googlemaps.HTTPError or googlemaps.ApiError as appropriate.
+        :param extract_body: A function that extracts the body from the
+            request. If the request was not successful, the function should
+            raise a googlemaps.HTTPError or googlemaps.ApiError as
+            appropriate.
         :type extract_body: function
         :param requests_kwargs: Same extra keywords arg for requests as per
             __init__, but provided here to allow overriding internally on a
@@ -69,6 +132,9 @@ class AsyncClient(googlemaps.Client):
         """
         if not first_request_time:
             first_request_time = datetime.now()
+        base_url = base_url or self.base_url
+        # e.g. "directions" for /maps/api/directions/json
+        api = url.rsplit('/', 2)[-2]
 
         authed_url = self._generate_auth_url(url, params, accepts_clientid)
         # Default to the client-level self.requests_kwargs, with method-level
@@ -81,45 +147,52 @@ class AsyncClient(googlemaps.Client):
                 raise googlemaps.exceptions.Timeout()
 
             if retry_counter > 0:
-                # 0.5 * (1.5 ^ i) is an increased sleep time of 1.5x per iteration,
-                # starting at 0.5s when retry_counter=0. The first retry will occur
-                # at 1, so subtract that first.
+                # 0.5 * (1.5 ^ i) is an increased sleep time of 1.5x per
+                # iteration, starting at 0.5s when retry_counter=0. The first
+                # retry will occur at 1, so subtract that first.
                 delay_seconds = 0.5 * 1.5 ** (retry_counter - 1)
 
                 # Jitter this value by 50% and pause.
                 await gen.sleep(delay_seconds * (random.random() + 0.5))
 
+            await self.rate_limiter.acquire()
+            queued = time.perf_counter()
+            await self._connections.acquire()
+            started = time.perf_counter()
+            metrics.UPSTREAM_QUEUE_WAIT.labels(api).observe(started - queued)
+            self.requests_in_flight += 1
             try:
                 resp = await self.http_client.fetch(base_url + authed_url,
                                                     **requests_kwargs)
             except httpclient.HTTPError as e:
+                outcome = 'timeout' if e.code == 599 else 'transport_error'
+                metrics.UPSTREAM_DURATION.labels(api, outcome).observe(
+                    time.perf_counter() - started)
                 if e.code == 599:
                     raise googlemaps.exceptions.Timeout()
                 else:
                     raise googlemaps.exceptions.TransportError(e)
+            finally:
+                self.requests_in_flight -= 1
+                self._connections.release()
+            metrics.UPSTREAM_DURATION.labels(api, str(resp.code)).observe(
+                time.perf_counter() - started)
 
             if resp.code in googlemaps.client._RETRIABLE_STATUSES:
                 # Retry request.
+                metrics.UPSTREAM_RETRIES.labels(api, str(resp.code)).inc()
                 retry_counter += 1
                 continue
 
-            # Check if the time of the nth previous query (where n is queries_per_second)
-            # is under a second ago - if so, sleep for the difference.
-            if self.sent_times and len(
-                    self.sent_times) == self.queries_per_second:
-                elapsed_since_earliest = time.time() - self.sent_times[0]
-                if elapsed_since_earliest < 1:
-                    await gen.sleep(1 - elapsed_since_earliest)
-
             try:
                 if extract_body:
                     result = extract_body(resp)
                 else:
                     result = self._get_body(resp)
-                self.sent_times.append(time.time())
                 return result
             except googlemaps.exceptions._RetriableRequest:
                 # Retry request.
+                metrics.UPSTREAM_RETRIES.labels(api, 'over_query_limit').inc()
                 retry_counter += 1
 
     def _get_body(self, resp):
@@ -151,8 +224,8 @@ class AsyncClient(googlemaps.Client):
                          transit_routing_preference=None, traffic_model=None):
         """Get directions between an origin point and a destination point.
 
-        :param origin: The address or latitude/longitude value from which you wish
-            to calculate directions.
+        :param origin: The address or latitude/longitude value from which you
+            wish to calculate directions.
         :type origin: string, dict, list, or tuple
 
         :param destination: The address or latitude/longitude value from which
@@ -168,8 +241,8 @@ class AsyncClient(googlemaps.Client):
         :type waypoints: a single location, or a list of locations, where a
             location is a string, dict, list, or tuple
 
-        :param alternatives: If True, more than one route may be returned in the
-            response.
+        :param alternatives: If True, more than one route may be returned in
+            the response.
         :type alternatives: bool
 
         :param avoid: Indicates that the calculated route(s) should avoid the
@@ -183,8 +256,8 @@ class AsyncClient(googlemaps.Client):
             "metric" or "imperial"
         :type units: string
 
-        :param region: The region code, specified as a ccTLD ("top-level domain"
-            two-character value.
+        :param region: The region code, specified as a ccTLD ("top-level
+            domain" two-character value.
         :type region: string
 
         :param departure_time: Specifies the desired time of departure.
@@ -195,8 +268,8 @@ class AsyncClient(googlemaps.Client):
             arrival_time.
         :type arrival_time: int or datetime.datetime
 
-        :param optimize_waypoints: Optimize the provided route by rearranging the
-            waypoints in a more efficient order.
+        :param optimize_waypoints: Optimize the provided route by rearranging
+            the waypoints in a more efficient order.
         :type optimize_waypoints: bool
 
         :param transit_mode: Specifies one or more preferred modes of transit.
@@ -209,11 +282,11 @@ class AsyncClient(googlemaps.Client):
             requests. Valid values are "less_walking" or "fewer_transfers"
         :type transit_routing_preference: string
 
-        :param traffic_model: Specifies the predictive travel time model to use.
-            Valid values are "best_guess" or "optimistic" or "pessimistic".
-            The traffic_model parameter may only be specified for requests where
-            the travel mode is driving, and where the request includes a
-            departure_time.
+        :param traffic_model: Specifies the predictive travel time model to
+            use. Valid values are "best_guess" or "optimistic" or
+            "pessimistic". The traffic_model parameter may only be specified
+            for requests where the travel mode is driving, and where the
+            request includes a departure_time.
         :type units: string
 
         :rtype: list of routes
@@ -271,5 +344,101 @@ class AsyncClient(googlemaps.Client):
         if traffic_model:
             params["traffic_model"] = traffic_model
 
+        if self.cache is not None:
+            routes = await self.cache.get(params)
+            if routes is not None:
+                return routes
+
+        return await self._single_flight(self._directions, params)
+
+    async def _directions(self, params):
         result = await self._get("/maps/api/directions/json", params)
-        return result["routes"]
+        routes = result["routes"]
+        if self.cache is not None and routes:
+            await self.cache.set(params, routes)
+        return routes
+
+    async def _single_flight(self, fetch, params):
+        """Shares one ``fetch(params)`` call between concurrent calls with the
+        same params. When the request is shared every caller gets its own copy
+        of the result, errors are raised in every caller.
+        """
+        key = tuple(sorted(params.items()))
+        flight = self._inflight.get(key)
+        if flight is None:
+            future = gen.convert_yielded(fetch(params))
+            flight = self._inflight[key] = [future, 0]
+            future.add_done_callback(lambda f: self._inflight.pop(key, None))
+        flight[1] += 1
+
+        result = await flight[0]
+        # Nobody can join once the future is done, so the count is final
+        if flight[1] > 1:
+            result = copy.deepcopy(result)
+        return result
+
+    async def distance_matrix(self, origins, destinations, mode=None,
+                              language=None, avoid=None, units=None,
+                              departure_time=None, arrival_time=None,
+                              transit_mode=None,
+                              transit_routing_preference=None,
+                              traffic_model=None):
+        """Gets travel distance and time for a matrix of origins and
+        destinations. At most 25 origins or destinations and 100 elements
+        per call are allowed by the API.
+
+        :param origins: One or more locations and/or latitude/longitude
+            values, from which to calculate distance and time.
+        :type origins: a single location, or a list of locations
+
+        :param destinations: One or more addresses and/or lat/lng values, to
+            which to calculate distance and time.
+        :type destinations: a single location, or a list of locations
+
+        Other parameters are those of ``directions()``.
+
+        :rtype: list of rows
+        """
+        params = {
+            "origins": convert.location_list(origins),
+            "destinations": convert.location_list(destinations)
+        }
+
+        if mode:
+            if mode not in ["driving", "walking", "bicycling", "transit"]:
+                raise ValueError("Invalid travel mode.")
+            params["mode"] = mode
+
+        if language:
+            params["language"] = language
+
+        if avoid:
+            params["avoid"] = avoid
+
+        if units:
+            params["units"] = units
+
+        if departure_time:
+            params["departure_time"] = convert.time(departure_time)
+
+        if arrival_time:
+            params["arrival_time"] = convert.time(arrival_time)
+
+        if departure_time and arrival_time:
+            raise ValueError("Should not specify both departure_time and"
+                             "arrival_time.")
+
+        if transit_mode:
+            params["transit_mode"] = convert.join_list("|", transit_mode)
+
+        if transit_routing_preference:
+            params["transit_routing_preference"] = transit_routing_preference
+
+        if traffic_model:
+            params["traffic_model"] = traffic_model
+
+        return await self._single_flight(self._distance_matrix, params)
+
+    async def _distance_matrix(self, params):
+        result = await self._get("/maps/api/distancematrix/json", params)
+        return result["rows"]
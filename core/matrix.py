@@ -0,0 +1,163 @@
+"""
+Duration and distance matrices kept in flat ``array`` buffers, and an
+on-disk cache of matrix cells keyed by rounded coordinates.
+"""
+import array
+import dbm
+import math
+import struct
+import time
+
+from core.routing import haversine
+
+MISSING = float('nan')
+UNREACHABLE = float('inf')
+# duration, distance, time stored
+_CELL = struct.Struct('<ddd')
+
+
+class Matrix(object):
+    """
+    Durations (seconds) and distances (metres) between every origin and
+    destination, row-major. Cells not known yet are NaN, cells without a
+    route are infinite.
+    """
+    def __init__(self, origins, destinations):
+        self.origins = origins
+        self.destinations = destinations
+        size = len(origins) * len(destinations)
+        self.durations = array.array('d', [MISSING]) * size
+        self.distances = array.array('d', [MISSING]) * size
+
+    def _index(self, i, j):
+        return i * len(self.destinations) + j
+
+    def get(self, i, j):
+        k = self._index(i, j)
+        return self.durations[k], self.distances[k]
+
+    def set(self, i, j, duration, distance):
+        k = self._index(i, j)
+        self.durations[k] = duration
+        self.distances[k] = distance
+
+    def missing(self):
+        """``(i, j)`` of cells not filled yet"""
+        width = len(self.destinations)
+        return [divmod(k, width) for k, value in enumerate(self.durations)
+                if math.isnan(value)]
+
+    def rows(self, values):
+        """Nested lists of integers, None for cells without a route"""
+        width = len(self.destinations)
+        return [[int(round(v)) if math.isfinite(v) else None
+                 for v in values[k:k + width]]
+                for k in range(0, len(values), width)]
+
+
+def straight_line_costs(locations):
+    """Great-circle distances between every two ``lat,lng`` locations,
+    row-major like ``Matrix.distances``. Raises ValueError for addresses.
+    """
+    points = []
+    for location in locations:
+        lat, lng = (float(v) for v in location.split(','))
+        points.append((lat, lng))
+    costs = array.array('d', [0.0]) * (len(points) ** 2)
+    k = 0
+    for lat1, lng1 in points:
+        for lat2, lng2 in points:
+            costs[k] = haversine(lat1, lng1, lat2, lng2)
+            k += 1
+    return costs
+
+
+def split_blocks(cells, limits=None):
+    """
+    Groups ``(i, j)`` cells into ``(rows, columns)`` blocks to request
+    together, covering no cell twice. Rows missing the same columns share
+    blocks.
+
+    :param limits: ``(max_side, max_elements)`` of a block, or None.
+    """
+    columns_of = {}
+    for i, j in cells:
+        columns_of.setdefault(i, []).append(j)
+    rows_of = {}
+    for i, columns in sorted(columns_of.items()):
+        rows_of.setdefault(tuple(columns), []).append(i)
+
+    blocks = []
+    for columns, rows in rows_of.items():
+        if limits is None:
+            blocks.append((rows, list(columns)))
+            continue
+        max_side, max_elements = limits
+        width = min(max_side, max_elements)
+        for c in range(0, len(columns), width):
+            block_columns = list(columns[c:c + width])
+            height = min(max_side, max_elements // len(block_columns))
+            for r in range(0, len(rows), height):
+                blocks.append((rows[r:r + height], block_columns))
+    return blocks
+
+
+def round_location(location, precision):
+    """``lat,lng`` rounded to ``precision`` digits, addresses normalized"""
+    try:
+        lat, lng = (float(v) for v in location.split(','))
+    except ValueError:
+        return ' '.join(location.lower().split())
+    return '%.*f,%.*f' % (precision, lat, precision, lng)
+
+
+class MatrixCache(object):
+    """
+    Matrix cells in a ``dbm`` file. Locations are rounded to ``precision``
+    decimal digits (4 is about 11 metres), so nearby points share cells.
+    Cells older than ``max_age`` seconds are ignored.
+    """
+    def __init__(self, path, precision=4, max_age=86400):
+        self.path = path
+        self.precision = precision
+        self.max_age = max_age
+        self.db = dbm.open(path, 'c')
+        self.hits = 0
+        self.misses = 0
+
+    def make_key(self, prefix, origin, destination):
+        return '%s|%s|%s' % (prefix,
+                             round_location(origin, self.precision),
+                             round_location(destination, self.precision))
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+    def fill(self, matrix, prefix):
+        """Fills missing cells of ``matrix`` from the cache.
+
+        :param prefix: Part of the key telling apart backends and modes.
+        """
+        expired = time.time() - self.max_age
+        for i, j in matrix.missing():
+            value = self.db.get(self.make_key(prefix, matrix.origins[i],
+                                              matrix.destinations[j]))
+            if value is not None:
+                duration, distance, stored = _CELL.unpack(value)
+                if stored >= expired:
+                    matrix.set(i, j, duration, distance)
+                    self.hits += 1
+                    continue
+            self.misses += 1
+
+    def store(self, matrix, prefix, cells):
+        stored = time.time()
+        for i, j in cells:
+            duration, distance = matrix.get(i, j)
+            if math.isfinite(duration):
+                key = self.make_key(prefix, matrix.origins[i],
+                                    matrix.destinations[j])
+                self.db[key] = _CELL.pack(duration, distance, stored)
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,254 @@
+"""
+Process-local metrics exposed in the Prometheus text format.
+
+Updates are cheap enough to leave on: a labelled child is a dict lookup,
+observing a histogram is a bisect and two additions under an uncontended
+lock (DB executor threads observe too).
+"""
+import bisect
+import math
+import threading
+import time
+
+from tornado.ioloop import IOLoop
+
+DEFAULT_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5,
+                   5, 10)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_value(value):
+    if isinstance(value, int):
+        return str(value)
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (name, str(value).replace('\\', r'\\')
+                     .replace('"', r'\"').replace('\n', r'\n'))
+        for name, value in labels)
+
+
+class Registry(object):
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+
+    def on_collect(self, fn):
+        """Calls ``fn()`` before every exposition, to set values read from
+        elsewhere, e.g. pool sizes"""
+        self.collectors.append(fn)
+
+    def expose(self):
+        for fn in self.collectors:
+            fn()
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.expose())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class _CounterChild(object):
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def set(self, value):
+        """Mirrors a counter kept elsewhere"""
+        self.value = value
+
+    def samples(self):
+        yield '', (), self.value
+
+
+class _GaugeChild(_CounterChild):
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+
+class _HistogramChild(object):
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def time(self):
+        return Timer(self)
+
+    def samples(self):
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            yield '_bucket', (('le', _format_value(bound)),), total
+        yield '_sum', (), self.sum
+        yield '_count', (), total
+
+
+class Metric(object):
+    type_ = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def _new_child(self):
+        raise NotImplementedError()
+
+    def labels(self, *values):
+        """Child metric for label values, in ``labelnames`` order"""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError('%s needs labels %s' % (self.name,
+                                                         self.labelnames))
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def expose(self):
+        yield '# HELP %s %s' % (self.name, self.documentation)
+        yield '# TYPE %s %s' % (self.name, self.type_)
+        for values, child in sorted(self._children.items()):
+            labels = tuple(zip(self.labelnames, values))
+            for suffix, extra, value in child.samples():
+                yield '%s%s%s %s' % (self.name, suffix,
+                                     _format_labels(labels + extra),
+                                     _format_value(value))
+
+
+class Counter(Metric):
+    type_ = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class Gauge(Metric):
+    type_ = 'gauge'
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value):
+        self.labels().set(value)
+
+
+class Histogram(Metric):
+    type_ = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), registry=None,
+                 buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        super(Histogram, self).__init__(name, documentation, labelnames,
+                                        registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def time(self):
+        return Timer(self.labels())
+
+
+class Timer(object):
+    """Context manager observing the time spent in its block"""
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started)
+
+
+class LagMonitor(object):
+    """
+    Measures how late IOLoop timers fire, which is how long callbacks
+    block the loop.
+    """
+    def __init__(self, histogram, interval=0.5, io_loop=None):
+        self.histogram = histogram
+        self.interval = interval
+        self.io_loop = io_loop or IOLoop.current()
+        self._timeout = None
+
+    def start(self):
+        self._expected = self.io_loop.time() + self.interval
+        self._timeout = self.io_loop.call_at(self._expected, self._tick)
+
+    def stop(self):
+        if self._timeout is not None:
+            self.io_loop.remove_timeout(self._timeout)
+            self._timeout = None
+
+    def _tick(self):
+        self.histogram.observe(max(0.0, self.io_loop.time() - self._expected))
+        self.start()
+
+
+REQUEST_DURATION = Histogram(
+    'http_request_duration_seconds', 'Time to serve HTTP requests',
+    ['handler', 'method', 'status'])
+STAGE_DURATION = Histogram(
+    'http_request_stage_duration_seconds',
+    'Time spent in stages of request handling',
+    ['handler', 'stage'])
+REQUESTS_IN_FLIGHT = Gauge(
+    'http_requests_in_flight', 'HTTP requests being served')
+UPSTREAM_DURATION = Histogram(
+    'upstream_request_duration_seconds',
+    'Upstream API request time, per attempt', ['api', 'outcome'])
+UPSTREAM_RETRIES = Counter(
+    'upstream_retries_total', 'Upstream API request retries',
+    ['api', 'reason'])
+UPSTREAM_QUEUE_WAIT = Histogram(
+    'upstream_queue_wait_seconds',
+    'Time upstream requests wait for a free connection', ['api'])
+UPSTREAM_IN_FLIGHT = Gauge(
+    'upstream_requests_in_flight', 'Upstream API requests being made')
+RATE_LIMIT_WAIT = Histogram(
+    'rate_limiter_wait_seconds', 'Time waited for rate limiter tokens')
+DB_EXECUTOR_WAIT = Histogram(
+    'db_executor_wait_seconds', 'Time DB calls wait for an executor thread')
+DB_POOL_CONNECTIONS = Gauge(
+    'db_pool_connections', 'DB connection pool connections', ['state'])
+IOLOOP_BLOCKED = Counter(
+    'ioloop_blocked_total', 'IOLoop stalls reported by the watchdog')
+IOLOOP_LAG = Histogram(
+    'ioloop_lag_seconds', 'Delay of IOLoop timer callbacks',
+    buckets=(.001, .005, .01, .025, .05, .1, .25, .5, 1, 5))
+CACHE_REQUESTS = Counter(
+    'cache_requests_total', 'Cache lookups', ['cache', 'result'])
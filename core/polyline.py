@@ -0,0 +1,69 @@
+"""
+Google encoded polyline algorithm format:
+https://developers.google.com/maps/documentation/utilities/polylinealgorithm
+
+Points are ``(lat, lng)`` pairs, like in Google responses. GeoJSON
+coordinates are ``[lng, lat]``.
+"""
+
+
+def _encode_value(value, chunks):
+    value = ~(value << 1) if value < 0 else value << 1
+    while value >= 0x20:
+        chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+        value >>= 5
+    chunks.append(chr(value + 63))
+
+
+def encode(points, precision=5):
+    """Encodes a sequence of ``(lat, lng)`` points into a polyline string"""
+    factor = 10 ** precision
+    chunks = []
+    prev_lat = prev_lng = 0
+    for lat, lng in points:
+        lat = int(round(lat * factor))
+        lng = int(round(lng * factor))
+        _encode_value(lat - prev_lat, chunks)
+        _encode_value(lng - prev_lng, chunks)
+        prev_lat, prev_lng = lat, lng
+    return ''.join(chunks)
+
+
+def decode(polyline, precision=5):
+    """Decodes a polyline string into a list of ``(lat, lng)`` tuples.
+
+    :raises ValueError: if the string is not a valid encoded polyline.
+    """
+    factor = float(10 ** precision)
+    values = []
+    value = shift = 0
+    for char in polyline:
+        byte = ord(char) - 63
+        if not 0 <= byte < 64:
+            raise ValueError('Invalid polyline character %r' % char)
+        value |= (byte & 0x1f) << shift
+        if byte & 0x20:
+            shift += 5
+            continue
+        values.append(~(value >> 1) if value & 1 else value >> 1)
+        value = shift = 0
+    if shift or len(values) % 2:
+        raise ValueError('Truncated polyline')
+
+    points = []
+    lat = lng = 0
+    for i in range(0, len(values), 2):
+        lat += values[i]
+        lng += values[i + 1]
+        points.append((lat / factor, lng / factor))
+    return points
+
+
+def from_geojson(coordinates, precision=5):
+    """Encodes GeoJSON ``[lng, lat]`` coordinates"""
+    return encode(((lat, lng) for lng, lat in coordinates), precision)
+
+
+def to_geojson(polyline, precision=5):
+    """Decodes a polyline into GeoJSON ``[lng, lat]`` coordinates"""
+    return [[lng, lat] for lat, lng in decode(polyline, precision)]
@@ -0,0 +1,94 @@
+import time
+
+from sqlalchemy import text
+from tornado import gen
+from tornado.concurrent import is_future
+
+from core import metrics
+
+
+class MemoryBackend(object):
+    """
+    Token bucket state of a single process
+    """
+    def __init__(self):
+        self.tat = 0.0
+
+    def reserve(self, interval, tolerance):
+        """Books the next token and returns seconds to wait for it.
+
+        Token bucket as the generic cell rate algorithm: ``tat`` is the
+        theoretical arrival time of the next request, a request may go
+        ``tolerance`` seconds ahead of it.
+        """
+        now = time.time()
+        tat = max(self.tat, now)
+        self.tat = tat + interval
+        return max(0.0, tat - tolerance - now)
+
+
+class DatabaseBackend(object):
+    """
+    Token bucket state in the ``rate_limit`` table, shared by all processes
+    using the same database. The row update is atomic, so concurrent
+    workers get consecutive reservations.
+    """
+    insert = text(
+        'INSERT INTO rate_limit (name, tat) VALUES (:name, 0) '
+        'ON CONFLICT (name) DO NOTHING'
+    )
+    # clock_timestamp(), now() is the start of the transaction. Read once,
+    # so the new TAT and the wait are computed from the same time.
+    update = text(
+        'UPDATE rate_limit '
+        'SET tat = greatest(tat, clock.now) + :interval '
+        'FROM (SELECT extract(epoch FROM clock_timestamp()) AS now) AS clock '
+        'WHERE name = :name '
+        'RETURNING greatest(0, tat - :interval - :tolerance - clock.now) '
+        'AS wait'
+    )
+
+    def __init__(self, db, name='google'):
+        self.db = db
+        self.name = name
+        self._created = False
+
+    def _reserve(self, interval, tolerance):
+        with self.db.engine.begin() as connection:
+            if not self._created:
+                connection.execute(self.insert, name=self.name)
+                self._created = True
+            return float(connection.execute(
+                self.update, name=self.name, interval=interval,
+                tolerance=tolerance).scalar())
+
+    def reserve(self, interval, tolerance):
+        return self.db.run(self._reserve, interval, tolerance)
+
+
+class TokenBucket(object):
+    """
+    Asynchronous token bucket rate limiter.
+
+    ``rate`` tokens per second are added up to ``burst`` tokens. Tokens are
+    reserved in the order ``acquire()`` is called, so waiters are served
+    first come, first served.
+    """
+    def __init__(self, rate, burst=1, backend=None):
+        self.interval = 1.0 / rate
+        self.tolerance = (max(burst, 1) - 1) * self.interval
+        self.backend = backend or MemoryBackend()
+        self.waits = 0
+        self.wait_time = 0.0
+
+    async def acquire(self):
+        """Waits for a token, returns the time waited in seconds"""
+        delay = self.backend.reserve(self.interval, self.tolerance)
+        if is_future(delay):
+            delay = await delay
+        metrics.RATE_LIMIT_WAIT.observe(delay)
+        if delay > 0:
+            self.waits += 1
+            self.wait_time += delay
+            await gen.sleep(delay)
+        return delay
@@ -0,0 +1,426 @@
+"""
+Offline routing over a road graph loaded from a file, answering directions
+queries in-process with Google Directions API compatible routes.
+
+Graph files are either OpenStreetMap XML (``.osm``) or JSON::
+
+    {"nodes": [[lat, lng], ...],
+     "edges": [[from_node, to_node, speed_kmh, name, oneway], ...]}
+
+where nodes are referenced by their position in the ``nodes`` list.
+"""
+import heapq
+import json
+import math
+import xml.etree.ElementTree as ElementTree
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import googlemaps
+from tornado.concurrent import Future, chain_future
+
+from core import polyline
+from core.backends import DirectionsBackend
+
+EARTH_RADIUS = 6371008.8
+# Default speeds of OSM highway types, km/h
+HIGHWAY_SPEEDS = {
+    'motorway': 110, 'motorway_link': 60,
+    'trunk': 90, 'trunk_link': 50,
+    'primary': 70, 'primary_link': 50,
+    'secondary': 60, 'secondary_link': 40,
+    'tertiary': 50, 'tertiary_link': 40,
+    'unclassified': 40, 'road': 30, 'residential': 30,
+    'living_street': 10, 'service': 20, 'track': 15,
+}
+# Modes moving at their own speed regardless of the road, km/h
+MODE_SPEEDS = {'walking': 5, 'bicycling': 15}
+GRID_CELL = 0.01
+# How far to look for the nearest node, in grid cells
+MAX_SNAP_CELLS = 50
+
+
+def haversine(lat1, lng1, lat2, lng2):
+    """Great-circle distance in metres"""
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2 +
+         math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2)
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(a))
+
+
+class RoadGraph(object):
+    """
+    Directed road graph. Nodes are kept in coordinate lists and adjacency
+    lists of ``(to_node, distance_m, duration_s, name, forward)`` tuples,
+    where ``forward`` is False for the opposite direction of oneway roads
+    (usable on foot only).
+    """
+    def __init__(self):
+        self.lats = []
+        self.lngs = []
+        self.edges = []
+        self.max_speed = 1.0
+        self._grid = {}
+
+    def __len__(self):
+        return len(self.lats)
+
+    def add_node(self, lat, lng):
+        node = len(self.lats)
+        self.lats.append(lat)
+        self.lngs.append(lng)
+        self.edges.append([])
+        cell = (int(math.floor(lat / GRID_CELL)),
+                int(math.floor(lng / GRID_CELL)))
+        self._grid.setdefault(cell, []).append(node)
+        return node
+
+    def add_edge(self, a, b, speed, name=None, oneway=False):
+        """Adds a road from node ``a`` to ``b``, ``speed`` in km/h"""
+        distance = haversine(self.lats[a], self.lngs[a],
+                             self.lats[b], self.lngs[b])
+        speed = speed / 3.6
+        self.max_speed = max(self.max_speed, speed)
+        duration = distance / speed
+        self.edges[a].append((b, distance, duration, name, True))
+        self.edges[b].append((a, distance, duration, name, not oneway))
+
+    @classmethod
+    def load(cls, path):
+        if path.endswith('.osm'):
+            return cls.from_osm(path)
+        return cls.from_json(path)
+
+    @classmethod
+    def from_json(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        graph = cls()
+        for lat, lng in data['nodes']:
+            graph.add_node(lat, lng)
+        for a, b, speed, name, oneway in data['edges']:
+            graph.add_edge(a, b, speed, name, oneway)
+        return graph
+
+    @classmethod
+    def from_osm(cls, path):
+        """Builds the graph of drivable ways of an OpenStreetMap XML file"""
+        coordinates = {}
+        ways = []
+        for _, element in ElementTree.iterparse(path):
+            if element.tag == 'node':
+                coordinates[element.get('id')] = (float(element.get('lat')),
+                                                  float(element.get('lon')))
+            elif element.tag == 'way':
+                tags = {tag.get('k'): tag.get('v')
+                        for tag in element.iter('tag')}
+                if tags.get('highway') in HIGHWAY_SPEEDS:
+                    refs = [nd.get('ref') for nd in element.iter('nd')]
+                    ways.append((refs, tags))
+            if element.tag in ('node', 'way', 'relation'):
+                element.clear()
+
+        graph = cls()
+        nodes = {}
+        for refs, tags in ways:
+            speed = HIGHWAY_SPEEDS[tags['highway']]
+            try:
+                speed = float(tags.get('maxspeed', speed))
+            except ValueError:
+                pass
+            oneway = tags.get('oneway') in ('yes', 'true', '1')
+            previous = None
+            for ref in refs:
+                if ref not in coordinates:
+                    previous = None
+                    continue
+                if ref not in nodes:
+                    nodes[ref] = graph.add_node(*coordinates[ref])
+                if previous is not None:
+                    graph.add_edge(previous, nodes[ref], speed,
+                                   tags.get('name'), oneway)
+                previous = nodes[ref]
+        return graph
+
+    def nearest(self, lat, lng):
+        """Closest node to the point, None if there is none nearby"""
+        row = int(math.floor(lat / GRID_CELL))
+        column = int(math.floor(lng / GRID_CELL))
+        best, best_distance, first_hit_radius = None, None, None
+        for radius in range(MAX_SNAP_CELLS + 1):
+            for i in range(row - radius, row + radius + 1):
+                for j in range(column - radius, column + radius + 1):
+                    if max(abs(i - row), abs(j - column)) != radius:
+                        continue
+                    for node in self._grid.get((i, j), ()):
+                        distance = haversine(lat, lng, self.lats[node],
+                                             self.lngs[node])
+                        if best is None or distance < best_distance:
+                            best, best_distance = node, distance
+            # Nodes of the next ring can still be closer than a corner
+            # of this one, so stop one ring after the first hit
+            if best is not None:
+                if first_hit_radius is None:
+                    first_hit_radius = radius
+                elif radius > first_hit_radius:
+                    return best
+        return best
+
+    def shortest_path(self, source, target, mode='driving'):
+        """A* search minimizing travel time.
+
+        :returns: list of ``(node, edge)`` steps from ``source`` to
+            ``target``, edge is None for the source; None if unreachable.
+        """
+        mode_speed = MODE_SPEEDS.get(mode)
+        speed = mode_speed / 3.6 if mode_speed else self.max_speed
+        target_lat, target_lng = self.lats[target], self.lngs[target]
+
+        def heuristic(node):
+            return haversine(self.lats[node], self.lngs[node],
+                             target_lat, target_lng) / speed
+
+        costs = {source: 0.0}
+        came_from = {source: None}
+        queue = [(heuristic(source), source)]
+        while queue:
+            _, node = heapq.heappop(queue)
+            if node == target:
+                break
+            cost = costs[node]
+            for edge in self.edges[node]:
+                to, distance, duration, name, forward = edge
+                if not forward and mode != 'walking':
+                    continue
+                if mode_speed:
+                    duration = distance / speed
+                new_cost = cost + duration
+                if new_cost < costs.get(to, float('inf')):
+                    costs[to] = new_cost
+                    came_from[to] = (node, edge)
+                    heapq.heappush(queue, (new_cost + heuristic(to), to))
+        else:
+            return None
+
+        path = []
+        node = target
+        while came_from[node] is not None:
+            previous, edge = came_from[node]
+            path.append((node, edge))
+            node = previous
+        path.append((source, None))
+        path.reverse()
+        return path
+
+    def travel_times(self, source, targets, mode='driving'):
+        """Dijkstra search from ``source`` until every target is reached.
+
+        :returns: dict of reachable target -> ``(duration_s, distance_m)``
+        """
+        mode_speed = MODE_SPEEDS.get(mode)
+        speed = mode_speed / 3.6 if mode_speed else None
+        remaining = set(targets)
+        found = {}
+        costs = {source: 0.0}
+        queue = [(0.0, 0.0, source)]
+        while queue and remaining:
+            cost, length, node = heapq.heappop(queue)
+            if cost > costs[node]:
+                continue
+            if node in remaining:
+                remaining.discard(node)
+                found[node] = (cost, length)
+            for to, distance, duration, name, forward in self.edges[node]:
+                if not forward and mode != 'walking':
+                    continue
+                if speed:
+                    duration = distance / speed
+                new_cost = cost + duration
+                if new_cost < costs.get(to, float('inf')):
+                    costs[to] = new_cost
+                    heapq.heappush(queue, (new_cost, length + distance, to))
+        return found
+
+
+def parse_location(value):
+    try:
+        lat, lng = (float(v) for v in value.split(','))
+    except (AttributeError, ValueError):
+        raise googlemaps.exceptions.ApiError(
+            'INVALID_REQUEST',
+            'Local routing needs locations as "lat,lng", got %r.' % value)
+    return lat, lng
+
+
+def distance_text(metres):
+    if metres >= 1000:
+        return '%.1f km' % (metres / 1000.0)
+    return '%d m' % round(metres)
+
+
+def duration_text(seconds):
+    minutes = max(1, int(round(seconds / 60.0)))
+    if minutes >= 60:
+        hours, minutes = divmod(minutes, 60)
+        return '%d hour%s %d mins' % (hours, '' if hours == 1 else 's',
+                                      minutes)
+    return '%d min%s' % (minutes, '' if minutes == 1 else 's')
+
+
+def _location(graph, node):
+    return {'lat': graph.lats[node], 'lng': graph.lngs[node]}
+
+
+class LocalRouter(DirectionsBackend):
+    """
+    Directions backend searching a ``RoadGraph`` in-process. Searches run
+    on a thread pool to keep them off the IOLoop.
+    """
+    copyrights = 'Map data (c) OpenStreetMap contributors'
+
+    def __init__(self, graph, executor=None):
+        self.graph = graph
+        self.executor = executor or ThreadPoolExecutor(max_workers=2)
+
+    async def directions(self, origin, destination, mode=None, waypoints=None,
+                         language=None, **kwargs):
+        future = Future()
+        chain_future(self.executor.submit(
+            self.route, origin, destination, mode or 'driving',
+            waypoints or []), future)
+        return await future
+
+    async def distance_matrix(self, origins, destinations, mode=None,
+                              language=None, **kwargs):
+        future = Future()
+        chain_future(self.executor.submit(
+            self.matrix, origins, destinations, mode or 'driving'), future)
+        return await future
+
+    def _check_mode(self, mode):
+        if mode not in ('driving', 'walking', 'bicycling'):
+            raise googlemaps.exceptions.ApiError(
+                'INVALID_REQUEST',
+                'Local routing does not support %s mode.' % mode)
+
+    def matrix(self, origins, destinations, mode):
+        self._check_mode(mode)
+        targets = [self.graph.nearest(*parse_location(d))
+                   for d in destinations]
+        rows = []
+        for origin in origins:
+            source = self.graph.nearest(*parse_location(origin))
+            found = {}
+            if source is not None:
+                found = self.graph.travel_times(
+                    source, [t for t in targets if t is not None], mode)
+            elements = []
+            for target in targets:
+                if target not in found:
+                    elements.append({'status': 'ZERO_RESULTS'})
+                    continue
+                duration, distance = found[target]
+                elements.append({
+                    'status': 'OK',
+                    'duration': {'text': duration_text(duration),
+                                 'value': int(round(duration))},
+                    'distance': {'text': distance_text(distance),
+                                 'value': int(round(distance))},
+                })
+            rows.append({'elements': elements})
+        return rows
+
+    def route(self, origin, destination, mode, waypoints):
+        self._check_mode(mode)
+        if isinstance(waypoints, str):
+            waypoints = [waypoints]
+        addresses = [origin] + list(waypoints) + [destination]
+        nodes = []
+        for address in addresses:
+            node = self.graph.nearest(*parse_location(address))
+            if node is None:
+                return []
+            nodes.append(node)
+
+        legs = []
+        points = []
+        for i in range(len(nodes) - 1):
+            path = self.graph.shortest_path(nodes[i], nodes[i + 1], mode)
+            if path is None:
+                return []
+            legs.append(self._leg(path, addresses[i], addresses[i + 1], mode))
+            leg_points = [(self.graph.lats[n], self.graph.lngs[n])
+                          for n, _ in path]
+            points.extend(leg_points[1:] if points else leg_points)
+
+        names = Counter(step['name'] for leg in legs for step in leg['steps']
+                        if step['name'])
+        lats = [lat for lat, _ in points]
+        lngs = [lng for _, lng in points]
+        for leg in legs:
+            for step in leg['steps']:
+                del step['name']
+        return [{
+            'bounds': {
+                'northeast': {'lat': max(lats), 'lng': max(lngs)},
+                'southwest': {'lat': min(lats), 'lng': min(lngs)},
+            },
+            'copyrights': self.copyrights,
+            'legs': legs,
+            'overview_polyline': {'points': polyline.encode(points)},
+            'summary': names.most_common(1)[0][0] if names else '',
+            'warnings': [],
+            'waypoint_order': list(range(len(waypoints))),
+        }]
+
+    def _leg(self, path, start_address, end_address, mode):
+        graph = self.graph
+        mode_speed = MODE_SPEEDS.get(mode)
+        steps = []
+        for node, edge in path[1:]:
+            _, distance, duration, name, _ = edge
+            if mode_speed:
+                duration = distance / (mode_speed / 3.6)
+            if steps and steps[-1]['name'] == name:
+                step = steps[-1]
+            else:
+                step = {
+                    'name': name,
+                    'distance': 0.0,
+                    'duration': 0.0,
+                    'start_location': (steps[-1]['end_location']
+                                       if steps else
+                                       _location(graph, path[0][0])),
+                    'points': ([steps[-1]['points'][-1]] if steps else
+                               [(graph.lats[path[0][0]],
+                                 graph.lngs[path[0][0]])]),
+                    'html_instructions': ('Continue on <b>%s</b>' % name
+                                          if name else 'Continue'),
+                    'travel_mode': mode.upper(),
+                }
+                steps.append(step)
+            step['distance'] += distance
+            step['duration'] += duration
+            step['end_location'] = _location(graph, node)
+            step['points'].append((graph.lats[node], graph.lngs[node]))
+
+        distance = sum(step['distance'] for step in steps)
+        duration = sum(step['duration'] for step in steps)
+        for step in steps:
+            step['polyline'] = {'points': polyline.encode(step.pop('points'))}
+            step['distance'] = {'text': distance_text(step['distance']),
+                                'value': int(round(step['distance']))}
+            step['duration'] = {'text': duration_text(step['duration']),
+                                'value': int(round(step['duration']))}
+        return {
+            'distance': {'text': distance_text(distance),
+                         'value': int(round(distance))},
+            'duration': {'text': duration_text(duration),
+                         'value': int(round(duration))},
+            'start_address': start_address,
+            'start_location': _location(graph, path[0][0]),
+            'end_address': end_address,
+            'end_location': _location(graph, path[-1][0]),
+            'steps': steps,
+            'via_waypoint': [],
+        }
@@ -0,0 +1,133 @@
+"""
+Waypoint order optimisation: the shortest open path between fixed ends
+through every stop, over an asymmetric duration matrix. A nearest
+neighbour tour is improved with 2-opt and Or-opt moves until neither
+helps or the time limit is reached.
+
+Matrices are flat row-major sequences of ``n * n`` costs, like
+``core.matrix.Matrix.durations``. Pairs without a route may be infinite
+or NaN.
+"""
+import math
+import time
+
+# Cost of a pair without a route, finite so that move deltas stay numbers
+UNREACHABLE_COST = 1e12
+
+
+def path_cost(costs, n, tour):
+    return sum(costs[a * n + b] for a, b in zip(tour, tour[1:]))
+
+
+def nearest_neighbour(costs, n, start=0, end=None):
+    """Tour from ``start`` to ``end`` (the last stop by default), always
+    going to the closest stop not visited yet"""
+    end = n - 1 if end is None else end
+    unvisited = set(range(n)) - {start, end}
+    tour = [start]
+    current = start
+    while unvisited:
+        row = current * n
+        current = min(unvisited, key=lambda j: costs[row + j])
+        unvisited.discard(current)
+        tour.append(current)
+    tour.append(end)
+    return tour
+
+
+def two_opt(costs, n, tour, deadline=None):
+    """Reverses segments of ``tour`` in place while that makes it shorter.
+    Reversal deltas take O(1) using prefix sums of the path cost in both
+    directions, as the matrix is asymmetric.
+
+    :returns: whether the tour was improved.
+    """
+    m = len(tour)
+    improved = False
+    restart = True
+    while restart:
+        restart = False
+        forward = [0.0] * m
+        backward = [0.0] * m
+        for k in range(1, m):
+            a, b = tour[k - 1], tour[k]
+            forward[k] = forward[k - 1] + costs[a * n + b]
+            backward[k] = backward[k - 1] + costs[b * n + a]
+
+        for i in range(1, m - 2):
+            if deadline is not None and time.time() > deadline:
+                return improved
+            before = tour[i - 1]
+            first = tour[i]
+            removed_in = costs[before * n + first]
+            for j in range(i + 1, m - 1):
+                last, after = tour[j], tour[j + 1]
+                delta = (costs[before * n + last] +
+                         costs[first * n + after] -
+                         removed_in - costs[last * n + after] +
+                         (backward[j] - backward[i]) -
+                         (forward[j] - forward[i]))
+                if delta < -1e-9:
+                    tour[i:j + 1] = tour[j:i - 1:-1]
+                    improved = restart = True
+                    break
+            if restart:
+                break
+    return improved
+
+
+def or_opt(costs, n, tour, deadline=None, max_segment=3):
+    """Moves segments of up to ``max_segment`` stops elsewhere in ``tour``,
+    in place, while that makes it shorter.
+
+    :returns: whether the tour was improved.
+    """
+    improved = False
+    restart = True
+    while restart:
+        restart = False
+        m = len(tour)
+        for length in range(1, max_segment + 1):
+            for i in range(1, m - length):
+                if deadline is not None and time.time() > deadline:
+                    return improved
+                head, tail = tour[i], tour[i + length - 1]
+                before, after = tour[i - 1], tour[i + length]
+                gain = (costs[before * n + head] + costs[tail * n + after] -
+                        costs[before * n + after])
+                for k in range(m - 1):
+                    if i - 1 <= k < i + length:
+                        continue
+                    a, b = tour[k], tour[k + 1]
+                    delta = (costs[a * n + head] + costs[tail * n + b] -
+                             costs[a * n + b] - gain)
+                    if delta < -1e-9:
+                        segment = tour[i:i + length]
+                        del tour[i:i + length]
+                        k = k if k < i else k - length
+                        tour[k + 1:k + 1] = segment
+                        improved = restart = True
+                        break
+                if restart:
+                    break
+            if restart:
+                break
+    return improved
+
+
+def optimize(costs, n, start=0, end=None, time_limit=None):
+    """Visiting order of all ``n`` stops from ``start`` to ``end``.
+
+    :param time_limit: Seconds to spend improving the initial tour, None
+        to run until no move helps.
+    :rtype: list of stop indexes
+    """
+    costs = [c if math.isfinite(c) else UNREACHABLE_COST for c in costs]
+    deadline = None if time_limit is None else time.time() + time_limit
+    tour = nearest_neighbour(costs, n, start, end)
+    while True:
+        improved = two_opt(costs, n, tour, deadline)
+        improved = or_opt(costs, n, tour, deadline) or improved
+        if not improved or (deadline is not None and
+                            time.time() > deadline):
+            return tour
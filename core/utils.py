@@ -1,3 +1,14 @@
+import base64
+import binascii
+import re
+from datetime import datetime, timedelta, timezone
+
+from tornado import escape
+
+_TIMESTAMP = re.compile(
+    r'(\d{4})-(\d{2})-(\d{2})T(\d{2}):(\d{2}):(\d{2})(?:\.(\d{1,6}))?'
+    r'(?:([+-])(\d{2}):(\d{2}))?$')
+
 
 def row_to_dict(row):
     return dict(zip(row.keys(), row))
@@ -7,3 +18,47 @@ def dasherize(text):
     return text.replace('_', '-')
 
 
+def parse_timestamp(value):
+    """``datetime`` of a ``datetime.isoformat()`` string, aware if it has
+    an offset. Raises ValueError for anything else."""
+    match = _TIMESTAMP.match(value)
+    if match is None:
+        raise ValueError('Invalid timestamp %r.' % value)
+    (year, month, day, hour, minute, second, fraction, sign, offset_hours,
+     offset_minutes) = match.groups()
+    tzinfo = None
+    if sign:
+        offset = timedelta(hours=int(offset_hours),
+                           minutes=int(offset_minutes))
+        tzinfo = timezone(-offset if sign == '-' else offset)
+    return datetime(int(year), int(month), int(day), int(hour), int(minute),
+                    int(second), int((fraction or '').ljust(6, '0')),
+                    tzinfo)
+
+
+def encode_cursor(*values):
+    """Opaque URL-safe pagination cursor from JSON-serializable values."""
+    raw = escape.utf8(escape.json_encode(values))
+    return escape.native_str(base64.urlsafe_b64encode(raw)).rstrip('=')
+
+
+def decode_cursor(cursor, *parsers):
+    """Inverse of ``encode_cursor()``. With ``parsers`` the cursor must
+    hold as many values, each is converted by its parser. Raises ValueError
+    for bad input."""
+    padding = '=' * (-len(cursor) % 4)
+    try:
+        raw = base64.urlsafe_b64decode(escape.utf8(cursor + padding))
+        values = escape.json_decode(raw)
+    except (TypeError, binascii.Error, UnicodeDecodeError) as e:
+        raise ValueError(str(e))
+    if not isinstance(values, list):
+        raise ValueError('Cursor must encode a list.')
+    if parsers:
+        if len(values) != len(parsers):
+            raise ValueError('Cursor must hold %d values.' % len(parsers))
+        try:
+            values = [parse(value) for parse, value in zip(parsers, values)]
+        except (AttributeError, TypeError, ValueError) as e:
+            raise ValueError(str(e))
+    return values
@@ -0,0 +1,129 @@
+"""
+Diagnostics of the IOLoop thread, run from background threads: a watchdog
+logging what blocks the loop, and a sampling profiler writing collapsed
+stacks (``flamegraph.pl``, speedscope).
+"""
+import collections
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+from tornado.ioloop import IOLoop, PeriodicCallback
+from tornado.web import RequestHandler
+
+from core import metrics
+
+
+def handler_context(frame):
+    """Describes the request handled in ``frame`` or the frames calling
+    it, None if there is no request handler among them"""
+    while frame is not None:
+        handler = frame.f_locals.get('self')
+        if isinstance(handler, RequestHandler):
+            request = handler.request
+            return '%s %s %s' % (type(handler).__name__, request.method,
+                                 request.uri)
+        frame = frame.f_back
+    return None
+
+
+class BlockingWatchdog(object):
+    """
+    Logs the IOLoop thread stack when the loop has not run a callback for
+    ``threshold`` seconds, once per stall, with the request being handled.
+
+    The loop beats every ``threshold / 2`` seconds; a daemon thread checks
+    the last beat.
+    """
+    def __init__(self, threshold, io_loop=None):
+        self.threshold = threshold
+        self.io_loop = io_loop or IOLoop.current()
+        self._beat = PeriodicCallback(self._heartbeat, threshold * 500,
+                                      io_loop=self.io_loop)
+        self._last_beat = time.monotonic()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._loop_thread = None
+
+    def start(self):
+        self._loop_thread = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._beat.start()
+        self._thread = threading.Thread(target=self._watch,
+                                        name='ioloop-watchdog', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._beat.stop()
+        self._stopped.set()
+
+    def _heartbeat(self):
+        self._last_beat = time.monotonic()
+
+    def _watch(self):
+        reported = None
+        while not self._stopped.wait(self.threshold / 4):
+            last_beat = self._last_beat
+            blocked = time.monotonic() - last_beat
+            if blocked < self.threshold or reported == last_beat:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            reported = last_beat
+            metrics.IOLOOP_BLOCKED.inc()
+            logging.warning(
+                'IOLoop blocked for %.0fms, handling %s:\n%s',
+                blocked * 1000, handler_context(frame) or 'no request',
+                ''.join(traceback.format_stack(frame)))
+
+
+def _frame_name(code):
+    filename = os.path.relpath(code.co_filename)
+    if filename.startswith('..'):
+        filename = os.path.basename(code.co_filename)
+    return ('%s:%s' % (filename, code.co_name)).replace(';', ':') \
+        .replace(' ', '_')
+
+
+class SamplingProfiler(object):
+    """
+    Samples the IOLoop thread stack every ``interval`` seconds for
+    ``duration`` seconds, then writes the samples to ``path`` as collapsed
+    stacks: one ``outer;...;inner count`` line per distinct stack.
+    """
+    def __init__(self, path, duration=30, interval=0.005):
+        self.path = path
+        self.duration = duration
+        self.interval = interval
+        self.samples = collections.Counter()
+        self._loop_thread = None
+
+    def start(self):
+        self._loop_thread = threading.get_ident()
+        thread = threading.Thread(target=self._run, name='sampling-profiler',
+                                  daemon=True)
+        thread.start()
+
+    def _run(self):
+        deadline = time.monotonic() + self.duration
+        while time.monotonic() < deadline:
+            frame = sys._current_frames().get(self._loop_thread)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+            time.sleep(self.interval)
+        self.write()
+
+    def write(self):
+        with open(self.path, 'w') as f:
+            for stack, count in self.samples.most_common():
+                f.write('%s %d\n' % (stack, count))
+        logging.info('Wrote %d profile samples to %s',
+                     sum(self.samples.values()), self.path)
@@ -1,5 +1,10 @@
+import time
+
 from marshmallow import Schema, fields
 from tornado import web, escape
+from tornado.concurrent import Future, chain_future
+
+from core import metrics
 
 
 class JSONAPIErrorSchema(Schema):
@@ -13,9 +18,64 @@ class JSONAPIErrorsSchema(Schema):
 
 
 class BaseHandler(web.RequestHandler):
+    _db_session = None
+    _active = False
+
     @property
     def db(self):
-        return self.application.db
+        """Per-request session. Use it only inside ``run_db()`` calls."""
+        if self._db_session is None:
+            self._db_session = self.application.db.session()
+        return self._db_session
+
+    def run_db(self, fn, *args, **kwargs):
+        """Runs blocking ``fn`` on the application's DB executor."""
+        stage = metrics.STAGE_DURATION.labels(type(self).__name__, 'db')
+        started = time.perf_counter()
+        future = self.application.db.run(fn, *args, **kwargs)
+        future.add_done_callback(
+            lambda f: stage.observe(time.perf_counter() - started))
+        return future
+
+    def run_cpu(self, fn, *args, **kwargs):
+        """Runs CPU bound ``fn`` on the application's executor"""
+        future = Future()
+        chain_future(self.application.executor.submit(fn, *args, **kwargs),
+                     future)
+        return future
+
+    def stage(self, name):
+        """Times a stage of handling the request::
+
+            with self.stage('serialize'):
+                ...
+        """
+        return metrics.STAGE_DURATION.labels(type(self).__name__,
+                                             name).time()
+
+    def prepare(self):
+        # In-flight requests are drained on graceful shutdown
+        self.application.active_requests += 1
+        self._active = True
+
+    def _request_done(self):
+        if self._active:
+            self._active = False
+            self.application.active_requests -= 1
+
+    def on_connection_close(self):
+        self._request_done()
+
+    def on_finish(self):
+        self._request_done()
+        metrics.REQUEST_DURATION.labels(
+            type(self).__name__, self.request.method,
+            str(self.get_status())).observe(self.request.request_time())
+        if self._db_session is not None:
+            # Closing rolls back and returns the connection to the pool,
+            # so it is done off the IOLoop as well.
+            self.application.db.run(self._db_session.close)
+            self._db_session = None
 
     @property
     def googlemaps(self):
@@ -25,7 +85,8 @@ class BaseHandler(web.RequestHandler):
         self.set_header('Content-Type', 'application/vnd.api+json')
         self.set_header('Access-Control-Allow-Origin', '*')
         self.set_header('Access-Control-Allow-Methods', 'GET, POST, PUT, DELETE')
-        self.set_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.set_header('Access-Control-Allow-Headers',
+                        'Content-Type, Idempotency-Key')
 
     def write_error(self, status_code, **kwargs):
         schema = JSONAPIErrorsSchema()
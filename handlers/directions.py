@@ -1,29 +1,96 @@
+import logging
+import math
+from datetime import timedelta
+
 import googlemaps
 from marshmallow import Schema, validate
+from marshmallow.exceptions import ValidationError
 from marshmallow_jsonapi import Schema as JSONAPISchema, fields
+from tornado import escape, gen, locks, web
+from tornado.options import options
 from webargs.tornadoparser import parser
 
+from core import polyline, tsp
 from core.google import ApiErrorCode
+from core.matrix import Matrix, UNREACHABLE, split_blocks, \
+    straight_line_costs
 from core.utils import dasherize
 from handlers.base import BaseHandler
 
 
+MODES = ('driving', 'walking', 'bicycling', 'transit')
+BACKENDS = ('google', 'local')
+
+
 class DirectionsQuerySchema(Schema):
     origin = fields.Str(required=True, validate=lambda s: bool(s))
     destination = fields.Str(required=True, validate=lambda s: bool(s))
     waypoints = fields.List(fields.Str)
-    mode = fields.Str(default='driving',
-                      validate=validate.OneOf(['driving', 'walking',
-                                               'bicycling', 'transit']))
+    mode = fields.Str(default='driving', validate=validate.OneOf(MODES))
     language = fields.Str(default='ru')
+    backend = fields.Str(validate=validate.OneOf(BACKENDS))
+    optimize = fields.Bool()
 
     class Meta:
         strict = True
 
 
+DIRECTIONS_QUERY_ARGUMENTS = frozenset([
+    'origin', 'destination', 'waypoints', 'mode', 'language', 'backend',
+    'optimize'])
+
+
+def _fast_directions_query(arguments):
+    args = {}
+    for name, values in arguments.items():
+        if name not in DIRECTIONS_QUERY_ARGUMENTS:
+            # Ignored by webargs as well
+            continue
+        try:
+            values = [value.decode('utf-8') for value in values]
+        except UnicodeDecodeError:
+            return None
+        if name == 'waypoints':
+            args[name] = values
+            continue
+        if len(values) != 1:
+            return None
+        value = values[0]
+        if name == 'optimize':
+            if value in fields.Bool.truthy:
+                value = True
+            elif value in fields.Bool.falsy:
+                value = False
+            else:
+                return None
+        elif ((name == 'mode' and value not in MODES) or
+                (name == 'backend' and value not in BACKENDS) or
+                (name in ('origin', 'destination') and not value)):
+            return None
+        args[name] = value
+    if 'origin' not in args or 'destination' not in args:
+        return None
+    return args
+
+
+def parse_directions_query(request):
+    """
+    ``DirectionsQuerySchema`` arguments of ``request``. Plain valid query
+    strings are checked without webargs and the schema; anything else goes
+    through them for their exact errors.
+    """
+    args = _fast_directions_query(request.query_arguments)
+    if args is None:
+        args = parser.parse(DirectionsQuerySchema, request,
+                            locations=('query',))
+    return args
+
+
 class DirectionsSchema(JSONAPISchema):
     id = fields.String()
     route = fields.Dict()
+    # Saves the route with POST /routes {"directions-token": ...}
+    token = fields.String()
 
     class Meta:
         type_ = 'directions'
@@ -31,32 +98,348 @@ class DirectionsSchema(JSONAPISchema):
         inflect = dasherize
 
 
-class DirectionsHandler(BaseHandler):
-    async def get(self):
-        args = parser.parse(DirectionsQuerySchema, self.request,
-                            locations=('query',))
+CLIENT_ERRORS = (googlemaps.exceptions.ApiError,
+                 googlemaps.exceptions.HTTPError,
+                 googlemaps.exceptions.Timeout,
+                 googlemaps.exceptions.TransportError)
+
+
+def api_error_response(error):
+    """HTTP status code and message for a Google Maps client exception"""
+    error_msg = 'Google Maps API error response: %s'
+    if isinstance(error, googlemaps.exceptions.ApiError):
+        return (ApiErrorCode[error.status].value,
+                error_msg % (error.message if error.message else error.status))
+    if isinstance(error, googlemaps.exceptions.HTTPError):
+        return error.status_code, error_msg % 'HTTP error'
+    if isinstance(error, googlemaps.exceptions.Timeout):
+        return 599, error_msg % 'timeout'
+    return 500, error_msg % 'transport error'
 
-        error_msg = 'Google Maps API error response: %s'
+
+# Waypoints per Google Directions request
+MAX_LEG_WAYPOINTS = 23
+
+
+def split_stops(stops, max_waypoints=MAX_LEG_WAYPOINTS):
+    """Splits stops into chunks of at most ``max_waypoints`` waypoints
+    between an origin and a destination, each chunk starting at the stop
+    the previous one ends at"""
+    step = max_waypoints + 1
+    return [stops[k:k + step + 1] for k in range(0, len(stops) - 1, step)]
+
+
+def route_reference(route):
+    """What saving ``route`` with ``POST /routes`` needs, a fraction of
+    the route with its steps"""
+    legs = route['legs']
+    return {
+        'origin': legs[0]['start_location'],
+        'origin_name': legs[0].get('start_address') or '',
+        'destination': legs[-1]['end_location'],
+        'destination_name': legs[-1].get('end_address') or '',
+        'waypoints': [leg['end_location'] for leg in legs[:-1]],
+        'waypoints_names': [leg.get('end_address') or '' for leg in legs[:-1]],
+        'polyline': route['overview_polyline']['points'],
+        'bounds': route.get('bounds'),
+    }
+
+
+def stitch_routes(routes):
+    """Joins routes following each other into one route"""
+    points = []
+    for route in routes:
+        decoded = polyline.decode(route['overview_polyline']['points'])
+        if points and decoded and decoded[0] == points[-1]:
+            decoded = decoded[1:]
+        points.extend(decoded)
+    corners = [route['bounds'] for route in routes]
+    return {
+        'bounds': {
+            'northeast': {
+                'lat': max(c['northeast']['lat'] for c in corners),
+                'lng': max(c['northeast']['lng'] for c in corners),
+            },
+            'southwest': {
+                'lat': min(c['southwest']['lat'] for c in corners),
+                'lng': min(c['southwest']['lng'] for c in corners),
+            },
+        },
+        'copyrights': routes[0].get('copyrights', ''),
+        'legs': [leg for route in routes for leg in route['legs']],
+        'overview_polyline': {'points': polyline.encode(points)},
+        'summary': routes[0].get('summary', ''),
+        'warnings': sorted(set(warning for route in routes
+                               for warning in route.get('warnings', []))),
+        'waypoint_order': [],
+    }
+
+
+class BaseDirectionsHandler(BaseHandler):
+    def directions_backend(self, name=None):
+        name = name or options.directions_backend
+        backend = self.application.directions_backends.get(name)
+        if backend is None:
+            msg = 'Directions backend %s is not configured.' % name
+            raise web.HTTPError(400, msg, msg)
+        return backend
+
+    async def find_routes(self, backend, args):
+        """Directions from ``backend``. If a fallback backend is configured
+        and ``backend`` does not answer within directions_fallback_timeout,
+        the fallback answers instead."""
+        fallback = self.application.directions_fallback
+        if fallback is None or backend is fallback:
+            return await backend.directions(**args)
+
+        future = gen.convert_yielded(backend.directions(**args))
         try:
-            routes = await self.googlemaps.directions(**args)
-        except googlemaps.exceptions.ApiError as e:
-            self.send_error(
-                ApiErrorCode[e.status].value,
-                message=error_msg % (e.message if e.message else e.status)
-            )
-            return
-        except googlemaps.exceptions.HTTPError as e:
-            self.send_error(e.status_code,
-                            message=error_msg % 'HTTP error')
-            return
-        except googlemaps.exceptions.Timeout as e:
-            self.send_error(599, message=error_msg % 'timeout')
+            return await gen.with_timeout(
+                timedelta(seconds=options.directions_fallback_timeout),
+                future, quiet_exceptions=CLIENT_ERRORS)
+        except (gen.TimeoutError, googlemaps.exceptions.Timeout):
+            logging.warning('Directions backend timed out, using fallback')
+            return await fallback.directions(**args)
+
+    async def _find_leg_routes(self, semaphore, backend, args):
+        await semaphore.acquire()
+        try:
+            return await self.find_routes(backend, args)
+        finally:
+            semaphore.release()
+
+    async def plan_routes(self, name, backend, args):
+        """Directions through any number of waypoints. Routes with more
+        than ``MAX_LEG_WAYPOINTS`` are requested in parts concurrently and
+        stitched together.
+
+        With ``optimize`` the waypoints are reordered to make the trip
+        shortest in time. Google does it for short routes, otherwise the
+        order is optimised here on a duration matrix.
+        """
+        optimize = args.pop('optimize', False)
+        waypoints = args.get('waypoints') or []
+        if len(waypoints) > options.directions_max_waypoints:
+            msg = ('At most %d waypoints are allowed.' %
+                   options.directions_max_waypoints)
+            raise web.HTTPError(400, msg, msg)
+        if len(waypoints) <= MAX_LEG_WAYPOINTS:
+            if not optimize or not waypoints:
+                return await self.find_routes(backend, args)
+            if backend is self.googlemaps:
+                args['optimize_waypoints'] = True
+                return await self.find_routes(backend, args)
+
+        stops = [args['origin']] + waypoints + [args['destination']]
+        order = list(range(len(stops)))
+        if optimize:
+            costs = await self._stop_costs(name, backend, stops,
+                                           args.get('mode') or 'driving',
+                                           args.get('language'))
+            order = await self.run_cpu(
+                tsp.optimize, costs, len(stops),
+                time_limit=options.directions_optimize_time_limit)
+
+        semaphore = locks.Semaphore(options.directions_batch_concurrency)
+        results = await gen.multi([
+            self._find_leg_routes(semaphore, backend, dict(
+                args, origin=chunk[0], destination=chunk[-1],
+                waypoints=chunk[1:-1]))
+            for chunk in split_stops([stops[k] for k in order])
+        ])
+        if not all(results):
+            return []
+        route = stitch_routes([routes[0] for routes in results])
+        route['waypoint_order'] = [k - 1 for k in order[1:-1]]
+        return [route]
+
+    async def _stop_costs(self, name, backend, stops, mode, language):
+        """Costs between every two stops for the optimiser: durations from
+        the backend, or straight line distances when the matrix would
+        take more than ``directions_optimize_max_elements`` cells"""
+        max_elements = min(options.directions_optimize_max_elements,
+                           options.matrix_max_elements)
+        if len(stops) ** 2 <= max_elements:
+            matrix, _ = await self.compute_matrix(name, backend, stops,
+                                                  stops, mode, language)
+            return matrix.durations
+        try:
+            return await self.run_cpu(straight_line_costs, stops)
+        except ValueError:
+            msg = ('optimize with more than %d stops needs every location '
+                   'as "lat,lng".' % int(math.sqrt(max_elements)))
+            raise web.HTTPError(400, msg, msg)
+
+    def _fill_from_directions(self, matrix, mode, language):
+        cache = self.application.directions_cache
+        if cache is None:
             return
-        except googlemaps.exceptions.TransportError as e:
-            self.send_error(500, message=error_msg % 'transport error')
+        for i, j in matrix.missing():
+            params = {'origin': matrix.origins[i],
+                      'destination': matrix.destinations[j]}
+            if language:
+                params['language'] = language
+            # Driving is the default, requests may or may not name it
+            candidates = [dict(params, mode=mode)]
+            if mode == 'driving':
+                candidates.append(params)
+            for candidate in candidates:
+                routes = cache.peek(candidate)
+                if routes:
+                    legs = routes[0]['legs']
+                    matrix.set(i, j,
+                               sum(leg['duration']['value'] for leg in legs),
+                               sum(leg['distance']['value'] for leg in legs))
+                    break
+
+    async def _fetch_block(self, semaphore, backend, matrix, rows, columns,
+                           mode, language):
+        await semaphore.acquire()
+        try:
+            result = await backend.distance_matrix(
+                [matrix.origins[i] for i in rows],
+                [matrix.destinations[j] for j in columns],
+                mode=mode, language=language)
+        finally:
+            semaphore.release()
+        for i, row in zip(rows, result):
+            for j, element in zip(columns, row['elements']):
+                if element.get('status') == 'OK':
+                    matrix.set(i, j, element['duration']['value'],
+                               element['distance']['value'])
+                else:
+                    matrix.set(i, j, UNREACHABLE, UNREACHABLE)
+
+    async def compute_matrix(self, name, backend, origins, destinations, mode,
+                             language=None):
+        """Durations and distances between every origin and destination.
+
+        Cells come from the matrix cache, then from cached directions
+        results, and only the rest is asked from the backend, in as few
+        calls as its limits allow.
+
+        :returns: ``(matrix, number of cells fetched from the backend)``
+        """
+        matrix = Matrix(origins, destinations)
+        cache = self.application.matrix_cache
+        prefix = '%s|%s' % (name, mode)
+        if cache is not None:
+            cache.fill(matrix, prefix)
+        if backend is self.googlemaps:
+            self._fill_from_directions(matrix, mode, language)
+
+        missing = matrix.missing()
+        semaphore = locks.Semaphore(options.directions_batch_concurrency)
+        await gen.multi([
+            self._fetch_block(semaphore, backend, matrix, rows, columns,
+                              mode, language)
+            for rows, columns in split_blocks(missing, backend.matrix_limits)
+        ])
+        if cache is not None:
+            cache.store(matrix, prefix, missing)
+        return matrix, len(missing)
+
+
+class DirectionsHandler(BaseDirectionsHandler):
+    async def get(self):
+        with self.stage('parse'):
+            args = parse_directions_query(self.request)
+        name = args.pop('backend', None) or options.directions_backend
+        backend = self.directions_backend(name)
+
+        try:
+            with self.stage('upstream'):
+                routes = await self.plan_routes(name, backend, args)
+        except CLIENT_ERRORS as e:
+            status_code, message = api_error_response(e)
+            self.send_error(status_code, message=message)
             return
 
         result = [{'id': i, 'route': r} for i, r in enumerate(routes)]
-        schema = DirectionsSchema(many=True)
-        output = schema.dumps(result)
+        store = self.application.directions_results
+        if store is not None:
+            tokens = store.put([route_reference(r) for r in routes])
+            for item, token in zip(result, tokens):
+                item['token'] = token
+
+        with self.stage('serialize'):
+            schema = DirectionsSchema(many=True)
+            output = schema.dumps(result)
         self.finish(output.data)
+
+
+class DirectionsBatchHandler(BaseDirectionsHandler):
+    """
+    Directions for many queries at once. The body is ``{"data": [...]}``
+    with ``GET /directions`` query parameters as objects. Google is called
+    for at most ``directions_batch_concurrency`` queries at a time.
+
+    Results are written as NDJSON in the order they complete, one JSON:API
+    document per query with its position in ``meta.index``.
+    """
+    def _error_document(self, index, status_code, detail):
+        return {
+            'errors': [{
+                'status': status_code,
+                'source': {'pointer': '/data/%d' % index},
+                'detail': detail,
+            }],
+            'meta': {'index': index},
+        }
+
+    async def _directions(self, semaphore, index, name, backend, args):
+        await semaphore.acquire()
+        try:
+            routes = await self.plan_routes(name, backend, args)
+        except CLIENT_ERRORS as e:
+            return self._error_document(index, *api_error_response(e))
+        except web.HTTPError as e:
+            return self._error_document(index, e.status_code, e.log_message)
+        finally:
+            semaphore.release()
+
+        result = [{'id': i, 'route': r} for i, r in enumerate(routes)]
+        document = DirectionsSchema(many=True).dump(result).data
+        document['meta'] = {'index': index}
+        return document
+
+    async def post(self):
+        try:
+            items = escape.json_decode(self.request.body)['data']
+        except (ValueError, TypeError, KeyError):
+            items = None
+        if not isinstance(items, list):
+            msg = 'Body must be a JSON document with a data array.'
+            raise web.HTTPError(400, msg, msg)
+        if len(items) > options.directions_batch_max_items:
+            msg = ('At most %d queries are allowed in a batch.' %
+                   options.directions_batch_max_items)
+            raise web.HTTPError(400, msg, msg)
+
+        self.set_header('Content-Type', 'application/x-ndjson')
+        semaphore = locks.Semaphore(options.directions_batch_concurrency)
+        futures = []
+        for index, item in enumerate(items):
+            try:
+                args = DirectionsQuerySchema().load(item).data
+                name = args.pop('backend', None) or options.directions_backend
+                backend = self.directions_backend(name)
+            except (ValidationError, TypeError) as e:
+                detail = getattr(e, 'messages', 'Query must be an object.')
+                self.write(escape.json_encode(
+                    self._error_document(index, 400, detail)) + '\n')
+                continue
+            except web.HTTPError as e:
+                self.write(escape.json_encode(self._error_document(
+                    index, e.status_code, e.log_message)) + '\n')
+                continue
+            futures.append(gen.convert_yielded(
+                self._directions(semaphore, index, name, backend, args)))
+
+        if futures:
+            results = gen.WaitIterator(*futures)
+            while not results.done():
+                document = await results.next()
+                self.write(escape.json_encode(document) + '\n')
+                await self.flush()
+        self.finish()
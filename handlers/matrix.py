@@ -0,0 +1,67 @@
+from marshmallow import Schema, fields, validate
+from tornado import escape, web
+from tornado.options import options
+from webargs.tornadoparser import parser
+
+from handlers.directions import BaseDirectionsHandler, CLIENT_ERRORS, \
+    api_error_response
+
+
+class MatrixQuerySchema(Schema):
+    origins = fields.Str(required=True, validate=lambda s: bool(s))
+    destinations = fields.Str(required=True, validate=lambda s: bool(s))
+    mode = fields.Str(validate=validate.OneOf(['driving', 'walking',
+                                               'bicycling', 'transit']))
+    language = fields.Str()
+    backend = fields.Str(validate=validate.OneOf(['google', 'local']))
+
+    class Meta:
+        strict = True
+
+
+class MatrixHandler(BaseDirectionsHandler):
+    """
+    Travel durations (seconds) and distances (metres) between ``|``
+    separated ``origins`` and ``destinations``, as arrays of rows with
+    null for pairs without a route.
+    """
+    async def get(self):
+        with self.stage('parse'):
+            args = parser.parse(MatrixQuerySchema, self.request,
+                                locations=('query',))
+        origins = args['origins'].split('|')
+        destinations = args['destinations'].split('|')
+        if len(origins) * len(destinations) > options.matrix_max_elements:
+            msg = ('At most %d origin-destination pairs are allowed.' %
+                   options.matrix_max_elements)
+            raise web.HTTPError(400, msg, msg)
+
+        name = args.get('backend') or options.directions_backend
+        backend = self.directions_backend(name)
+        try:
+            with self.stage('upstream'):
+                matrix, fetched = await self.compute_matrix(
+                    name, backend, origins, destinations,
+                    args.get('mode') or 'driving', args.get('language'))
+        except CLIENT_ERRORS as e:
+            status_code, message = api_error_response(e)
+            self.send_error(status_code, message=message)
+            return
+
+        with self.stage('serialize'):
+            output = escape.json_encode({
+                'data': {
+                    'type': 'matrices',
+                    'attributes': {
+                        'origins': origins,
+                        'destinations': destinations,
+                        'durations': matrix.rows(matrix.durations),
+                        'distances': matrix.rows(matrix.distances),
+                    },
+                },
+                'meta': {
+                    'cells': len(origins) * len(destinations),
+                    'fetched': fetched,
+                },
+            })
+        self.finish(output)
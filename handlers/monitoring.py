@@ -0,0 +1,9 @@
+from core import metrics
+from handlers.base import BaseHandler
+
+
+class MetricsHandler(BaseHandler):
+    """Metrics of this process in the Prometheus text format"""
+    def get(self):
+        self.set_header('Content-Type', metrics.CONTENT_TYPE)
+        self.finish(metrics.REGISTRY.expose())
@@ -1,16 +1,194 @@
+import email.utils
+import hashlib
+import itertools
 import uuid
-from datetime import datetime
+from datetime import datetime, timezone
+from urllib.parse import urlencode
 
 from marshmallow_jsonapi import Schema as JSONAPISchema, fields
-from marshmallow import Schema, pre_dump, validate
+from marshmallow_jsonapi.exceptions import IncorrectTypeError
+from marshmallow import Schema, pre_dump, validate, validates
 from marshmallow.exceptions import ValidationError
-from sqlalchemy import func
+from sqlalchemy import cast, func, text, tuple_
+from sqlalchemy.exc import DBAPIError, IntegrityError
 from sqlalchemy.orm.exc import MultipleResultsFound, NoResultFound
 from tornado import escape, web
+from tornado.ioloop import IOLoop
 
-from core.utils import row_to_dict, dasherize
-from handlers.base import BaseHandler
-from models import Route
+from core import compression
+from core.geojson import Fragments, geometry_error
+from core.utils import row_to_dict, dasherize, encode_cursor, \
+    decode_cursor, parse_timestamp
+from handlers.base import BaseHandler, JSONAPIErrorsSchema
+from models import Route, RouteBody, SIMPLIFIED_ZOOM_LEVELS, \
+    collection_version
+
+OUTPUT_FORMATS = ('geojson', 'encoded-polyline')
+# Google's encoded polylines use 5 decimal digits
+DEFAULT_POLYLINE_PRECISION = 5
+MAX_PRECISION = 15
+MAX_ZOOM = 22
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+STREAM_BATCH_SIZE = 500
+BULK_BATCH_SIZE = 500
+MAX_IDEMPOTENCY_KEY_LENGTH = 255
+# JSON documents are buffered whole, NDJSON is processed as it arrives
+BULK_MAX_BODY_SIZE = 64 * 1024 ** 2
+BULK_NDJSON_MAX_BODY_SIZE = 1024 ** 3
+NDJSON_TYPES = ('application/x-ndjson', 'application/ndjson')
+# Stored routes never change, a representation can be kept for a year
+ROUTE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# Lists change with every new route, clients revalidate with the ETag
+COLLECTION_CACHE_CONTROL = 'no-cache'
+STORE_ROUTE_BODY = text(
+    'INSERT INTO route_body (route_id, encoding, body) '
+    'VALUES (:route_id, :encoding, :body) '
+    'ON CONFLICT (route_id, encoding) DO NOTHING'
+)
+
+
+def _parse_floats(name, value, count):
+    try:
+        values = [float(v) for v in value.split(',')]
+    except ValueError:
+        values = []
+    if len(values) != count:
+        msg = '%s must be %d comma-separated numbers.' % (name, count)
+        raise web.HTTPError(400, msg, msg)
+    return values
+
+
+def _check_point(name, lng, lat):
+    if not (-180 <= lng <= 180 and -90 <= lat <= 90):
+        msg = '%s has coordinates out of range.' % name
+        raise web.HTTPError(400, msg, msg)
+
+
+def bbox_filter(name, value):
+    """``min_lng,min_lat,max_lng,max_lat``: the polyline crosses the box"""
+    min_lng, min_lat, max_lng, max_lat = _parse_floats(name, value, 4)
+    _check_point(name, min_lng, min_lat)
+    _check_point(name, max_lng, max_lat)
+    envelope = func.ST_MakeEnvelope(min_lng, min_lat, max_lng, max_lat, 4326)
+    # && against the stored bbox is answered by its GiST index
+    return (Route.bbox.op('&&')(envelope) &
+            func.ST_Intersects(func.geometry(Route.polyline), envelope))
+
+
+def near_filter(column):
+    """``lng,lat,radius``: ``column`` is within radius metres of the point"""
+    def build(name, value):
+        lng, lat, radius = _parse_floats(name, value, 3)
+        _check_point(name, lng, lat)
+        if radius < 0:
+            msg = '%s radius must not be negative.' % name
+            raise web.HTTPError(400, msg, msg)
+        point = func.geography(
+            func.ST_SetSRID(func.ST_MakePoint(lng, lat), 4326))
+        return func.ST_DWithin(column, point, radius)
+    return build
+
+
+SPATIAL_FILTERS = {
+    'filter[bbox]': bbox_filter,
+    'filter[near]': near_filter(Route.polyline),
+    'filter[origin-near]': near_filter(Route.origin),
+    'filter[destination-near]': near_filter(Route.destination),
+    'filter[stops-near]': near_filter(Route.waypoints),
+}
+
+
+def bbox_from_bounds(bounds):
+    """Envelope of Google's route ``bounds``, None if they are malformed"""
+    try:
+        northeast, southwest = bounds['northeast'], bounds['southwest']
+        return func.ST_MakeEnvelope(
+            float(southwest['lng']), float(southwest['lat']),
+            float(northeast['lng']), float(northeast['lat']), 4326)
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def _route_values(data, origin, destination, polyline, waypoints=None):
+    # Simplified polylines, and the bbox without bounds, are derived from
+    # the polyline by a trigger (see models.ROUTE_DERIVED_COLUMNS_TRIGGER)
+    return {
+        'id': str(uuid.uuid4()),
+        'origin': origin,
+        'origin_name': data['origin_name'],
+        'destination': destination,
+        'destination_name': data['destination_name'],
+        'polyline': polyline,
+        # Always set, rows of a multi-row insert need the same columns
+        'waypoints': waypoints,
+        'waypoints_names': data.get('waypoints_names') or None,
+        'bounds': data.get('bounds'),
+        'bbox': bbox_from_bounds(data.get('bounds')),
+        'created': data.get('created') or datetime.utcnow(),
+    }
+
+
+def _multipoint(geojson):
+    """MultiPoint of GeoJSON, None without points"""
+    if not geojson or not geojson.get('coordinates'):
+        return None
+    return func.ST_GeomFromGeoJSON(escape.json_encode(geojson))
+
+
+def route_values(data):
+    """Column values of a new route from ``RouteInputSchema`` data"""
+    return _route_values(
+        data,
+        func.ST_GeomFromGeoJSON(escape.json_encode(data['origin'])),
+        func.ST_GeomFromGeoJSON(escape.json_encode(data['destination'])),
+        func.ST_GeomFromGeoJSON(escape.json_encode(data['polyline'])),
+        _multipoint(data.get('waypoints')))
+
+
+def _point(location):
+    return func.ST_SetSRID(
+        func.ST_MakePoint(float(location['lng']), float(location['lat'])),
+        4326)
+
+
+def directions_route_values(data):
+    """Column values of a new route from a directions result saved by
+    ``route_reference()``. PostGIS decodes the encoded polyline."""
+    waypoints = {'type': 'MultiPoint',
+                 'coordinates': [[w['lng'], w['lat']]
+                                 for w in data['waypoints']]}
+    return _route_values(data, _point(data['origin']),
+                         _point(data['destination']),
+                         func.ST_LineFromEncodedPolyline(data['polyline']),
+                         _multipoint(waypoints))
+
+
+def is_directions_reference(document):
+    """Whether a ``POST /routes`` document saves a directions result by
+    its token"""
+    try:
+        return 'directions-token' in document['data']['attributes']
+    except (KeyError, TypeError):
+        return False
+
+
+def compress_route_body(body):
+    """``(encoding, compressed)`` variants of a route document to store"""
+    data = escape.utf8(body)
+    return [(encoding, compression.compress(data, encoding))
+            for encoding in compression.available_encodings()]
+
+
+def store_route_bodies(db, route_id, bodies):
+    try:
+        with db.engine.begin() as connection:
+            connection.execute(STORE_ROUTE_BODY, [
+                {'route_id': route_id, 'encoding': encoding, 'body': body}
+                for encoding, body in bodies])
+    except IntegrityError:
+        # The route has been deleted meanwhile
+        pass
 
 
 class GeoJSONSchema(Schema):
@@ -24,7 +202,7 @@ class RouteInputSchema(JSONAPISchema):
     origin_name = fields.String(required=True)
     destination = fields.Nested(GeoJSONSchema, required=True)
     destination_name = fields.String(required=True)
-    waypoints = fields.List(fields.Float)
+    waypoints = fields.Nested(GeoJSONSchema)
     waypoints_names = fields.List(fields.String)
     polyline = fields.Nested(GeoJSONSchema, required=True)
     bounds = fields.Dict()
@@ -35,6 +213,145 @@ class RouteInputSchema(JSONAPISchema):
         strict = True
         inflect = dasherize
 
+    geometry_types = {'origin': 'Point', 'destination': 'Point',
+                      'polyline': 'LineString', 'waypoints': 'MultiPoint'}
+
+    def _validate_geometry(self, name, value):
+        error = geometry_error(value, self.geometry_types[name])
+        if error is not None:
+            raise ValidationError(error)
+
+    @validates('origin')
+    def validate_origin(self, value):
+        self._validate_geometry('origin', value)
+
+    @validates('destination')
+    def validate_destination(self, value):
+        self._validate_geometry('destination', value)
+
+    @validates('polyline')
+    def validate_polyline(self, value):
+        self._validate_geometry('polyline', value)
+
+    @validates('waypoints')
+    def validate_waypoints(self, value):
+        self._validate_geometry('waypoints', value)
+
+
+# Attributes of POST /routes documents load_route_input() handles without
+# the schema: GeoJSON geometry type or Python type of the value
+FAST_ROUTE_ATTRIBUTES = dict(RouteInputSchema.geometry_types, **{
+    'origin-name': str, 'destination-name': str, 'waypoints-names': list,
+    'bounds': dict,
+})
+REQUIRED_ROUTE_ATTRIBUTES = ('origin', 'origin-name', 'destination',
+                             'destination-name', 'polyline')
+
+
+def _fast_route_input(document):
+    try:
+        resource = document['data']
+        attributes = resource['attributes']
+    except (KeyError, TypeError):
+        return None
+    if (len(document) != 1 or set(resource) != {'type', 'attributes'} or
+            resource['type'] != 'routes' or
+            not isinstance(attributes, dict) or
+            not attributes.keys() <= FAST_ROUTE_ATTRIBUTES.keys() or
+            not all(name in attributes
+                    for name in REQUIRED_ROUTE_ATTRIBUTES)):
+        return None
+    data = {}
+    for name, value in attributes.items():
+        kind = FAST_ROUTE_ATTRIBUTES[name]
+        if isinstance(kind, str):
+            if geometry_error(value, kind) is not None:
+                return None
+            # Members besides these are dropped, as by GeoJSONSchema
+            value = {'type': value['type'],
+                     'coordinates': value['coordinates']}
+        elif not isinstance(value, kind):
+            return None
+        elif kind is list:
+            if not all(isinstance(item, str) for item in value):
+                return None
+            value = list(value)
+        data[name.replace('-', '_')] = value
+    return data
+
+
+def _check_resource_object(document):
+    # marshmallow-jsonapi raises TypeError or AttributeError for these
+    resource = document.get('data') if isinstance(document, dict) else None
+    if not isinstance(resource, dict):
+        pointer, detail = '/data', '`data` must be an object.'
+    elif not isinstance(resource.get('attributes', {}), dict):
+        pointer, detail = '/data/attributes', '`attributes` must be an object.'
+    else:
+        return
+    raise ValidationError({'errors': [
+        {'detail': detail, 'source': {'pointer': pointer}}]})
+
+
+def error_objects(messages, status=400, pointer='/data'):
+    """
+    JSON:API error objects with ``status`` of ``ValidationError.messages``
+    or an error message. ``JSONAPISchema`` pointers are relative to the
+    document's ``/data``, they are rebased onto ``pointer``, e.g.
+    ``/data/3`` for the fourth item of a bulk import. Other messages point
+    at ``pointer`` itself.
+    """
+    if isinstance(messages, dict) and 'errors' in messages:
+        errors = []
+        for error in messages['errors']:
+            error = dict(error, status=status)
+            source = error.get('source') or {}
+            path = source.get('pointer', '')
+            if path == '/data' or path.startswith('/data/'):
+                error['source'] = dict(source,
+                                       pointer=pointer + path[len('/data'):])
+            errors.append(error)
+        return errors
+    if isinstance(messages, dict):
+        return [error for name, field_messages in messages.items()
+                for error in error_objects(field_messages, status,
+                                           '%s/%s' % (pointer, name))]
+    if isinstance(messages, (list, tuple)):
+        return [error for message in messages
+                for error in error_objects(message, status, pointer)]
+    return [{'status': status, 'source': {'pointer': pointer},
+             'detail': messages}]
+
+
+def load_route_input(document):
+    """
+    ``RouteInputSchema().load(document).data``. Plain valid documents
+    skip the schema, their coordinates are checked in bulk; anything else,
+    e.g. with ``id`` or ``created`` or invalid, goes through the schema for
+    its exact errors.
+    """
+    data = _fast_route_input(document)
+    if data is None:
+        _check_resource_object(document)
+        data = RouteInputSchema().load(document).data
+    return data
+
+
+class DirectionsReferenceSchema(JSONAPISchema):
+    """Route from a ``GET /directions`` result, names default to its
+    addresses"""
+    id = fields.UUID()
+    directions_token = fields.String(required=True,
+                                     validate=validate.Length(max=64))
+    origin_name = fields.String()
+    destination_name = fields.String()
+    created = fields.DateTime(allow_none=True)
+
+    class Meta:
+        type_ = 'routes'
+        strict = True
+        inflect = dasherize
+
 
 class RouteOutputSchema(JSONAPISchema):
     id = fields.UUID()
@@ -42,6 +359,8 @@ class RouteOutputSchema(JSONAPISchema):
     origin_name = fields.String()
     destination = fields.Dict()
     destination_name = fields.String()
+    waypoints = fields.Dict(allow_none=True)
+    waypoints_names = fields.List(fields.String, allow_none=True)
     polyline = fields.Dict()
     bounds = fields.Dict()
     created = fields.DateTime()
@@ -51,82 +370,473 @@ class RouteOutputSchema(JSONAPISchema):
         strict = True
         inflect = dasherize
 
+    geojson_fields = ('origin', 'destination', 'waypoints', 'polyline')
+
+    def stash_geojson(self, data, fragments):
+        """Replaces GeoJSON texts in ``data`` with ``fragments`` placeholders.
+        They are spliced into the serialized output as is, which skips the
+        decode/re-encode round trip of ``convert_geojson_to_dict``.
+        """
+        for item in (data if self.many else [data]):
+            for field in self.geojson_fields:
+                item[field] = fragments.stash(item[field])
+        return data
+
     @pre_dump(pass_many=True)
     def convert_geojson_to_dict(self, data, many):
-        fields = ['origin', 'destination', 'polyline']
-        if many:
-            for item in data:
-                for field in fields:
+        for item in (data if many else [data]):
+            for field in self.geojson_fields:
+                if isinstance(item[field], str):
                     item[field] = escape.json_decode(item[field])
-        else:
-            for field in fields:
-                data[field] = escape.json_decode(data[field])
         return data
 
 
+class EncodedPolylineRouteOutputSchema(RouteOutputSchema):
+    polyline = fields.String()
+
+    geojson_fields = ('origin', 'destination', 'waypoints')
+
+
 class RoutesHandler(BaseHandler):
+    output_format = 'geojson'
+    precision = None
+    zoom = None
+    simplify = None
+    filters = ()
+
+    def _as_geojson(self, column):
+        if self.precision is None:
+            return func.ST_AsGeoJSON(column)
+        return func.ST_AsGeoJSON(column, self.precision)
+
+    def _polyline_source(self):
+        if self.simplify is not None:
+            return func.geography(func.ST_SimplifyPreserveTopology(
+                func.geometry(Route.polyline), self.simplify))
+        if self.zoom is not None:
+            # Least simplified stored variant that is detailed enough
+            for zoom in SIMPLIFIED_ZOOM_LEVELS:
+                if self.zoom <= zoom:
+                    # Routes stored before the variants existed have none
+                    return func.coalesce(
+                        getattr(Route, 'polyline_z%d' % zoom),
+                        Route.polyline)
+        return Route.polyline
+
+    def _polyline_column(self):
+        polyline = self._polyline_source()
+        if self.output_format == 'encoded-polyline':
+            precision = self.precision
+            if precision is None:
+                precision = DEFAULT_POLYLINE_PRECISION
+            return func.ST_AsEncodedPolyline(func.geometry(polyline),
+                                             precision)
+        return self._as_geojson(polyline)
+
+    def _route_columns(self):
+        # Table columns rather than ORM attributes, so they can go to
+        # INSERT ... RETURNING as well
+        route = Route.__table__.c
+        return [
+            route.id,
+            self._as_geojson(route.origin).label('origin'),
+            route.origin_name,
+            self._as_geojson(route.destination).label('destination'),
+            route.destination_name,
+            self._as_geojson(route.waypoints).label('waypoints'),
+            route.waypoints_names,
+            self._polyline_column().label('polyline'),
+            route.bounds,
+            route.created,
+        ]
+
     def _route_query(self):
-        return self.db.query(
-            Route.id,
-            func.ST_AsGeoJSON(Route.origin).label('origin'),
-            Route.origin_name,
-            func.ST_AsGeoJSON(Route.destination).label('destination'),
-            Route.destination_name,
-            func.ST_AsGeoJSON(Route.polyline).label('polyline'),
-            Route.bounds,
-            Route.created
-        )
+        return self.db.query(*self._route_columns())
 
-    async def get(self, route_id=None):
-        if route_id:
+    def _output_schema(self, many=False):
+        if self.output_format == 'encoded-polyline':
+            return EncodedPolylineRouteOutputSchema(many=many)
+        return RouteOutputSchema(many=many)
+
+    def _parse_output_options(self):
+        self.output_format = self.get_query_argument('format',
+                                                     self.output_format)
+        if self.output_format not in OUTPUT_FORMATS:
+            msg = 'format must be one of: %s.' % ', '.join(OUTPUT_FORMATS)
+            raise web.HTTPError(400, msg, msg)
+
+        precision = self.get_query_argument('precision', None)
+        if precision is not None:
             try:
-                result = self._route_query().filter(
-                    Route.id == route_id).one()
-            except MultipleResultsFound:
-                msg = 'Multiple results for unique ID is founded.'
+                self.precision = int(precision)
+            except ValueError:
+                self.precision = -1
+            if not 0 <= self.precision <= MAX_PRECISION:
+                msg = ('precision must be an integer from 0 to %d.' %
+                       MAX_PRECISION)
                 raise web.HTTPError(400, msg, msg)
-            except NoResultFound:
-                msg = 'Route with ID %s is not found.' % route_id
-                raise web.HTTPError(404, msg, msg)
-        else:
-            result = self._route_query().order_by(Route.created.desc()).all()
 
-        get_many = not bool(route_id)
-        schema = RouteOutputSchema(many=get_many)
-        if get_many:
-            output = schema.dumps([row_to_dict(r) for r in result])
-        else:
-            output = schema.dumps(row_to_dict(result))
-        self.finish(output.data)
+        zoom = self.get_query_argument('zoom', None)
+        simplify = self.get_query_argument('simplify', None)
+        if zoom is not None and simplify is not None:
+            msg = 'zoom and simplify can not be used together.'
+            raise web.HTTPError(400, msg, msg)
+        if zoom is not None:
+            try:
+                self.zoom = int(zoom)
+            except ValueError:
+                self.zoom = -1
+            if not 0 <= self.zoom <= MAX_ZOOM:
+                msg = 'zoom must be an integer from 0 to %d.' % MAX_ZOOM
+                raise web.HTTPError(400, msg, msg)
+        if simplify is not None:
+            try:
+                self.simplify = float(simplify)
+            except ValueError:
+                self.simplify = -1
+            if not 0 <= self.simplify < 180:
+                msg = 'simplify must be a tolerance in degrees.'
+                raise web.HTTPError(400, msg, msg)
+
+    def _is_default_representation(self):
+        return (self.output_format == RoutesHandler.output_format and
+                self.precision is None and self.zoom is None and
+                self.simplify is None)
+
+    def _stored_encoding(self):
+        """Encoding of a stored compressed document the response can be,
+        None if it needs another representation or no compression"""
+        if not (self.application.compress_responses and
+                self._is_default_representation()):
+            return None
+        return compression.negotiate(
+            self.request.headers.get('Accept-Encoding', ''))
+
+    def _representation(self):
+        """Output options a response body depends on"""
+        return '%s|%s|%s|%s' % (self.output_format, self.precision,
+                                self.zoom, self.simplify)
+
+    def _etag(self, *parts):
+        key = '|'.join(str(part) for part in parts + (self._representation(),))
+        # Weak, the identity and every compressed body share it
+        return 'W/"%s"' % hashlib.sha1(escape.utf8(key)).hexdigest()
+
+    def _set_cache_headers(self, etag, last_modified, cache_control):
+        self.set_header('Etag', etag)
+        if last_modified is not None:
+            self.set_header('Last-Modified', last_modified)
+        self.set_header('Cache-Control', cache_control)
+
+    def _set_route_cache_headers(self, route_id, created):
+        self._set_cache_headers(
+            self._etag(route_id, created.isoformat() if created else None),
+            created, ROUTE_CACHE_CONTROL)
+
+    def _not_modified(self, last_modified):
+        """Whether the conditional request headers match the ETag and
+        Last-Modified already set"""
+        if self.request.headers.get('If-None-Match'):
+            return self.check_etag_header()
+        since = self.request.headers.get('If-Modified-Since')
+        if since is None or last_modified is None:
+            return False
+        since = email.utils.parsedate_tz(since)
+        if since is None:
+            return False
+        since = datetime.fromtimestamp(email.utils.mktime_tz(since),
+                                       timezone.utc)
+        if last_modified.tzinfo is None:
+            last_modified = last_modified.replace(tzinfo=timezone.utc)
+        return last_modified.replace(microsecond=0) <= since
+
+    def _finish_not_modified(self):
+        self.set_status(304)
+        self.finish()
+
+    def _get_route_created(self, route_id):
+        row = self.db.query(Route.created).filter(
+            Route.id == route_id).first()
+        if row is None:
+            msg = 'Route with ID %s is not found.' % route_id
+            raise web.HTTPError(404, msg, msg)
+        return row.created
+
+    def _get_route_body(self, route_id, encoding):
+        """``created`` and the stored document of a route, which is None
+        if it has not been stored yet"""
+        row = self.db.query(Route.created, RouteBody.body).outerjoin(
+            RouteBody, (RouteBody.route_id == Route.id) &
+            (RouteBody.encoding == encoding)).filter(
+            Route.id == route_id).first()
+        if row is None:
+            msg = 'Route with ID %s is not found.' % route_id
+            raise web.HTTPError(404, msg, msg)
+        return row.created, row.body
+
+    async def _store_route_body(self, route_id, body):
+        # Runs after the response is finished, so it doesn't use the
+        # request's session
+        bodies = await self.run_cpu(compress_route_body, body)
+        await self.application.db.run(store_route_bodies,
+                                      self.application.db, route_id, bodies)
+
+    def _get_collection_version(self):
+        return collection_version(self.db, Route.__tablename__)
+
+    def _get_route(self, route_id):
+        try:
+            return self._route_query().filter(Route.id == route_id).one()
+        except MultipleResultsFound:
+            msg = 'Multiple results for unique ID is founded.'
+            raise web.HTTPError(400, msg, msg)
+        except NoResultFound:
+            msg = 'Route with ID %s is not found.' % route_id
+            raise web.HTTPError(404, msg, msg)
+
+    def _routes_query(self, after=None):
+        query = self._route_query().filter(*self.filters).order_by(
+            Route.created.desc(), Route.id.desc())
+        if after:
+            created, route_id = after
+            query = query.filter(
+                tuple_(Route.created, Route.id) <
+                tuple_(cast(created, Route.created.type),
+                       cast(route_id, Route.id.type)))
+        return query
+
+    def _get_routes(self, limit, after=None):
+        return self._routes_query(after).limit(limit).all()
+
+    def _open_routes_stream(self, after=None):
+        # Server-side cursor, rows are fetched STREAM_BATCH_SIZE at a time
+        query = self._routes_query(after).execution_options(
+            stream_results=True).yield_per(STREAM_BATCH_SIZE)
+        return iter(query)
+
+    def _next_routes_batch(self, rows):
+        return list(itertools.islice(rows, STREAM_BATCH_SIZE))
+
+    def _parse_filters(self):
+        self.filters = [
+            build(name, self.get_query_argument(name))
+            for name, build in sorted(SPATIAL_FILTERS.items())
+            if self.get_query_argument(name, None) is not None
+        ]
+
+    def _page_size(self):
+        value = self.get_query_argument('page[size]', None)
+        if value is None:
+            return DEFAULT_PAGE_SIZE
+        try:
+            size = int(value)
+        except ValueError:
+            size = 0
+        if not 0 < size <= MAX_PAGE_SIZE:
+            msg = 'page[size] must be an integer from 1 to %d.' % MAX_PAGE_SIZE
+            raise web.HTTPError(400, msg, msg)
+        return size
+
+    def _page_after(self):
+        cursor = self.get_query_argument('page[after]', None)
+        if cursor is None:
+            return None
+        try:
+            created, route_id = decode_cursor(
+                cursor, parse_timestamp, lambda value: str(uuid.UUID(value)))
+        except ValueError:
+            msg = 'Invalid page[after] cursor.'
+            raise web.HTTPError(400, msg, msg)
+        return created, route_id
+
+    def _page_url(self, cursor):
+        args = [(k, escape.to_unicode(v))
+                for k, values in sorted(self.request.query_arguments.items())
+                for v in values if k != 'page[after]']
+        args.append(('page[after]', cursor))
+        return '%s://%s%s?%s' % (self.request.protocol, self.request.host,
+                                 self.request.path, urlencode(args))
+
+    def _streaming(self):
+        return self.get_query_argument('stream', 'false').lower() in (
+            '1', 'true')
+
+    async def _stream_routes(self, after):
+        rows = await self.run_db(self._open_routes_stream, after)
+        schema = self._output_schema(many=True)
+        separator = ''
+        self.write('{"data": [')
+        while True:
+            batch = await self.run_db(self._next_routes_batch, rows)
+            if not batch:
+                break
+            with self.stage('serialize'):
+                fragments = Fragments()
+                output = schema.dump(schema.stash_geojson(
+                    [row_to_dict(r) for r in batch], fragments))
+                chunk = ', '.join(escape.json_encode(item)
+                                  for item in output.data['data'])
+                chunk = fragments.splice(chunk)
+            self.write(separator + chunk)
+            separator = ', '
+            await self.flush()
+        self.finish(']}')
+
+    async def _get_routes_page(self, after):
+        size = self._page_size()
+        # One extra row tells whether there is a next page
+        rows = await self.run_db(self._get_routes, size + 1, after)
+        next_url = None
+        if len(rows) > size:
+            rows = rows[:size]
+            last = rows[-1]
+            next_url = self._page_url(
+                encode_cursor(last.created.isoformat(), last.id))
+
+        with self.stage('serialize'):
+            fragments = Fragments()
+            schema = self._output_schema(many=True)
+            result = schema.dump(schema.stash_geojson(
+                [row_to_dict(r) for r in rows], fragments)).data
+            result['links'] = {'next': next_url}
+            output = fragments.splice(escape.json_encode(result))
+        self.finish(output)
+
+    def _finish_route(self, row):
+        with self.stage('serialize'):
+            fragments = Fragments()
+            schema = self._output_schema()
+            output = schema.dumps(schema.stash_geojson(row_to_dict(row),
+                                                       fragments))
+            output = fragments.splice(output.data)
+        self.finish(output)
+        return output
+
+    def _create_route(self, values, idempotency_key=None):
+        values['idempotency_key'] = idempotency_key
+        statement = Route.__table__.insert().values(values).returning(
+            *self._route_columns())
+        try:
+            row = self.db.execute(statement).first()
+            self.db.commit()
+            return row
+        except IntegrityError:
+            self.db.rollback()
+            if idempotency_key is None:
+                raise
+            # A retry of a request that has already created the route
+            row = self._route_query().filter(
+                Route.idempotency_key == idempotency_key).first()
+            if row is None:
+                raise
+            return row
+
+    def _delete_route(self, route_id):
+        try:
+            route = self.db.query(Route).filter(Route.id == route_id).one()
+        except MultipleResultsFound:
+            msg = 'Multiple results for unique ID is founded.'
+            raise web.HTTPError(400, msg, msg)
+        except NoResultFound:
+            msg = 'Route with ID %s is not found.' % route_id
+            raise web.HTTPError(404, msg, msg)
+        self.db.delete(route)
+        self.db.commit()
+
+    async def get(self, route_id=None):
+        with self.stage('parse'):
+            self._parse_output_options()
+            if not route_id:
+                self._parse_filters()
+                after = self._page_after()
+        if not route_id:
+            # Read before the routes, so the ETag is never newer than them
+            version, modified = await self.run_db(
+                self._get_collection_version)
+            self._set_cache_headers(self._etag(version, self.request.uri),
+                                    modified, COLLECTION_CACHE_CONTROL)
+            if self._not_modified(modified):
+                self._finish_not_modified()
+            elif self._streaming():
+                await self._stream_routes(after)
+            else:
+                await self._get_routes_page(after)
+            return
+
+        route_id = route_id.lower()
+        encoding = self._stored_encoding()
+        if encoding is not None:
+            created, body = await self.run_db(self._get_route_body, route_id,
+                                              encoding)
+            self._set_route_cache_headers(route_id, created)
+            if self._not_modified(created):
+                self._finish_not_modified()
+                return
+            if body is not None:
+                self.set_header('Content-Encoding', encoding)
+                self.finish(body)
+                return
+        elif (self.request.headers.get('If-None-Match') or
+                self.request.headers.get('If-Modified-Since')):
+            # Answer revalidation without building the representation
+            created = await self.run_db(self._get_route_created, route_id)
+            self._set_route_cache_headers(route_id, created)
+            if self._not_modified(created):
+                self._finish_not_modified()
+                return
+
+        result = await self.run_db(self._get_route, route_id)
+        self._set_route_cache_headers(route_id, result.created)
+        output = self._finish_route(result)
+        if encoding is not None:
+            # Routes imported in bulk get their documents stored on first read
+            IOLoop.current().spawn_callback(self._store_route_body, route_id,
+                                            output)
+
+    async def _directions_route_values(self, data):
+        store = self.application.directions_results
+        result = None
+        if store is not None:
+            result = await store.get(data['directions_token'])
+        if result is None:
+            msg = 'directions-token is unknown or has expired.'
+            raise web.HTTPError(400, msg, msg)
+        result.update((k, v) for k, v in data.items()
+                      if k in ('origin_name', 'destination_name', 'created'))
+        return directions_route_values(result)
 
     async def post(self):
         try:
-            args = RouteInputSchema().load(
-                escape.json_decode(self.request.body))
+            with self.stage('parse'):
+                document = escape.json_decode(self.request.body)
+                by_token = is_directions_reference(document)
+                if by_token:
+                    args = DirectionsReferenceSchema().load(document)
+                else:
+                    values = route_values(load_route_input(document))
         except ValidationError as e:
             raise web.HTTPError(400, escape.json_encode(e.messages),
-                                e.messages)
-        route_id = uuid.uuid4()
-        data = args.data
-        new_route = Route(
-            id=str(route_id),
-            origin=func.ST_GeomFromGeoJSON(escape.json_encode(data['origin'])),
-            origin_name=data['origin_name'],
-            destination=func.ST_GeomFromGeoJSON(
-                escape.json_encode(data['destination'])),
-            destination_name=data['destination_name'],
-            polyline=func.ST_GeomFromGeoJSON(escape.json_encode(data['polyline'])),
-            bounds=data.get('bounds'),
-            created=data.get('created') or datetime.utcnow()
-        )
-        self.db.add(new_route)
-        self.db.commit()
-
-        new_route_from_db = self._route_query().filter(
-            Route.id == str(route_id)).one()
-        schema = RouteOutputSchema()
-        output = schema.dumps(row_to_dict(new_route_from_db))
-        self.finish(output.data)
+                                {'errors': error_objects(e.messages)})
+        except IncorrectTypeError as e:
+            raise web.HTTPError(409, e.detail,
+                                {'errors': error_objects(e.messages, 409)})
+        idempotency_key = self.request.headers.get('Idempotency-Key')
+        if idempotency_key is not None and not (
+                0 < len(idempotency_key) <= MAX_IDEMPOTENCY_KEY_LENGTH):
+            msg = ('Idempotency-Key must be 1 to %d characters long.' %
+                   MAX_IDEMPOTENCY_KEY_LENGTH)
+            raise web.HTTPError(400, msg, msg)
+        if by_token:
+            # The geometry stays on the server, it doesn't cross the wire
+            values = await self._directions_route_values(args.data)
+        new_route_from_db = await self.run_db(self._create_route, values,
+                                              idempotency_key)
+        # The response is the default representation, which GET serves
+        # from the stored compressed documents
+        output = self._finish_route(new_route_from_db)
+        if self.application.compress_responses:
+            IOLoop.current().spawn_callback(
+                self._store_route_body, new_route_from_db.id, output)
 
     async def options(self, *args, **kwargs):
         self.finish()
@@ -135,16 +845,133 @@ class RoutesHandler(BaseHandler):
         if not route_id:
             msg = 'Delete all routes is not allowed. Pass route ID to DELETE.'
             raise web.HTTPError(400, msg, msg)
+        else:
+            await self.run_db(self._delete_route, route_id)
+            self.set_status(204)
+            self.finish()
+
+
+@web.stream_request_body
+class RoutesBulkHandler(RoutesHandler):
+    """
+    Imports many routes at once, as a JSON:API document with a ``data``
+    array or as NDJSON with a JSON:API document per line. NDJSON is
+    validated and written in batches while the body is being received.
+    Invalid items are reported in ``meta.errors`` and don't abort the rest.
+    """
+    SUPPORTED_METHODS = ('POST', 'OPTIONS')
+
+    def prepare(self):
+        super(RoutesBulkHandler, self).prepare()
+        content_type = self.request.headers.get('Content-Type', '')
+        self.ndjson = content_type.split(';')[0].strip() in NDJSON_TYPES
+        self.request.connection.set_max_body_size(
+            BULK_NDJSON_MAX_BODY_SIZE if self.ndjson else BULK_MAX_BODY_SIZE)
+        self._chunks = []
+        self._count = 0
+        self._pending = []
+        self.created = []
+        self.errors = []
+        self.failed = 0
+
+    async def data_received(self, chunk):
+        if not self.ndjson:
+            self._chunks.append(chunk)
+            return
+        lines = (b''.join(self._chunks) + chunk).split(b'\n')
+        self._chunks = [lines.pop()]
+        for line in lines:
+            self._add_line(line)
+        if len(self._pending) >= BULK_BATCH_SIZE:
+            await self._write_pending()
+
+    def _add_error(self, index, messages, status=400):
+        self.failed += 1
+        self.errors.extend(error_objects(messages, status,
+                                         '/data/%d' % index))
+
+    def _add_line(self, line):
+        if not line.strip():
+            return
+        try:
+            document = escape.json_decode(line)
+        except ValueError:
+            self._add_error(self._count, 'Invalid JSON.')
+            self._count += 1
+            return
+        if isinstance(document, dict) and 'data' not in document:
+            document = {'data': document}
+        self._add_item(document)
+
+    def _add_item(self, document):
+        index = self._count
+        self._count += 1
+        try:
+            data = load_route_input(document)
+        except ValidationError as e:
+            self._add_error(index, e.messages)
+            return
+        except IncorrectTypeError as e:
+            self._add_error(index, e.messages, 409)
+            return
+        self._pending.append((index, route_values(data)))
+
+    def _insert_batch(self, batch):
+        table = Route.__table__
+        try:
+            self.db.execute(table.insert().values([v for _, v in batch]))
+            self.db.commit()
+            return [(index, values['id'], None) for index, values in batch]
+        except DBAPIError:
+            self.db.rollback()
+
+        # Something in the batch was rejected, find out what row by row
+        results = []
+        for index, values in batch:
+            try:
+                with self.db.begin_nested():
+                    self.db.execute(table.insert().values(values))
+            except DBAPIError as e:
+                results.append((index, None, str(e.orig).strip()))
+            else:
+                results.append((index, values['id'], None))
+        self.db.commit()
+        return results
+
+    async def _write_pending(self):
+        pending, self._pending = self._pending, []
+        for i in range(0, len(pending), BULK_BATCH_SIZE):
+            results = await self.run_db(self._insert_batch,
+                                        pending[i:i + BULK_BATCH_SIZE])
+            for index, route_id, error in results:
+                if error:
+                    self._add_error(index, error)
+                else:
+                    self.created.append(route_id)
+
+    async def post(self):
+        body = b''.join(self._chunks)
+        if self.ndjson:
+            self._add_line(body)
         else:
             try:
-                route = self.db.query(Route).filter(Route.id == route_id).one()
-            except MultipleResultsFound:
-                msg = 'Multiple results for unique ID is founded.'
+                items = escape.json_decode(body)['data']
+            except (ValueError, TypeError, KeyError):
+                items = None
+            if not isinstance(items, list):
+                msg = 'Body must be a JSON:API document with a data array.'
                 raise web.HTTPError(400, msg, msg)
-            except NoResultFound:
-                msg = 'Route with ID %s is not found.' % route_id
-                raise web.HTTPError(404, msg, msg)
-            self.db.delete(route)
-            self.db.commit()
-            self.set_status(204)
-            self.finish()
\ No newline at end of file
+            for item in items:
+                self._add_item({'data': item})
+        await self._write_pending()
+
+        errors = JSONAPIErrorsSchema().dump({'errors': self.errors}).data
+        self.finish(escape.json_encode({
+            'data': [{'type': 'routes', 'id': route_id}
+                     for route_id in self.created],
+            'meta': {
+                'created': len(self.created),
+                'failed': self.failed,
+                'errors': errors['errors'],
+            },
+        }))
@@ -1,26 +1,245 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean
+from sqlalchemy import Column, Integer, Float, String, Text, DateTime, \
+    Boolean, Index, BigInteger, DDL, ForeignKey, LargeBinary, event, func, \
+    text
 from sqlalchemy.dialects import postgresql
 from sqlalchemy.ext.declarative import declarative_base
-from geoalchemy2 import Geography
+from geoalchemy2 import Geography, Geometry
 
 Base = declarative_base()
 
+# Zoom levels with simplified polylines stored at insert time
+SIMPLIFIED_ZOOM_LEVELS = (6, 10, 14)
+
+
+def simplify_tolerance(zoom):
+    """ST_SimplifyPreserveTopology tolerance in degrees for a zoom level,
+    about half a pixel of a 256px map tile at the equator"""
+    return 180.0 / (256 * 2 ** zoom)
+
 
 def init_db(engine):
     Base.metadata.create_all(bind=engine)
 
 
+def _add_column_if_missing(table, column, definition):
+    """PL/pgSQL adding a column to an existing table, PostgreSQL 9.5 has no
+    ADD COLUMN IF NOT EXISTS"""
+    return '''
+    IF NOT EXISTS (SELECT 1 FROM information_schema.columns
+                   WHERE table_schema = current_schema()
+                   AND table_name = '%s' AND column_name = '%s') THEN
+        ALTER TABLE %s ADD COLUMN %s %s;
+    END IF;''' % (table, column, table, column, definition)
+
+
+# create_all() skips existing tables, so columns and indexes added to the
+# route table since it was first created are added to it here. Registered
+# first, the triggers and the backfill below rely on them.
+ROUTE_UPGRADE = DDL('''
+DO $$
+BEGIN%s
+END
+$$;
+CREATE INDEX IF NOT EXISTS ix_route_created_id ON route (created, id);
+CREATE INDEX IF NOT EXISTS idx_route_bbox ON route USING gist (bbox);
+CREATE INDEX IF NOT EXISTS idx_route_waypoints ON route
+USING gist (waypoints);
+''' % ''.join([
+    _add_column_if_missing('route', 'bbox', 'geometry(GEOMETRY, 4326)'),
+] + [
+    # Routes stored before these existed are served the full polyline
+    _add_column_if_missing('route', 'polyline_z%d' % zoom,
+                           'geography(LINESTRING)')
+    for zoom in SIMPLIFIED_ZOOM_LEVELS
+] + [
+    _add_column_if_missing('route', 'idempotency_key',
+                           'varchar(255) UNIQUE'),
+    # Waypoints used to be an array of points
+    '''
+    IF EXISTS (SELECT 1 FROM information_schema.columns
+               WHERE table_schema = current_schema()
+               AND table_name = 'route' AND column_name = 'waypoints'
+               AND data_type = 'ARRAY') THEN
+        ALTER TABLE route ALTER COLUMN waypoints TYPE geography(MULTIPOINT)
+        USING CASE WHEN cardinality(waypoints) > 0 THEN
+            geography(ST_Multi(ST_Collect(waypoints::geometry[]))) END;
+    END IF;''',
+]))
+event.listen(Base.metadata, 'after_create', ROUTE_UPGRADE)
+
+
+# Every statement changing the route table adds a collection change. Only
+# inserting, writers never wait for each other's row locks, and a change
+# is visible exactly when the statement's rows are. The trigger is
+# (re)created after create_all(), so existing databases get it as well.
+ROUTE_VERSION_TRIGGER = DDL('''
+CREATE OR REPLACE FUNCTION bump_route_version() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO collection_change (name, changed)
+    VALUES ('route', clock_timestamp());
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+DROP TRIGGER IF EXISTS route_version ON route;
+CREATE TRIGGER route_version
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON route
+FOR EACH STATEMENT EXECUTE PROCEDURE bump_route_version();
+''')
+event.listen(Base.metadata, 'after_create', ROUTE_VERSION_TRIGGER)
+
+
+# Simplified polylines and the bounding box are derived from the polyline
+# by the database, so an INSERT sends and parses the geometry only once.
+# Values given in the INSERT are kept.
+ROUTE_DERIVED_COLUMNS_TRIGGER = DDL('''
+CREATE OR REPLACE FUNCTION route_derived_columns() RETURNS trigger AS $$
+BEGIN
+%s
+    NEW.bbox := coalesce(NEW.bbox, ST_Envelope(NEW.polyline::geometry));
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+DROP TRIGGER IF EXISTS route_derived_columns ON route;
+CREATE TRIGGER route_derived_columns
+BEFORE INSERT ON route
+FOR EACH ROW EXECUTE PROCEDURE route_derived_columns();
+''' % '\n'.join(
+    '    NEW.polyline_z%d := coalesce(NEW.polyline_z%d, geography('
+    'ST_SimplifyPreserveTopology(NEW.polyline::geometry, %r)));' % (
+        zoom, zoom, simplify_tolerance(zoom))
+    for zoom in SIMPLIFIED_ZOOM_LEVELS))
+event.listen(Base.metadata, 'after_create', ROUTE_DERIVED_COLUMNS_TRIGGER)
+
+# Routes stored before the bbox column existed get it on the next start.
+# The check first, so that nothing is written (and the collection version
+# kept) once they all have one.
+ROUTE_BBOX_BACKFILL = DDL('''
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM route WHERE bbox IS NULL
+               AND polyline IS NOT NULL) THEN
+        UPDATE route SET bbox = ST_Envelope(polyline::geometry)
+        WHERE bbox IS NULL AND polyline IS NOT NULL;
+    END IF;
+END
+$$;
+''')
+event.listen(Base.metadata, 'after_create', ROUTE_BBOX_BACKFILL)
+
+
 class Route(Base):
     __tablename__ = 'route'
+    __table_args__ = (
+        # Backs keyset pagination of GET /routes on (created, id)
+        Index('ix_route_created_id', 'created', 'id'),
+    )
 
     id = Column(postgresql.UUID(), nullable=False, primary_key=True)
     origin = Column(Geography(geometry_type='POINT'))
     origin_name = Column(String, nullable=False)
     destination = Column(Geography(geometry_type='POINT'))
     destination_name = Column(String, nullable=False)
-    waypoints = Column(postgresql.ARRAY(Geography(geometry_type='POINT')),
-                       nullable=True)
+    # Stops between origin and destination, the GiST index answers
+    # filter[stops-near]
+    waypoints = Column(Geography(geometry_type='MULTIPOINT'), nullable=True)
     waypoints_names = Column(postgresql.ARRAY(String), nullable=True)
     polyline = Column(Geography(geometry_type='LINESTRING'))
+    polyline_z6 = Column(Geography(geometry_type='LINESTRING',
+                                   spatial_index=False), nullable=True)
+    polyline_z10 = Column(Geography(geometry_type='LINESTRING',
+                                    spatial_index=False), nullable=True)
+    polyline_z14 = Column(Geography(geometry_type='LINESTRING',
+                                    spatial_index=False), nullable=True)
     bounds = Column(postgresql.JSON, nullable=True)
+    # Bounding box of the polyline with a GiST index, for bbox filters
+    bbox = Column(Geometry(srid=4326), nullable=True)
     created = Column(DateTime(timezone=True))
+    # Client supplied Idempotency-Key of the POST that created the route
+    idempotency_key = Column(String(255), nullable=True, unique=True)
+
+
+class RouteBody(Base):
+    """Default ``GET /routes/{id}`` document of a route, compressed once
+    and served as is"""
+    __tablename__ = 'route_body'
+
+    route_id = Column(postgresql.UUID(),
+                      ForeignKey('route.id', ondelete='CASCADE'),
+                      primary_key=True)
+    encoding = Column(String(16), primary_key=True)
+    body = Column(LargeBinary, nullable=False)
+
+
+class DirectionsCacheEntry(Base):
+    __tablename__ = 'directions_cache'
+
+    key = Column(String(40), primary_key=True)
+    value = Column(Text, nullable=False)
+    expires = Column(DateTime(timezone=True), nullable=False, index=True)
+
+
+class RateLimit(Base):
+    __tablename__ = 'rate_limit'
+
+    name = Column(String, primary_key=True)
+    # Theoretical arrival time of the next request, Unix time
+    tat = Column(Float, nullable=False)
+
+
+class CollectionVersion(Base):
+    """Version of a table's contents, for ETags of collection responses.
+    Changes since the last compaction are added to it, see
+    ``collection_version()``."""
+    __tablename__ = 'collection_version'
+
+    name = Column(String, primary_key=True)
+    version = Column(BigInteger, nullable=False)
+    modified = Column(DateTime(timezone=True), nullable=False,
+                      server_default=func.now())
+
+
+class CollectionChange(Base):
+    """Change of a table not yet compacted into its ``CollectionVersion``"""
+    __tablename__ = 'collection_change'
+
+    id = Column(BigInteger, primary_key=True)
+    name = Column(String, nullable=False)
+    changed = Column(DateTime(timezone=True), nullable=False,
+                     server_default=func.now())
+
+
+# One statement, so the version and the changes come from one snapshot
+SELECT_COLLECTION_VERSION = text('''
+SELECT coalesce(v.version, 0) + c.changes AS version,
+       greatest(v.modified, c.modified) AS modified
+FROM (SELECT count(*) AS changes, max(changed) AS modified
+      FROM collection_change WHERE name = :name) AS c
+LEFT JOIN collection_version AS v ON v.name = :name
+''')
+# DELETE ... RETURNING yields only rows this statement deleted, so
+# concurrent compactions never count a change twice
+COMPACT_COLLECTION_CHANGES = text('''
+WITH compacted AS (
+    DELETE FROM collection_change RETURNING name, changed
+)
+INSERT INTO collection_version (name, version, modified)
+SELECT name, count(*), max(changed) FROM compacted GROUP BY name
+ON CONFLICT (name) DO UPDATE
+SET version = collection_version.version + excluded.version,
+    modified = greatest(collection_version.modified, excluded.modified)
+''')
+
+
+def collection_version(connection, name):
+    """``(version, modified)`` of a table's contents, ``(0, None)`` before
+    its first change"""
+    row = connection.execute(SELECT_COLLECTION_VERSION,
+                             {'name': name}).first()
+    return row.version, row.modified
+
+
+def compact_collection_changes(engine):
+    """Folds collection changes into the versions, keeping the changes
+    ``collection_version()`` counts few"""
+    with engine.begin() as connection:
+        connection.execute(COMPACT_COLLECTION_CHANGES)
@@ -0,0 +1,29 @@
+import unittest
+
+from tornado import httputil
+from webargs.tornadoparser import parser
+
+from handlers.directions import DirectionsQuerySchema, \
+    _fast_directions_query, parse_directions_query
+
+QUERIES = [
+    'origin=50.45,30.52&destination=50.40,30.60',
+    'origin=50.45,30.52&destination=50.40,30.60&mode=walking&language=en'
+    '&waypoints=50.43,30.55&waypoints=50.42,30.57',
+    'origin=Kyiv&destination=%D0%9B%D1%8C%D0%B2%D1%96%D0%B2&backend=local'
+    '&optimize=true&waypoints=50.43,30.55',
+    'origin=50.45,30.52&destination=50.40,30.60&optimize=0&unknown=1',
+]
+
+
+class ParseDirectionsQueryTest(unittest.TestCase):
+    def test_fast_path_matches_webargs(self):
+        for query in QUERIES:
+            request = httputil.HTTPServerRequest(
+                method='GET', uri='/directions?' + query)
+            self.assertIsNotNone(
+                _fast_directions_query(request.query_arguments))
+            self.assertEqual(
+                parse_directions_query(request),
+                parser.parse(DirectionsQuerySchema, request,
+                             locations=('query',)))
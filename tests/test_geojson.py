@@ -0,0 +1,66 @@
+import json
+import unittest
+import uuid
+from datetime import datetime, timezone
+
+from core.geojson import Fragments, normalize
+from handlers.routes import RouteOutputSchema
+
+# Texts as ST_AsGeoJSON prints them
+TEXTS = [
+    '{"type":"Point","coordinates":[30.5234,50.4501]}',
+    '{"type":"Point","coordinates":[-0.1276,51.5072]}',
+    '{"type":"LineString","coordinates":[[-179.999999999999,-89.5],'
+    '[179.123456789012,89.99999]]}',
+    # Exponents
+    '{"type":"Point","coordinates":[1e-05,-2.5e-07]}',
+    '{"type":"LineString","coordinates":[[1e+16,0],[0,1]]}',
+    # Negative zero
+    '{"type":"Point","coordinates":[-0,0]}',
+    '{"type":"Point","coordinates":[12.5,-0]}',
+    '{"type":"Point","coordinates":[-0.0,0.0]}',
+    # Values below 1e-4
+    '{"type":"Point","coordinates":[0.00001,-0.000012345]}',
+    '{"type":"MultiPoint","coordinates":[[1,2],[0.00009,10.00001]]}',
+    '{"type":"Point","coordinates":[0.0001,30.00001]}',
+]
+
+
+class NormalizeTest(unittest.TestCase):
+    def test_matches_json_dumps(self):
+        for text in TEXTS:
+            self.assertEqual(normalize(text), json.dumps(json.loads(text)))
+
+
+class SpliceTest(unittest.TestCase):
+    def row(self, polyline):
+        return {
+            'id': str(uuid.uuid4()),
+            'origin': TEXTS[0],
+            'origin_name': 'Origin',
+            'destination': TEXTS[5],
+            'destination_name': 'Destination',
+            'waypoints': TEXTS[9],
+            'waypoints_names': ['First', 'Second'],
+            'polyline': polyline,
+            'bounds': None,
+            'created': datetime(2016, 5, 1, 12, 30, tzinfo=timezone.utc),
+        }
+
+    def test_same_bytes_as_schema(self):
+        for text in TEXTS[2:5] + TEXTS[9:]:
+            row = self.row(text)
+            fragments = Fragments()
+            schema = RouteOutputSchema()
+            output = schema.dumps(schema.stash_geojson(dict(row), fragments))
+            self.assertEqual(fragments.splice(output.data),
+                             RouteOutputSchema().dumps(dict(row)).data)
+
+    def test_missing_geometry(self):
+        row = self.row(TEXTS[2])
+        row['waypoints'] = row['waypoints_names'] = None
+        fragments = Fragments()
+        schema = RouteOutputSchema()
+        output = schema.dumps(schema.stash_geojson(dict(row), fragments))
+        self.assertEqual(fragments.splice(output.data),
+                         RouteOutputSchema().dumps(dict(row)).data)
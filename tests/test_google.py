@@ -0,0 +1,86 @@
+import googlemaps
+from tornado import gen, locks
+from tornado.testing import AsyncTestCase, gen_test
+
+from core.google import AsyncClient
+
+REQUESTS = 50
+
+
+class FakeBackendClient(AsyncClient):
+    """``AsyncClient`` answering from memory. Requests are held until
+    ``release`` is set, so concurrent calls overlap."""
+    def __init__(self, error=None):
+        super(FakeBackendClient, self).__init__(key='AIzaFakeTestKey')
+        self.error = error
+        self.release = locks.Event()
+        self.calls = []
+
+    async def _get(self, url, params, **kwargs):
+        self.calls.append((url, params))
+        await self.release.wait()
+        if self.error is not None:
+            raise self.error
+        if url.endswith('/directions/json'):
+            return {'routes': [{'summary': 'M06', 'legs': []}]}
+        return {'rows': [{'elements': [{'status': 'OK'}]}]}
+
+
+class SingleFlightTest(AsyncTestCase):
+    def lookups(self, client, count=REQUESTS, mode='driving'):
+        """Starts ``count`` identical lookups, then lets their requests
+        complete"""
+        client.release.clear()
+        futures = [gen.convert_yielded(client.directions(
+            '50.45,30.52', '50.40,30.60', mode=mode)) for _ in range(count)]
+        client.release.set()
+        return futures
+
+    @gen_test
+    async def test_identical_lookups_make_one_request(self):
+        client = FakeBackendClient()
+        results = await gen.multi(self.lookups(client))
+        self.assertEqual(len(client.calls), 1)
+        self.assertTrue(all(r == results[0] for r in results))
+        # Every caller may change its result without affecting the others
+        self.assertEqual(len(set(id(r) for r in results)), REQUESTS)
+        self.assertEqual(client._inflight, {})
+
+    @gen_test
+    async def test_different_lookups_are_not_shared(self):
+        client = FakeBackendClient()
+        client.release.clear()
+        futures = [gen.convert_yielded(client.directions(
+            '50.45,30.52', '50.40,30.60', mode=mode))
+            for mode in ('driving', 'driving', 'walking', 'walking')]
+        client.release.set()
+        await gen.multi(futures)
+        self.assertEqual(len(client.calls), 2)
+
+    @gen_test
+    async def test_lookup_after_completion_makes_new_request(self):
+        client = FakeBackendClient()
+        await gen.multi(self.lookups(client))
+        await gen.multi(self.lookups(client))
+        self.assertEqual(len(client.calls), 2)
+
+    @gen_test
+    async def test_error_is_raised_in_every_caller(self):
+        error = googlemaps.exceptions.ApiError('OVER_QUERY_LIMIT')
+        client = FakeBackendClient(error=error)
+        futures = self.lookups(client)
+        for future in futures:
+            with self.assertRaises(googlemaps.exceptions.ApiError):
+                await future
+        self.assertEqual(len(client.calls), 1)
+        self.assertEqual(client._inflight, {})
+
+    @gen_test
+    async def test_identical_matrix_lookups_make_one_request(self):
+        client = FakeBackendClient()
+        futures = [gen.convert_yielded(client.distance_matrix(
+            ['50.45,30.52'], ['50.40,30.60'])) for _ in range(REQUESTS)]
+        client.release.set()
+        results = await gen.multi(futures)
+        self.assertEqual(len(client.calls), 1)
+        self.assertEqual(len(set(id(r) for r in results)), REQUESTS)
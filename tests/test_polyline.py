@@ -0,0 +1,72 @@
+import random
+import unittest
+
+from core import polyline
+
+# Example of Google's encoded polyline algorithm documentation
+POINTS = [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]
+ENCODED = '_p~iF~ps|U_ulLnnqC_mqNvxq`@'
+
+
+class PolylineTest(unittest.TestCase):
+    def test_encode(self):
+        self.assertEqual(polyline.encode(POINTS), ENCODED)
+
+    def test_decode(self):
+        self.assertEqual(polyline.decode(ENCODED), POINTS)
+
+    def test_empty(self):
+        self.assertEqual(polyline.encode([]), '')
+        self.assertEqual(polyline.decode(''), [])
+        self.assertEqual(polyline.from_geojson([]), '')
+        self.assertEqual(polyline.to_geojson(''), [])
+
+    def test_zero_deltas(self):
+        points = [(0.0, 0.0), (0.0, 0.0), (1.5, -2.25), (1.5, -2.25)]
+        encoded = polyline.encode(points)
+        # A zero delta is a single '?' character
+        self.assertEqual(encoded[:2], '??')
+        self.assertEqual(polyline.decode(encoded), points)
+
+    def test_negative_deltas(self):
+        points = [(10.0, 20.0), (-10.0, -20.0), (-89.99999, -179.99999),
+                  (89.99999, 179.99999)]
+        self.assertEqual(polyline.decode(polyline.encode(points)), points)
+
+    def test_precision_rounding(self):
+        self.assertEqual(polyline.decode(polyline.encode([(1.234564, 0)])),
+                         [(1.23456, 0.0)])
+        self.assertEqual(polyline.decode(polyline.encode([(1.234566, 0)])),
+                         [(1.23457, 0.0)])
+        self.assertEqual(
+            polyline.decode(polyline.encode([(-1.234566, 0)])),
+            [(-1.23457, 0.0)])
+        self.assertEqual(
+            polyline.decode(polyline.encode([(1.2345666, 0)], 6), 6),
+            [(1.234567, 0.0)])
+
+    def test_round_trip(self):
+        rng = random.Random(1)
+        lng, lat = rng.uniform(-180, 180), rng.uniform(-85, 85)
+        coordinates = []
+        for _ in range(1000):
+            lng += rng.uniform(-0.001, 0.001)
+            lat += rng.uniform(-0.001, 0.001)
+            coordinates.append([lng, lat])
+        for precision in (5, 6):
+            decoded = polyline.to_geojson(
+                polyline.from_geojson(coordinates, precision), precision)
+            self.assertEqual(len(decoded), len(coordinates))
+            tolerance = 0.5 * 10 ** -precision + 1e-12
+            for (a, b), (c, d) in zip(coordinates, decoded):
+                self.assertLessEqual(abs(a - c), tolerance)
+                self.assertLessEqual(abs(b - d), tolerance)
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            polyline.decode('_p~iF ~ps|U')
+        # Truncated inside a value, and a latitude without longitude
+        with self.assertRaises(ValueError):
+            polyline.decode('_p~iF~ps|')
+        with self.assertRaises(ValueError):
+            polyline.decode('_p~iF')
@@ -0,0 +1,182 @@
+import json
+import unittest
+import uuid
+from unittest import mock
+
+from tornado.options import options
+from tornado.testing import AsyncHTTPTestCase
+
+import app
+from handlers import routes
+from handlers.routes import RouteInputSchema, _fast_route_input, \
+    load_route_input
+
+POINT = {'type': 'Point', 'coordinates': [30.52, 50.45]}
+ROUTE = {
+    'type': 'routes',
+    'attributes': {
+        'origin': POINT,
+        'origin-name': 'Origin',
+        'destination': POINT,
+        'destination-name': 'Destination',
+        'polyline': {'type': 'LineString',
+                     'coordinates': [[30.52, 50.45], [30.60, 50.40]]},
+    },
+}
+
+
+def route(**attributes):
+    return dict(ROUTE, attributes=dict(ROUTE['attributes'], **attributes))
+
+
+class LoadRouteInputTest(unittest.TestCase):
+    def test_fast_path_matches_schema(self):
+        coordinates = [[30.52 + i * 0.001, 50.45 - i * 0.001]
+                       for i in range(1000)]
+        documents = [
+            {'data': ROUTE},
+            {'data': route(polyline={'type': 'LineString',
+                                     'coordinates': coordinates})},
+            {'data': route(
+                waypoints={'type': 'MultiPoint',
+                           'coordinates': coordinates[1:3]},
+                **{'waypoints-names': ['First', 'Second']})},
+            # Members besides type and coordinates are dropped
+            {'data': route(origin=dict(POINT, bbox=[0, 0, 1, 1]),
+                           bounds={'northeast': {'lat': 1, 'lng': 2}})},
+        ]
+        for document in documents:
+            self.assertIsNotNone(_fast_route_input(document))
+            self.assertEqual(load_route_input(document),
+                             RouteInputSchema().load(document).data)
+
+
+class AppTestCase(AsyncHTTPTestCase):
+    def get_app(self):
+        with mock.patch.object(options.mockable(), 'google_maps_api_key',
+                               'AIzaFakeTestKey'):
+            self.application = app.make_app()
+        return self.application
+
+    def tearDown(self):
+        self.application.close()
+        super(AppTestCase, self).tearDown()
+
+    def post(self, path, document, content_type=None):
+        if content_type is None:
+            body = json.dumps(document)
+            headers = None
+        else:
+            body = '\n'.join(json.dumps(d) for d in document)
+            headers = {'Content-Type': content_type}
+        response = self.fetch(path, method='POST', body=body,
+                              headers=headers)
+        return response.code, json.loads(response.body.decode())
+
+
+class RouteErrorsTest(AppTestCase):
+    def assertErrorObjects(self, errors):
+        for error in errors:
+            self.assertEqual(set(error), {'status', 'source', 'detail'})
+            self.assertIsInstance(error['status'], int)
+            self.assertIsInstance(error['detail'], str)
+            self.assertIsInstance(error['source']['pointer'], str)
+
+    def test_single_route(self):
+        cases = [
+            ({'data': 1}, '/data', '`data` must be an object.'),
+            ([], '/data', '`data` must be an object.'),
+            ({'data': dict(ROUTE, attributes=[])}, '/data/attributes',
+             '`attributes` must be an object.'),
+            ({'data': route(polyline=POINT)}, '/data/attributes/polyline',
+             'Must be a GeoJSON LineString.'),
+        ]
+        for document, pointer, detail in cases:
+            code, body = self.post('/routes', document)
+            self.assertEqual(code, 400)
+            self.assertEqual(body, {'errors': [{
+                'status': 400, 'source': {'pointer': pointer},
+                'detail': detail}]})
+
+    def test_single_route_of_another_type(self):
+        code, body = self.post('/routes', {'data': dict(ROUTE, type='stops')})
+        self.assertEqual(code, 409)
+        self.assertEqual(body, {'errors': [{
+            'status': 409, 'source': {'pointer': '/data/type'},
+            'detail': 'Invalid type. Expected "routes".'}]})
+
+    def test_single_route_errors_of_several_fields(self):
+        code, body = self.post('/routes', {'data': route(
+            origin=None, created='yesterday')})
+        self.assertEqual(code, 400)
+        self.assertErrorObjects(body['errors'])
+        self.assertEqual(
+            sorted(e['source']['pointer'] for e in body['errors']),
+            ['/data/attributes/created', '/data/attributes/origin'])
+
+    def test_bulk(self):
+        items = [
+            1,
+            dict(ROUTE, attributes=[]),
+            route(polyline=POINT, created='yesterday'),
+            dict(ROUTE, type='stops'),
+        ]
+        code, body = self.post('/routes/bulk', {'data': items})
+        self.assertEqual(code, 200)
+        self.assertEqual(body['data'], [])
+        self.assertEqual(body['meta']['created'], 0)
+        self.assertEqual(body['meta']['failed'], 4)
+        errors = body['meta']['errors']
+        self.assertErrorObjects(errors)
+        self.assertEqual(
+            sorted((e['source']['pointer'], e['status']) for e in errors),
+            [('/data/0', 400),
+             ('/data/1/attributes', 400),
+             ('/data/2/attributes/created', 400),
+             ('/data/2/attributes/polyline', 400),
+             ('/data/3/type', 409)])
+
+    def test_bulk_ndjson(self):
+        body = b'{"data": 1}\nnot json\n'
+        response = self.fetch('/routes/bulk', method='POST', body=body,
+                              headers={'Content-Type': 'application/x-ndjson'})
+        meta = json.loads(response.body.decode())['meta']
+        self.assertErrorObjects(meta['errors'])
+        self.assertEqual(meta['errors'], [
+            {'status': 400, 'source': {'pointer': '/data/0'},
+             'detail': '`data` must be an object.'},
+            {'status': 400, 'source': {'pointer': '/data/1'},
+             'detail': 'Invalid JSON.'},
+        ])
+
+
+def insert_batch(handler, batch):
+    return [(index, values['id'], None) for index, values in batch]
+
+
+@mock.patch.object(routes.RoutesBulkHandler, '_insert_batch', insert_batch)
+class BulkImportTest(AppTestCase):
+    def documents(self, count):
+        return [{'data': route(**{'origin-name': 'Origin %d' % i})}
+                for i in range(count)]
+
+    def assertCreated(self, body, count):
+        self.assertEqual(body['meta'], {'created': count, 'failed': 0,
+                                        'errors': []})
+        self.assertEqual(len(body['data']), count)
+        for resource in body['data']:
+            uuid.UUID(resource['id'])
+
+    def test_json_api(self):
+        count = routes.BULK_BATCH_SIZE + 10
+        code, body = self.post('/routes/bulk', {'data': [
+            d['data'] for d in self.documents(count)]})
+        self.assertEqual(code, 200)
+        self.assertCreated(body, count)
+
+    def test_ndjson(self):
+        count = routes.BULK_BATCH_SIZE * 2 + 1
+        code, body = self.post('/routes/bulk', self.documents(count),
+                               content_type='application/x-ndjson')
+        self.assertEqual(code, 200)
+        self.assertCreated(body, count)
@@ -0,0 +1,27 @@
+import unittest
+
+from core.routing import RoadGraph
+
+
+class NearestTest(unittest.TestCase):
+    def test_nearest(self):
+        graph = RoadGraph()
+        a = graph.add_node(50.4501, 30.5234)
+        b = graph.add_node(50.4601, 30.5334)
+        self.assertEqual(graph.nearest(50.4502, 30.5235), a)
+        self.assertEqual(graph.nearest(50.4599, 30.5333), b)
+
+    def test_closer_node_in_the_next_ring(self):
+        # The point is in cell (1, 1), in its corner next to cell (2, 1).
+        # The first node found is at the far corner of cell (0, 0), one
+        # ring away, a closer one is in cell (3, 1), two rings away.
+        graph = RoadGraph()
+        graph.add_node(0.0001, 0.0001)
+        closer = graph.add_node(0.0301, 0.0199)
+        self.assertEqual(graph.nearest(0.0199, 0.0199), closer)
+
+    def test_none_nearby(self):
+        graph = RoadGraph()
+        graph.add_node(10.0, 10.0)
+        self.assertIsNone(graph.nearest(0.0, 0.0))
+        self.assertIsNone(RoadGraph().nearest(0.0, 0.0))
@@ -0,0 +1,51 @@
+import unittest
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from core.utils import encode_cursor, decode_cursor, parse_timestamp
+
+ROUTE_ID = '0f8b7c1e-3d2a-4b5c-8d9e-1a2b3c4d5e6f'
+
+
+def parse_uuid(value):
+    return str(uuid.UUID(value))
+
+
+class CursorTest(unittest.TestCase):
+    def test_round_trip(self):
+        created = datetime(2016, 5, 1, 12, 30, 15, 123000, timezone.utc)
+        cursor = encode_cursor(created.isoformat(), ROUTE_ID)
+        self.assertEqual(decode_cursor(cursor), [created.isoformat(),
+                                                 ROUTE_ID])
+        self.assertEqual(
+            decode_cursor(cursor, parse_timestamp, parse_uuid),
+            [created, ROUTE_ID])
+
+    def test_invalid_values(self):
+        for values in (['x', 'y'], ['2016-05-01T12:30:15', 'y'],
+                       ['2016-13-01T12:30:15', ROUTE_ID], [1, ROUTE_ID],
+                       ['2016-05-01T12:30:15'], []):
+            with self.assertRaises(ValueError):
+                decode_cursor(encode_cursor(*values), parse_timestamp,
+                              parse_uuid)
+
+    def test_invalid_encoding(self):
+        for cursor in ('%%%', 'eyJ4Ijog', encode_cursor()[:-1] + '{'):
+            with self.assertRaises(ValueError):
+                decode_cursor(cursor)
+
+
+class ParseTimestampTest(unittest.TestCase):
+    def test_isoformat(self):
+        for value in (datetime(2016, 5, 1, 12, 30, 15),
+                      datetime(2016, 5, 1, 12, 30, 15, 5),
+                      datetime(2016, 5, 1, tzinfo=timezone.utc),
+                      datetime(2016, 5, 1, 23, 59, 59, 999999, timezone(
+                          -timedelta(hours=3, minutes=30)))):
+            self.assertEqual(parse_timestamp(value.isoformat()), value)
+
+    def test_invalid(self):
+        for value in ('', '2016-05-01', '2016-05-01T25:00:00',
+                      '2016-05-01T12:30:15+99:00', '2016-05-01T12:30:15Z '):
+            with self.assertRaises(ValueError):
+                parse_timestamp(value)